@@ -0,0 +1,467 @@
+"""Asyncio server mode: the server.py routes on FastAPI/uvicorn.
+
+Every connection is a coroutine instead of an OS thread. Stream viewers
+share one AsyncFrameBroadcaster per stream mode, files go out through
+SendfileResponse, and blocking work (SQLite, thumbnails, camera, disk) runs
+on a small executor. Captures go to the capture service of frontend.py, in
+this process or in capture_daemon.py; Flask is not needed.
+
+    python3 async_server.py            # or: uvicorn async_server:app --port 8000
+"""
+import asyncio
+import contextlib
+import json
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import FastAPI, Request
+from fastapi.responses import (FileResponse, HTMLResponse, JSONResponse, RedirectResponse,
+                               Response, StreamingResponse)
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+import uvicorn
+
+import frontend
+from broadcaster import AsyncFrameBroadcaster
+from jobs import QueueFull
+from storage import StorageFull
+from passthrough import h264_chunks, h264_chunks_async
+from process_runner import runner
+
+# Blocking calls are kept off the event loop, on few threads
+executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="blocking")
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Opening the camera can take seconds; serve pages meanwhile
+    if not os.environ.get('ACTIONPI_CAPTURE_SOCKET'):
+        frontend.capture.start(background=True)
+    yield
+    executor.shutdown(wait=False)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.exception_handler(ConnectionError)
+async def capture_unavailable(request, e):
+    return JSONResponse({"error": str(e)}, status_code=503)
+
+
+def url_for(name, **values):
+    """Flask-style url_for for the shared template: unknown values become the query string."""
+    for route in app.routes:
+        if getattr(route, 'name', None) == name:
+            path_params = {k: v for k, v in values.items() if k in route.param_convertors}
+            query = {k: v for k, v in values.items() if k not in route.param_convertors}
+            url = app.url_path_for(name, **path_params)
+            return url + ('?' + urllib.parse.urlencode(query) if query else '')
+    raise KeyError(f"no route named {name}")
+
+
+templates = Environment(loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+                        autoescape=select_autoescape(['html']))
+templates.globals['url_for'] = url_for
+
+
+class SendfileResponse(FileResponse):
+    """FileResponse that hands the file descriptor to the server when it
+    supports the ASGI zero-copy send extension, so the kernel copies the
+    file to the socket (sendfile) without passing through Python.
+
+    Range requests and servers without the extension fall back to
+    FileResponse, which streams the file in chunks.
+    """
+
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get('extensions') or {}
+        if 'http.response.zerocopysend' not in extensions or 'range' in Request(scope).headers:
+            return await super().__call__(scope, receive, send)
+        stat = await run_blocking(os.stat, self.path)
+        self.set_stat_headers(stat)
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        with open(self.path, "rb") as f:
+            await send({"type": "http.response.zerocopysend", "file": f.fileno(),
+                        "count": stat.st_size, "more_body": False})
+
+
+def redirect_index(**query):
+    return RedirectResponse(url_for('index', **query), status_code=302)
+
+
+# Streams
+
+async_broadcasters = {}
+
+async def get_async_broadcaster(mode):
+    """One AsyncFrameBroadcaster per stream mode, over the capture service's thread broadcaster."""
+    if mode not in async_broadcasters:
+        # May open and warm up the camera, or ask the daemon over its socket
+        broadcaster = await run_blocking(frontend.capture.broadcaster, mode)
+        if broadcaster is None:
+            return None
+        if mode in async_broadcasters:
+            return async_broadcasters[mode]  # made by another request meanwhile
+        if mode == 'h264':
+            async_broadcasters[mode] = AsyncFrameBroadcaster(broadcaster, ring_size=256, reader=h264_chunks)
+        else:
+            async_broadcasters[mode] = AsyncFrameBroadcaster(broadcaster)
+        if not os.environ.get('ACTIONPI_CAPTURE_SOCKET'):
+            import capture_core
+            capture_core.telemetry.register(f'async_stream_{mode}', lambda b=async_broadcasters[mode]: {
+                "frames_published_total": b.seq,
+                "frames_dropped_total": b.frames_dropped,
+                "clients": b.clients,
+            })
+    return async_broadcasters[mode]
+
+
+@app.get('/stream')
+async def stream(mode: str = 'software'):
+    """Streams the camera images as a multipart HTTP response (see server.stream)."""
+    if mode not in frontend.STREAM_MODES:
+        return Response(f"Unknown stream mode {mode}", status_code=400)
+    broadcaster = await get_async_broadcaster(mode)
+    if broadcaster is None:
+        return Response(status_code=503)
+    if mode == 'h264':
+        return StreamingResponse(h264_chunks_async(broadcaster), media_type='video/h264')
+    return StreamingResponse(broadcaster.mjpeg(), media_type='multipart/x-mixed-replace; boundary=frame')
+
+
+@app.get('/stream_stats')
+async def stream_stats():
+    return {mode: broadcaster.stats() for mode, broadcaster in async_broadcasters.items()}
+
+
+# Gallery
+
+def render_index():
+    frontend.media_index.reconcile()
+    return templates.get_template('index.html').render(
+        counts=frontend.media_index.counts(), page_size=frontend.PAGE_SIZE,
+        temperature=frontend.cpu_temperature(), disk_space=frontend.capture.disk_usage())
+
+
+@app.get('/', response_class=HTMLResponse)
+async def index():
+    return HTMLResponse(await run_blocking(render_index))
+
+
+@app.get('/api/media')
+async def api_media(kind: str = None, offset: int = 0, limit: int = frontend.PAGE_SIZE):
+    kind = kind or None
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), 500)
+    if kind is not None and kind not in frontend.DIRECTORIES:
+        return JSONResponse({"error": f"unknown kind {kind}"}, status_code=400)
+
+    def page():
+        frontend.media_index.reconcile()
+        return {
+            "items": frontend.media_index.page(kind, offset, limit),
+            "offset": offset,
+            "limit": limit,
+            "total": frontend.media_index.count(kind),
+        }
+
+    return await run_blocking(page)
+
+
+@app.get('/thumbnail/{filepath:path}')
+async def thumbnail(filepath: str):
+    """Thumbnail of a photo, video or timelapse, generated on first request."""
+    if not frontend.valid_media_path(filepath):
+        return Response(status_code=404)
+    try:
+        data = await run_blocking(frontend.thumbnail_cache.get, filepath)
+    except Exception as e:
+        print(f"Thumbnail for {filepath} failed: {e}")
+        return Response(status_code=404)
+    return Response(data, media_type='image/jpeg', headers={'Cache-Control': 'max-age=86400'})
+
+
+@app.post('/delete')
+async def delete(request: Request):
+    filepath = (await request.form())['filepath']
+    if not await run_blocking(frontend.delete_media, filepath):
+        return JSONResponse({"error": "invalid path"}, status_code=400)
+    return redirect_index()
+
+
+@app.post('/delete_all/{directory}')
+async def delete_all(directory: str):
+    if directory not in frontend.DIRECTORIES:
+        return JSONResponse({"error": "invalid directory"}, status_code=400)
+    await run_blocking(frontend.delete_all_media, directory)
+    return redirect_index()
+
+
+# Capture jobs, on the capture service's job queue
+
+async def submit_job(request, kind, **params):
+    """Queue a capture and answer with its job id (JSON) or go back to the index (browser)."""
+    try:
+        job = await run_blocking(lambda: frontend.capture.submit(kind, **params))
+    except QueueFull as e:
+        return JSONResponse({"error": f"camera busy: {e}"}, status_code=429)
+    except StorageFull as e:
+        return JSONResponse({"error": f"not enough space: {e}"}, status_code=507)
+    if 'text/html' in request.headers.get('accept', ''):
+        return redirect_index(job=job["id"])
+    return JSONResponse({"job_id": job["id"], "status": job["status"]}, status_code=202)
+
+
+@app.get('/jobs')
+async def list_jobs():
+    return await run_blocking(frontend.capture.jobs)
+
+
+@app.api_route('/jobs/{job_id}', methods=['GET', 'DELETE'])
+async def job_status(request: Request, job_id: int):
+    if request.method == 'DELETE':
+        job = await run_blocking(frontend.capture.cancel, job_id)
+    else:
+        job = await run_blocking(frontend.capture.job, job_id)
+    if job is None:
+        return JSONResponse({"error": "unknown job"}, status_code=404)
+    return job
+
+
+@app.post('/jobs/{job_id}/cancel')
+async def cancel_job(job_id: int):
+    if await run_blocking(frontend.capture.cancel, job_id) is None:
+        return JSONResponse({"error": "unknown job"}, status_code=404)
+    return redirect_index()
+
+
+@app.get('/start_photo_capture')
+async def start_photo_capture(request: Request):
+    return await submit_job(request, 'photo')
+
+
+@app.get('/arm_burst')
+async def arm_burst():
+    stats = await run_blocking(frontend.capture.arm_burst)
+    if stats is None:
+        return JSONResponse({"error": "no camera"}, status_code=503)
+    return stats
+
+
+@app.get('/disarm_burst')
+async def disarm_burst():
+    return await run_blocking(frontend.capture.disarm_burst)
+
+
+@app.get('/start_burst')
+async def start_burst(request: Request, count: int = 10):
+    count = min(max(count, 0), frontend.BURST_MAX_FRAMES)
+    return await submit_job(request, 'burst', count=count)
+
+
+@app.get('/stop_burst')
+async def stop_burst():
+    await run_blocking(frontend.capture.cancel_kind, 'burst')
+    return redirect_index()
+
+
+@app.get('/arm_preroll')
+async def arm_preroll():
+    try:
+        return await run_blocking(frontend.capture.arm_preroll)
+    except (OSError, RuntimeError) as e:
+        return JSONResponse({"error": f"no encoder for the pre-roll: {e}"}, status_code=503)
+
+
+@app.get('/disarm_preroll')
+async def disarm_preroll():
+    return await run_blocking(frontend.capture.disarm_preroll)
+
+
+@app.get('/start_video_capture')
+async def start_video_capture(request: Request, duration: int = 1):
+    return await submit_job(request, 'video', duration=duration)
+
+
+@app.get('/start_motion')
+async def start_motion(request: Request, action: str = 'photo', threshold: int = 20, area: float = 0.005,
+                       roi: str = '', cooldown: float = 10, fps: float = 4):
+    try:
+        stats = await run_blocking(lambda: frontend.capture.start_motion(
+            action=action, pixel_threshold=threshold, min_area=area, roi=roi or None,
+            cooldown=cooldown, fps=min(max(fps, 0.5), 15)))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    except (ImportError, RuntimeError) as e:
+        return JSONResponse({"error": f"motion detection unavailable: {e}"}, status_code=503)
+    if 'text/html' in request.headers.get('accept', ''):
+        return redirect_index()
+    return stats
+
+
+@app.get('/stop_motion')
+async def stop_motion(request: Request):
+    stats = await run_blocking(frontend.capture.stop_motion)
+    if 'text/html' in request.headers.get('accept', ''):
+        return redirect_index()
+    return stats
+
+
+@app.get('/motion')
+async def motion_status():
+    """Detector settings, cost per frame and recent triggers."""
+    return await run_blocking(frontend.capture.status, 'motion') or {"running": False}
+
+
+@app.get('/start_timelapse')
+async def start_timelapse(request: Request, interval: int = 1, duration: int = 1,
+                          video: int = 0, keep_frames: int = 1):
+    video = video == 1
+    return await submit_job(request, 'timelapse', interval=interval, duration=duration,
+                            video=video, keep_frames=keep_frames == 1 or not video)
+
+
+@app.get('/stop_timelapse')
+async def stop_timelapse():
+    await run_blocking(frontend.capture.cancel_kind, 'timelapse')
+    return redirect_index()
+
+
+# Downloads
+
+@app.get('/download/{filepath:path}')
+async def download(filepath: str):
+    if not frontend.valid_media_path(filepath):
+        return Response(status_code=404)
+    full_filepath = os.path.join(frontend.BASE_DIR, filepath)
+    if await run_blocking(os.path.isdir, full_filepath):
+        return zip_response(full_filepath, f"{os.path.basename(filepath)}.zip")
+    if not await run_blocking(os.path.isfile, full_filepath):
+        return Response(status_code=404)
+    return SendfileResponse(full_filepath, filename=os.path.basename(filepath))
+
+
+@app.get('/download_all/{directory}')
+async def download_all(directory: str):
+    if directory not in frontend.DIRECTORIES:
+        return Response(status_code=404)
+    return zip_response(os.path.join(frontend.BASE_DIR, directory), f"{directory}.zip")
+
+
+def zip_response(dir_path, output_filename):
+    """Send a directory as a zip built while it is sent; each chunk is read on a worker thread."""
+    from zipstream import walk_files, zip_chunks
+    return StreamingResponse(zip_chunks(walk_files(dir_path)), media_type='application/zip',
+                             headers={'Content-Disposition': f'attachment; filename="{output_filename}"'})
+
+
+# Status
+
+@app.get('/camera_session')
+async def camera_session():
+    """Current camera mode and how long recent mode switches took."""
+    stats = await run_blocking(frontend.capture.status, 'camera_session')
+    if stats is None:
+        return JSONResponse({"error": "no camera"}, status_code=503)
+    return stats
+
+
+@app.get('/cpu_temperature')
+async def cpu_temperature():
+    return Response(await run_blocking(frontend.cpu_temperature), media_type='text/html')
+
+
+@app.get('/startup')
+async def startup_status():
+    """Boot-to-ready milestones and recent trigger-to-file latencies."""
+    return await run_blocking(frontend.capture.status, 'startup')
+
+
+@app.get('/governor')
+async def governor_status():
+    """Current thermal level with its settings, and the recent level changes with their reasons."""
+    return await run_blocking(frontend.capture.status, 'governor')
+
+
+@app.get('/metrics')
+async def metrics():
+    """Latest telemetry sample for Prometheus."""
+    return Response(await run_blocking(frontend.capture.metrics), media_type='text/plain; version=0.0.4')
+
+
+@app.get('/telemetry')
+async def telemetry_status(history: int = 0):
+    """Latest telemetry sample; ?history=N adds the last N samples for charts."""
+    return await run_blocking(frontend.capture.telemetry, history)
+
+
+@app.get('/telemetry/stream')
+async def telemetry_stream():
+    """Telemetry samples as Server-Sent Events, checked once a second."""
+
+    async def events():
+        seq = None
+        idle = 0.0
+        while True:
+            await asyncio.sleep(1.0)
+            sample = (await run_blocking(frontend.capture.telemetry))["latest"]
+            if sample is not None and seq is not None and sample["seq"] > seq:
+                idle = 0.0
+                yield f"id: {sample['seq']}\ndata: {json.dumps(sample)}\n\n"
+            else:
+                idle += 1.0
+                if idle >= 15:
+                    idle = 0.0
+                    yield ": keepalive\n\n"
+            if sample is not None:
+                seq = sample["seq"]
+
+    return StreamingResponse(events(), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.get('/disk_usage')
+async def disk_usage():
+    return await run_blocking(frontend.capture.disk_usage)
+
+
+@app.get('/storage')
+async def storage_status():
+    """Free space, quotas, running reservations and recently pruned media."""
+    return await run_blocking(frontend.capture.status, 'storage')
+
+
+@app.get('/sync')
+async def sync_status(now: bool = False):
+    """Offload target, progress and errors; ?now=1 starts a round right away."""
+    if now:
+        stats = await run_blocking(frontend.capture.sync_now)
+    else:
+        stats = await run_blocking(frontend.capture.status, 'sync')
+    return stats or {"enabled": False}
+
+
+@app.post('/shutdown')
+async def shutdown():
+    await run_blocking(lambda: runner.run(["sudo", "shutdown", "-h", "now"], timeout=30))
+    return redirect_index()
+
+
+@app.get('/processes')
+async def processes():
+    """Running external tools and exit status, wall/CPU time and peak RSS of recent ones."""
+    return await run_blocking(frontend.capture.status, 'processes')
+
+
+if __name__ == '__main__':
+    # One process, one event loop: every client is a coroutine on it
+    uvicorn.run(app, host='0.0.0.0', port=int(os.environ.get('ACTIONPI_PORT', 8000)),
+                workers=1, access_log=False)
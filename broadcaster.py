@@ -0,0 +1,411 @@
+import asyncio
+import collections
+import contextlib
+import io
+import threading
+import time
+
+
+class FrameRing:
+    """Fixed-size ring of encoded frames shared by every stream client."""
+
+    def __init__(self, size=4):
+        self.size = size
+        self._slots = [None] * size
+        self._seq = 0  # sequence number of the newest frame, 0 = no frame yet
+        self._cond = threading.Condition()
+
+    def put(self, frame):
+        """Store a new frame and wake up every waiting client."""
+        with self._cond:
+            self._seq += 1
+            self._slots[self._seq % self.size] = frame
+            self._cond.notify_all()
+            return self._seq
+
+    def latest(self, after=0, timeout=None):
+        """Return (seq, frame) of the newest frame newer than `after`.
+
+        Clients that fell behind skip straight to the newest frame instead
+        of replaying the backlog (drop-to-latest). Returns (after, None) on
+        timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > after, timeout):
+                return after, None
+            return self._seq, self._slots[self._seq % self.size]
+
+    def get(self, seq, timeout=None):
+        """Return the frame with sequence number `seq` for in-order readers.
+
+        Blocks until it has been produced. Returns None if it was already
+        overwritten, i.e. the reader fell more than a ring length behind.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq >= seq, timeout):
+                return b""
+            if self._seq - seq >= self.size:
+                return None
+            return self._slots[seq % self.size]
+
+    @property
+    def seq(self):
+        return self._seq
+
+
+class FakeCameraSource:
+    """Emits synthetic JPEG frames so the broadcaster runs without a Pi."""
+
+    def __init__(self, width=320, height=240, fps=10, frame_size=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.frame_size = frame_size  # fixed payload size, skips PIL entirely
+        self._count = 0
+        self._next = None
+
+    def start(self):
+        self._next = time.monotonic()
+
+    def stop(self):
+        pass
+
+    def _encode(self):
+        if self.frame_size is None:
+            try:
+                from PIL import Image, ImageDraw
+                img = Image.new("RGB", (self.width, self.height), (0, 40, 80))
+                x = (self._count * 4) % self.width
+                ImageDraw.Draw(img).rectangle([x, 0, x + 8, self.height], fill=(255, 255, 255))
+                stream = io.BytesIO()
+                img.save(stream, format="jpeg")
+                return stream.getvalue()
+            except ImportError:
+                self.frame_size = 16 * 1024
+        # Not a decodable image, but framed like one (SOI ... EOI)
+        body = b"%d" % self._count
+        return b"\xff\xd8" + body.ljust(self.frame_size - 4, b"\0") + b"\xff\xd9"
+
+    def read(self):
+        """Block until the next frame is due and return it encoded."""
+        self._next += 1.0 / self.fps
+        delay = self._next - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self._next = time.monotonic()
+        self._count += 1
+        return self._encode()
+
+
+class FrameBroadcaster:
+    """One capture thread encodes each frame once; any number of clients read it.
+
+    `max_fps` caps the published frame rate: sources that are pulled are
+    simply read less often, frames of pushed sources (`source.pushed`, e.g.
+    an encoder) that come too early are dropped. pause() stops the source
+    until resume(); clients stay connected and wait. With `idle_after` the
+    source is also stopped once no client has been connected for that many
+    seconds, and started again by the next one.
+    """
+
+    def __init__(self, source, ring_size=4, max_fps=None, idle_after=None):
+        self.source = source
+        self.ring = FrameRing(ring_size)
+        self.max_fps = max_fps
+        self.idle_after = idle_after
+        self.clients = 0
+        self._last_client = time.monotonic()
+        self.frames_captured = 0
+        self.frames_dropped = 0  # summed over all clients
+        self.frames_skipped = 0  # read from a pushed source but over max_fps
+        self.captured_at = [0.0] * ring_size  # wall-clock capture time per ring slot
+        self.read_ms = 0.0  # moving average of source.read(): waiting for, capturing and encoding a frame
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    @property
+    def paused(self):
+        return not self._resumed.is_set()
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    @contextlib.contextmanager
+    def client(self):
+        """Count one client while the block runs, starting the broadcaster if needed.
+
+        Every reader of the ring goes through this, or an idle_after
+        broadcaster stops its source under it.
+        """
+        self.start()
+        with self._lock:
+            self.clients += 1
+            self._last_client = time.monotonic()
+        try:
+            yield self.ring
+        finally:
+            with self._lock:
+                self.clients -= 1
+                self._last_client = time.monotonic()
+
+    @property
+    def idle(self):
+        """True while the source is stopped for lack of clients."""
+        return (self.idle_after is not None and self.clients == 0
+                and time.monotonic() - self._last_client > self.idle_after)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._running.set()
+            self._thread = threading.Thread(target=self._run, name="frame-broadcaster", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _run(self):
+        self.source.start()
+        source_running = True
+        pushed = getattr(self.source, 'pushed', False)
+        next_due = 0.0
+        try:
+            while self._running.is_set():
+                if not self._resumed.is_set() or self.idle:
+                    if source_running:
+                        self.source.stop()
+                        source_running = False
+                    # Short waits while idle, so a new client gets frames quickly
+                    self._resumed.wait(0.5 if self.paused else 0.05)
+                    continue
+                if not source_running:
+                    self.source.start()
+                    source_running = True
+                t0 = time.monotonic()
+                if self.max_fps and not pushed and t0 < next_due:
+                    time.sleep(min(next_due - t0, 0.5))
+                    continue
+                try:
+                    frame = self.source.read()
+                except Exception as e:
+                    print(f"Frame capture failed: {e}")
+                    time.sleep(0.5)
+                    continue
+                now = time.monotonic()
+                self.read_ms += ((now - t0) * 1000 - self.read_ms) * 0.1
+                if frame and self.max_fps:
+                    if pushed and now < next_due:
+                        self.frames_skipped += 1
+                        continue
+                    next_due += 1.0 / self.max_fps
+                    if next_due < now:
+                        next_due = now + 1.0 / self.max_fps
+                if frame:
+                    # Only this thread puts, so the next slot is known before the put
+                    self.captured_at[(self.ring.seq + 1) % self.ring.size] = time.time()
+                    self.ring.put(frame)
+                    self.frames_captured += 1
+        finally:
+            if source_running:
+                self.source.stop()
+
+    def frames(self, timeout=5.0):
+        """Yield the newest encoded frame for one client, skipping stale ones."""
+        for _, frame in self.timed_frames(timeout):
+            yield frame
+
+    def timed_frames(self, timeout=5.0):
+        """Like frames(), but yields (capture time, frame)."""
+        with self.client() as ring:
+            seq = ring.seq
+            while self.running:
+                new_seq, frame = ring.latest(after=seq, timeout=timeout)
+                if frame is None:
+                    continue
+                if seq and new_seq - seq > 1:
+                    self.frames_dropped += new_seq - seq - 1
+                seq = new_seq
+                yield self.captured_at[seq % ring.size], frame
+
+    def mjpeg(self):
+        """Multipart chunks for a /stream response.
+
+        The frame bytes are yielded as their own chunk so the shared buffer is
+        handed to the socket as-is instead of being concatenated per client.
+        Each part carries its length and capture time (X-Timestamp, Unix
+        seconds), so clients can measure delivery latency.
+        """
+        for captured_at, frame in self.timed_frames():
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n'
+                   b'X-Timestamp: %.6f\r\n\r\n' % (len(frame), captured_at))
+            yield frame
+            yield b'\r\n'
+
+    def stats(self):
+        return {
+            "clients": self.clients,
+            "frames_captured": self.frames_captured,
+            "frames_dropped": self.frames_dropped,
+            "frames_skipped": self.frames_skipped,
+            "max_fps": self.max_fps,
+            "paused": self.paused,
+            "idle": self.idle,
+            "read_ms": round(self.read_ms, 2),
+        }
+
+
+
+class AsyncFrameBroadcaster:
+    """Hands the frames of a FrameBroadcaster to asyncio clients.
+
+    One bridge thread reads the broadcaster and publishes every frame into a
+    small ring owned by the event loop. Clients are coroutines waiting on a
+    shared future, so a viewer costs no thread and no copy of the frame. The
+    bridge only runs while there are clients. `reader(broadcaster)` chooses
+    what is bridged: by default frames drop-to-latest with their capture
+    time; an H.264 stream passes passthrough.h264_chunks to keep every chunk.
+    """
+
+    def __init__(self, broadcaster, ring_size=4, reader=None, loop=None):
+        self.broadcaster = broadcaster
+        self.loop = loop or asyncio.get_running_loop()
+        self.seq = 0
+        self.clients = 0
+        self.frames_dropped = 0  # summed over all clients
+        self._ring = collections.deque(maxlen=ring_size)  # (seq, captured_at, frame)
+        self._reader = reader or (lambda b: b.timed_frames())
+        self._waiter = self.loop.create_future()
+        self._lock = threading.Lock()
+        self._bridge = None
+
+    def _publish(self, captured_at, frame):
+        # Runs on the event loop
+        self.seq += 1
+        self._ring.append((self.seq, captured_at, frame))
+        waiter, self._waiter = self._waiter, self.loop.create_future()
+        if not waiter.done():
+            waiter.set_result(None)
+
+    def _run_bridge(self):
+        items = self._reader(self.broadcaster)
+        try:
+            for item in items:
+                if not isinstance(item, tuple):
+                    item = (time.time(), item)
+                self.loop.call_soon_threadsafe(self._publish, *item)
+                with self._lock:
+                    if self.clients == 0:
+                        # Cleared here, not after close(): a client joining
+                        # meanwhile must start a bridge of its own
+                        self._bridge = None
+                        return
+        finally:
+            with self._lock:
+                if self._bridge is threading.current_thread():
+                    self._bridge = None
+            items.close()
+
+    def _join(self):
+        with self._lock:
+            self.clients += 1
+            if self._bridge is None:
+                self._bridge = threading.Thread(target=self._run_bridge, name="async-bridge", daemon=True)
+                self._bridge.start()
+
+    def _leave(self):
+        with self._lock:
+            self.clients -= 1
+
+    async def _wait_for(self, seq):
+        """Wait until frame `seq` has been published."""
+        while self.seq < seq:
+            # shield: a client going away must not cancel the future the others wait on
+            await asyncio.shield(self._waiter)
+
+    async def frames(self):
+        """Yield (capture time, frame) for one client, skipping to the newest frame."""
+        self._join()
+        try:
+            seq = self.seq
+            while True:
+                await self._wait_for(seq + 1)
+                new_seq, captured_at, frame = self._ring[-1]
+                if seq and new_seq - seq > 1:
+                    self.frames_dropped += new_seq - seq - 1
+                seq = new_seq
+                yield captured_at, frame
+        finally:
+            self._leave()
+
+    async def chunks(self):
+        """Yield every frame in order; None marks a gap after the client fell behind the ring."""
+        self._join()
+        try:
+            seq = self.seq + 1
+            while True:
+                await self._wait_for(seq)
+                oldest = self._ring[0][0]
+                if seq < oldest:
+                    self.frames_dropped += oldest - seq
+                    seq = oldest
+                    yield None
+                    continue
+                yield self._ring[seq - oldest][2]
+                seq += 1
+        finally:
+            self._leave()
+
+    async def mjpeg(self):
+        """Multipart chunks for a /stream response, like FrameBroadcaster.mjpeg()."""
+        async for captured_at, frame in self.frames():
+            yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n'
+                   b'X-Timestamp: %.6f\r\n\r\n' % (len(frame), captured_at))
+            yield frame
+            yield b'\r\n'
+
+    def stats(self):
+        return {
+            "clients": self.clients,
+            "frames_published": self.seq,
+            "frames_dropped": self.frames_dropped,
+        }
+
+
+if __name__ == '__main__':
+    # Quick load test on any Linux box: python3 broadcaster.py [clients] [seconds]
+    import sys
+    n_clients = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    broadcaster = FrameBroadcaster(FakeCameraSource(fps=30, frame_size=32 * 1024))
+    received = [0] * n_clients
+
+    def client(i):
+        t0 = time.monotonic()
+        for _ in broadcaster.frames():
+            received[i] += 1
+            if time.monotonic() - t0 > seconds:
+                break
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    broadcaster.stop()
+    print(broadcaster.stats())
+    print(f"frames per client: min {min(received)}, max {max(received)}")
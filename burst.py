@@ -0,0 +1,299 @@
+import collections
+import io
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from camera_session import MockPicamera2
+
+BURST_NAME = "{prefix}_{index:04d}.jpg"
+
+# Picamera2 RGB formats -> (Pillow raw mode, bytes per pixel)
+RAW_MODES = {
+    "BGR888": ("RGB", 3),
+    "RGB888": ("BGR", 3),
+    "XBGR8888": ("RGBX", 4),
+    "XRGB8888": ("BGRX", 4),
+}
+
+
+class RawGrabber:
+    """Copies raw frames of a running Picamera2 stream into ring slots; encodes them with Pillow.
+
+    The copy out of the camera buffer is all that happens on the capture
+    thread, so the camera buffer goes back to libcamera right away and the
+    JPEG encode runs in the pool.
+    """
+
+    def __init__(self, picam2, stream="main"):
+        config = picam2.stream_configuration(stream)
+        if config.get("format") not in RAW_MODES:
+            raise ValueError(f"burst needs an RGB {stream} stream, not {config.get('format')}")
+        self.picam2 = picam2
+        self.stream = stream
+        self.size = tuple(config["size"])
+        self.rawmode, self.channels = RAW_MODES[config["format"]]
+        self.frame_bytes = self.size[0] * self.size[1] * self.channels
+
+    def grab(self, buffer):
+        import numpy as np
+        from picamera2 import MappedArray
+        request = self.picam2.capture_request()
+        try:
+            with MappedArray(request, self.stream) as m:
+                if m.array.size != self.frame_bytes:
+                    raise RuntimeError("the camera was reconfigured since the burst was set up")
+                # Drops the row padding while copying into the preallocated slot
+                target = np.frombuffer(buffer, dtype=np.uint8, count=self.frame_bytes).reshape(m.array.shape)
+                np.copyto(target, m.array)
+        finally:
+            request.release()
+        return self.frame_bytes
+
+    def encode(self, data, quality):
+        from PIL import Image
+        stream = io.BytesIO()
+        img = Image.frombuffer("RGB", self.size, data, "raw", self.rawmode, self.size[0] * self.channels, 1)
+        img.save(stream, format="jpeg", quality=quality)
+        return stream.getvalue()
+
+
+class JpegGrabber:
+    """For cameras that only hand out JPEGs (the simulated one); frames are written as they are."""
+
+    def __init__(self, picam2):
+        self.picam2 = picam2
+        probe = io.BytesIO()
+        picam2.capture_file(probe, format="jpeg")
+        self.frame_bytes = len(probe.getvalue()) * 2
+
+    def grab(self, buffer):
+        stream = io.BytesIO()
+        self.picam2.capture_file(stream, format="jpeg")
+        data = stream.getvalue()
+        buffer[:len(data)] = data  # grows the slot if a frame is ever larger
+        return len(data)
+
+    def encode(self, data, quality):
+        return data
+
+
+def make_grabber(picam2):
+    return JpegGrabber(picam2) if isinstance(picam2, MockPicamera2) else RawGrabber(picam2)
+
+
+class Slot:
+    __slots__ = ("buffer", "length", "captured_at", "busy")
+
+    def __init__(self, size):
+        self.buffer = bytearray(size)
+        self.length = 0
+        self.captured_at = 0.0
+        self.busy = False  # waiting for or in the encode pool
+
+
+class BurstCapture:
+    """Captures stills as fast as the running camera delivers them.
+
+    Frames are copied into a ring of `ring_size` slots (ring_size *
+    grabber.frame_bytes of memory, about 9 MB per slot at 2028x1520 RGB),
+    and encoded and written by a pool of `workers` threads. If the pool falls
+    a whole ring behind, capturing waits for a free slot (counted in
+    `stalls`) instead of allocating more. `max_bytes` caps the ring, which
+    also caps the pre-trigger to leave two slots for new frames. The ring is
+    allocated when a burst starts or arm() is called, and freed again after
+    the burst or on disarm().
+
+    With `pre_trigger` K > 0, arm() keeps capturing into the ring before the
+    trigger; burst() then also saves the last K frames from before it.
+    """
+
+    def __init__(self, grabber, pre_trigger=0, ring_size=None, workers=2, quality=90, max_bytes=None):
+        self.grabber = grabber
+        self.quality = quality
+        ring_size = ring_size or pre_trigger + 2 * workers + 2
+        if max_bytes is not None:
+            ring_size = max(2, min(ring_size, max_bytes // grabber.frame_bytes))
+            pre_trigger = min(pre_trigger, ring_size - 2)
+        if ring_size <= pre_trigger:
+            raise ValueError("the ring must be larger than the pre-trigger")
+        self.pre_trigger = pre_trigger
+        self.ring_size = ring_size
+        self.slots = []  # allocated while in use
+        self.stalls = 0
+        self.encode_ms = 0.0  # moving average per frame
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="burst-encode")
+        self._history = collections.deque(maxlen=pre_trigger or 1)  # armed frames, oldest first
+        self._next = 0
+        self._cond = threading.Condition()
+        self._capture_lock = threading.Lock()  # one thread grabs at a time
+        self._armed = threading.Event()
+        self._arm_thread = None
+
+    @property
+    def armed(self):
+        return self._armed.is_set()
+
+    def _allocate(self):
+        with self._cond:
+            if not self.slots:
+                self.slots = [Slot(self.grabber.frame_bytes) for _ in range(self.ring_size)]
+                self._next = 0
+
+    def _free(self):
+        # Slots still being encoded are only dropped from the ring; they go
+        # away once their write is done
+        with self._cond:
+            self.slots = []
+            self._history.clear()
+
+    def _grab(self):
+        with self._cond:
+            slot = self.slots[self._next]
+            if slot.busy:
+                self.stalls += 1
+                self._cond.wait_for(lambda: not slot.busy)
+            self._next = (self._next + 1) % len(self.slots)
+            if slot in self._history:
+                self._history.remove(slot)
+        slot.length = self.grabber.grab(slot.buffer)
+        slot.captured_at = time.time()
+        return slot
+
+    def arm(self):
+        """Start filling the pre-trigger history."""
+        if not self.pre_trigger or self._armed.is_set():
+            return
+        self._allocate()
+        self._armed.set()
+        self._arm_thread = threading.Thread(target=self._run_armed, name="burst-armed", daemon=True)
+        self._arm_thread.start()
+
+    def disarm(self):
+        """Stop the pre-trigger and free the ring (unless a burst is using it)."""
+        self._stop_arming()
+        with self._capture_lock:
+            if not self.armed:
+                self._free()
+
+    def _stop_arming(self):
+        self._armed.clear()
+        if self._arm_thread is not None:
+            self._arm_thread.join()
+            self._arm_thread = None
+
+    def _run_armed(self):
+        while self._armed.is_set():
+            with self._capture_lock:
+                try:
+                    slot = self._grab()
+                except Exception as e:
+                    print(f"Burst pre-trigger capture failed: {e}")
+                    self._armed.clear()
+                    return
+                with self._cond:
+                    self._history.append(slot)
+
+    def _write(self, slot, path):
+        try:
+            t0 = time.monotonic()
+            data = self.grabber.encode(memoryview(slot.buffer)[:slot.length], self.quality)
+            with open(path, "wb") as f:
+                f.write(data)
+            self.encode_ms += ((time.monotonic() - t0) * 1000 - self.encode_ms) * 0.1
+        finally:
+            with self._cond:
+                slot.busy = False
+                self._cond.notify_all()
+
+    def burst(self, folder, prefix="burst", count=None, stop_event=None, held=None, max_frames=200):
+        """Save the pre-trigger frames (if armed) and then `count` new ones.
+
+        With count=None frames are taken until `stop_event` is set or held()
+        returns False (the button is released), at most `max_frames`. Returns
+        a summary with the written files, oldest first.
+        """
+        stop_event = stop_event or threading.Event()
+        trigger = time.time()
+        rearm = self.armed
+        self._stop_arming()  # the history stays; it is taken over below
+        with self._capture_lock:
+            self._allocate()
+            with self._cond:
+                pre = list(self._history)
+                self._history.clear()
+                for slot in pre:
+                    slot.busy = True
+            t0 = time.monotonic()
+            stalls = self.stalls
+            files, jobs = [], []
+
+            def submit(slot):
+                slot.busy = True
+                path = os.path.join(folder, BURST_NAME.format(prefix=prefix, index=len(files)))
+                files.append((path, slot.captured_at - trigger))
+                jobs.append(self._pool.submit(self._write, slot, path))
+
+            for slot in pre:
+                submit(slot)
+            taken = 0
+            while taken < (count if count is not None else max_frames):
+                if taken and (stop_event.is_set() or (held is not None and not held())):
+                    break
+                submit(self._grab())
+                taken += 1
+            seconds = time.monotonic() - t0
+        if rearm:
+            self.arm()
+        errors = [job.exception() for job in jobs if job.exception() is not None]
+        if not rearm:
+            with self._capture_lock:
+                if not self.armed:
+                    self._free()
+        for error in errors:
+            print(f"Burst frame failed: {error}")
+        return {
+            "files": [path for path, _ in files],
+            "offsets_ms": [round(offset * 1000, 1) for _, offset in files],
+            "pre_trigger": len(pre),
+            "frames": taken,
+            "fps": round(taken / seconds, 2) if seconds > 0 else 0.0,
+            "stalls": self.stalls - stalls,
+            "errors": len(errors),
+            "encode_ms": round(self.encode_ms, 2),
+        }
+
+    def stats(self):
+        return {
+            "armed": self.armed,
+            "pre_trigger": self.pre_trigger,
+            "ring_size": self.ring_size,
+            "ring_bytes": sum(len(slot.buffer) for slot in self.slots),  # 0 while freed
+            "stalls": self.stalls,
+            "encode_ms": round(self.encode_ms, 2),
+        }
+
+    def close(self):
+        self.disarm()
+        self._pool.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    # Burst from the simulated camera: python3 burst.py [frames] [pre-trigger]
+    import sys
+    import tempfile
+    from hal import SimulatedCamera
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pre = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    camera = SimulatedCamera(sensor_size=(2028, 1520), frame_latency=0.02, configure_latency=0)
+    camera.configure(camera.create_still_configuration())
+    camera.start()
+    burst = BurstCapture(make_grabber(camera), pre_trigger=pre)
+    burst.arm()
+    time.sleep(0.5)
+    with tempfile.TemporaryDirectory() as folder:
+        summary = burst.burst(folder, count=frames)
+    burst.close()
+    print({k: v for k, v in summary.items() if k != "files"})
+    print(burst.stats())
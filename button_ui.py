@@ -0,0 +1,316 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+
+# UI states
+IDLE = 'idle'
+SELECT = 'select'
+DURATION = 'duration'
+CAPTURING = 'capturing'
+CONFIRM_SHUTDOWN = 'confirm_shutdown'
+SETTLE = 'settle'
+
+MODES = ['photo', 'burst', 'timelapse', 'video', 'shutdown']
+
+# Durations (seconds) of the UI windows, scaled by ButtonUI(timing_scale=...)
+SELECT_WINDOW = 6
+SELECT_PAUSE = 1
+DURATION_WINDOW = 10
+SHUTDOWN_WINDOW = 10
+SETTLE_TIME = 1
+MAX_DURATION_INDEX = 7  # 1, 2, 4, ... 128 minutes
+
+IDLE_TUNE = [('A', 0.5), ('R', 0.5)]
+CONFIRM_TUNE = [('A', 0.2), ('R', 0.8)]
+CAPTURE_MELODY = [('R', 2), ('C', 0.2), ('D', 0.2), ('E', 0.2), ('F', 0.2), ('G', 0.2), ('A', 0.15), ('C2', 0.1)]
+
+
+class Scheduler:
+    """Runs callbacks at their due time on one thread that sleeps until the next one.
+
+    Nothing polls: the thread waits on a condition until the earliest timer
+    is due or a new one is added.
+    """
+
+    def __init__(self, name="scheduler"):
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay, fn, *args):
+        """Run fn(*args) after `delay` seconds; returns a handle for cancel()."""
+        entry = [time.monotonic() + delay, next(self._counter), fn, args, False]
+        with self._cond:
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return entry
+
+    def call_soon(self, fn, *args):
+        return self.call_later(0, fn, *args)
+
+    def cancel(self, handle):
+        if handle is not None:
+            handle[4] = True
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if not self._running:
+                    return
+                _, _, fn, args, cancelled = heapq.heappop(self._heap)
+            if cancelled:
+                continue
+            try:
+                fn(*args)
+            except Exception:
+                traceback.print_exc()
+
+
+class TunePlayer:
+    """Plays tunes on the buzzer from its own scheduler, so notes keep their timing
+    while the UI handles events."""
+
+    def __init__(self, gpio, notes, timing_scale=1.0):
+        self.gpio = gpio
+        self.notes = notes
+        self.timing_scale = timing_scale
+        self._scheduler = Scheduler("tune-player")
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def play(self, tune, repeat=False, delay=0.0):
+        """Start `tune` (list of (note, seconds)), replacing whatever is playing."""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        self.gpio.silence()
+        self._scheduler.call_later(delay * self.timing_scale, self._note, generation, tune, 0, repeat)
+
+    def stop(self):
+        with self._lock:
+            self._generation += 1
+        self.gpio.silence()
+
+    def _note(self, generation, tune, index, repeat):
+        if generation != self._generation:
+            return  # a newer tune (or stop) replaced this one
+        if index >= len(tune):
+            if not repeat or not tune:
+                self.gpio.silence()
+                return
+            index = 0
+        note, duration = tune[index]
+        if note == 'R':
+            self.gpio.silence()  # rest notes are silent
+        else:
+            self.gpio.tone(self.notes.get(note, 1))
+        self._scheduler.call_later(duration * self.timing_scale, self._note, generation, tune, index + 1, repeat)
+
+
+class ButtonUI:
+    """The one-button, buzzer-only interface as an event-driven state machine.
+
+    Button presses and timer expiries are events handled on a single UI
+    scheduler thread. Captures run on their own thread, so a press during a
+    video or timelapse stops it early. `actions` provides photo(stop_event),
+    burst(stop_event) (runs while the button is held), video(minutes,
+    stop_event), timelapse(minutes, stop_event), shutdown() and exit(), and
+    optionally select(mode), told which mode is offered (None when idle) so
+    it can get ready, e.g. arm the burst pre-trigger.
+    """
+
+    def __init__(self, gpio, actions, notes, tunes, timing_scale=1.0):
+        self.gpio = gpio
+        self.actions = actions
+        self.tunes = tunes
+        self.timing_scale = timing_scale
+        self.player = TunePlayer(gpio, notes, timing_scale)
+        self.scheduler = Scheduler("button-ui")
+        self.state = None
+        self.mode_index = 0
+        self.duration_index = 0
+        self.history = []  # (state, detail) transitions, for logs and tests
+        self._timer = None
+        self._stop_capture = None
+        self._finished = threading.Event()
+        gpio.on_button(lambda: self.scheduler.call_soon(self._on_press))
+
+    def start(self):
+        self.scheduler.call_soon(self._enter_idle)
+
+    def wait(self, timeout=None):
+        """Block until the UI exits (shutdown not confirmed)."""
+        return self._finished.wait(timeout)
+
+    def _set_state(self, state, detail=None, window=None, on_timeout=None):
+        self.state = state
+        self.history.append((state, detail))
+        self.scheduler.cancel(self._timer)
+        self._timer = None
+        if window is not None:
+            self._timer = self.scheduler.call_later(window * self.timing_scale, on_timeout)
+
+    # States
+
+    def _select(self, mode):
+        select = getattr(self.actions, 'select', None)
+        if select is not None:
+            try:
+                select(mode)
+            except Exception:
+                traceback.print_exc()
+
+    def _enter_idle(self):
+        self._set_state(IDLE)
+        self._select(None)
+        self.player.play(IDLE_TUNE, repeat=True)
+
+    def _enter_select(self, index):
+        self.mode_index = index
+        mode = MODES[index]
+        print(f"Select {mode} mode")
+        self._select(mode)
+        self._set_state(SELECT, mode, SELECT_WINDOW, self._select_timeout)
+        self.player.play(self.tunes[mode], repeat=True, delay=SELECT_PAUSE)
+
+    def _select_timeout(self):
+        if self.mode_index + 1 < len(MODES):
+            self._enter_select(self.mode_index + 1)
+        else:
+            self._enter_idle()
+
+    def _enter_duration(self, index):
+        self.duration_index = index
+        print(f"Set recording time to {2 ** index} minute(s)")
+        self._set_state(DURATION, 2 ** index, DURATION_WINDOW, self._duration_timeout)
+        # One short beep per step, then a long pause
+        self.player.play([('A', 0.1), ('R', 0.1)] * (index + 1) + [('R', 0.7)], repeat=True)
+
+    def _duration_timeout(self):
+        self._start_capture(MODES[self.mode_index], 2 ** self.duration_index)
+
+    def _start_capture(self, mode, minutes=None):
+        self._set_state(CAPTURING, mode)
+        self.player.play(CAPTURE_MELODY, repeat=True)
+        stop_event = threading.Event()
+        self._stop_capture = stop_event
+
+        def run():
+            try:
+                if mode == 'photo':
+                    print("Taking a photo")
+                    self.actions.photo(stop_event)
+                elif mode == 'burst':
+                    print("Burst while the button is held")
+                    self.actions.burst(stop_event)
+                else:
+                    print(f"Recording {mode} for {minutes} minute(s)")
+                    getattr(self.actions, mode)(minutes, stop_event)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                self.scheduler.call_soon(self._capture_done)
+
+        threading.Thread(target=run, name=f"capture-{mode}", daemon=True).start()
+
+    def _capture_done(self):
+        self._stop_capture = None
+        self.player.stop()
+        # Ignore the button briefly so a late "stop" press does not start a new selection
+        self._set_state(SETTLE, None, SETTLE_TIME, self._enter_idle)
+
+    def _enter_confirm_shutdown(self):
+        self._set_state(CONFIRM_SHUTDOWN, None, SHUTDOWN_WINDOW, self._shutdown_timeout)
+        self.player.play(CONFIRM_TUNE, repeat=True)
+
+    def _shutdown_timeout(self):
+        self.player.stop()
+        self._set_state(None)
+        self.actions.exit()
+        self._finished.set()
+
+    # Events
+
+    def _on_press(self):
+        if self.state == IDLE:
+            self._enter_select(0)
+        elif self.state == SELECT:
+            mode = MODES[self.mode_index]
+            print(f"{mode} mode selected")
+            if mode in ('photo', 'burst'):
+                self._start_capture(mode)
+            elif mode == 'shutdown':
+                self._enter_confirm_shutdown()
+            else:
+                self._enter_duration(0)
+        elif self.state == DURATION:
+            self._enter_duration((self.duration_index + 1) % (MAX_DURATION_INDEX + 1))
+        elif self.state == CAPTURING:
+            if self._stop_capture is not None and not self._stop_capture.is_set():
+                print("Stopping capture early")
+                self._stop_capture.set()
+        elif self.state == CONFIRM_SHUTDOWN:
+            self.player.stop()
+            self._set_state(None, 'shutdown')
+            self.actions.shutdown()
+            # Only reached if the shutdown did not happen
+            self._set_state(SETTLE, None, SETTLE_TIME, self._enter_idle)
+
+
+if __name__ == '__main__':
+    # Walk the whole flow headless with the simulated GPIO at 1/20 speed
+    from hal import SimulatedGpio
+
+    class DemoActions:
+        def photo(self, stop_event):
+            time.sleep(0.1)
+
+        def burst(self, stop_event):
+            time.sleep(0.1)
+
+        def video(self, minutes, stop_event):
+            stopped = stop_event.wait(minutes * 60)
+            print(f"video stopped early: {stopped}")
+
+        def timelapse(self, minutes, stop_event):
+            self.video(minutes, stop_event)
+
+        def shutdown(self):
+            print("shutdown requested")
+
+        def exit(self):
+            print("exit")
+
+    scale = 0.05
+    notes = {'C': 261.63, 'D': 293.66, 'E': 329.63, 'F': 349.23, 'G': 392,
+             'A': 440, 'B': 493.88, 'C2': 523.25, 'R': 1}
+    tunes = {mode: [('A', 0.3)] for mode in MODES}
+    gpio = SimulatedGpio()
+    ui = ButtonUI(gpio, DemoActions(), notes, tunes, timing_scale=scale)
+    ui.start()
+    for delay in [0.1, 0.1,   # photo
+                  2.5, 0.1 + (2 * SELECT_WINDOW + 1) * scale, 0.2, 0.1,  # timelapse, 4 minutes
+                  (DURATION_WINDOW + 1) * scale]:  # stop it early
+        time.sleep(delay)
+        gpio.press()
+    time.sleep(1)
+    print(ui.history)
+    print(f"{len(gpio.tones)} buzzer changes")
@@ -1,20 +1,24 @@
-import RPi.GPIO as GPIO
-import threading
-import time
 import os
-from datetime import datetime
+import threading
 import sys
-from PIL import Image
 
-# Add a base directory for your paths
-base_dir = "/home/pi/camera/"
+# The button's captures land in the pi user's camera folder unless told otherwise
+os.environ.setdefault("ACTIONPI_BASE_DIR", "/home/pi/camera")
+
+from button_ui import ButtonUI
+from capture_client import connect
+from hal import open_gpio
+from jobs import QUEUED, RUNNING, QueueFull
+from process_runner import runner
+from storage import StorageFull
 
-# Set a directory for thumbnails
-thumbnail_dir = base_dir + "thumbnails/"
+# Captures go through the same capture core as the web server: the capture
+# daemon's when ACTIONPI_CAPTURE_SOCKET names its socket, so both front-ends
+# can run at once, otherwise loaded into this process
+capture = connect()
 
-# Ensure the thumbnails directory exists
-if not os.path.exists(thumbnail_dir):
-    os.mkdir(thumbnail_dir)
+# Keep burst frames from before the press while the burst mode is offered
+ARM_BURST_ON_OFFER = os.environ.get('ACTIONPI_BUTTON_BURST_PRE') == '1'
 
 # Pin configurations
 BUTTON_PIN = 10
@@ -36,260 +40,115 @@ notes = {
 # Tunes for different modes with different timings
 tunes = {
     "photo": [('D', 0.4), ('F', 0.4), ('A', 0.4)],
+    "burst": [('D', 0.1), ('D', 0.1), ('D', 0.1), ('A', 0.4)],
     "timelapse": [('D', 0.3), ('F', 0.1), ('A', 0.3), ('F', 0.1)],
     "video": [('C', 0.2), ('D', 0.2), ('E', 0.2)],
     "shutdown": [('G', 0.3), ('C2', 0.3)],
 }
 
-# State variables
-selected_mode = None
-button_pressed = threading.Event()
-
-# Set up GPIO
-GPIO.setmode(GPIO.BOARD)
-GPIO.setup(BUTTON_PIN, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
-GPIO.setup(BUZZER_PIN, GPIO.OUT)
-
-# Initialize PWM for the buzzer
-p = GPIO.PWM(BUZZER_PIN, 100)
-p.start(1)
-p.ChangeDutyCycle(0) # stop the buzzer initially
-
-# Function to play a note
-def play_note(note, duration):
-    frequency = notes.get(note, 1)
-    p.ChangeFrequency(frequency)
-    p.ChangeDutyCycle(90 if note != 'R' else 0)  # Make rest notes silent
-    time.sleep(duration)
-
-# Function to play a beep and pause at the beginning
-def initial_beep():
-    while not button_pressed.is_set():
-        play_note('A', 0.5)
-        p.ChangeDutyCycle(0)
-        time.sleep(0.5)
-
-# Function to play a tune
-def play_tune(mode, tune):
-    global selected_mode
-    start_time = time.time()
-    p.ChangeDutyCycle(0)  # stop the buzzer before starting the tune
-    time.sleep(1)  # delay between tunes
-    while True:
-        for note, duration in tune:
-            if button_pressed.is_set():
-                button_pressed.clear()
-                selected_mode = mode
-                return True
-            play_note(note, duration)
-        if time.time() - start_time >= 6:  # 10 seconds to decide
-            break
-    p.ChangeDutyCycle(0)  # stop the buzzer after finishing the tune
-    return False
-
-
-def recording_duration():
-    duration_index = 0  # index 0-7 maps to 1, 2, 4, 8, 16, 32, 64, 128 minutes
+def run_capture(kind, stop_event=None, **params):
+    """Queue a capture and wait for it; a button press (stop_event) cancels it."""
+    try:
+        job = capture.submit(kind, **params)
+    except (QueueFull, StorageFull, ConnectionError) as e:
+        print(f"Cannot start {kind}: {e}")
+        return None
     while True:
-        duration = 2**duration_index
-        print(f"Set recording time to {duration} minute(s)")
-        start_time = time.time()
-        while time.time() - start_time < 10:  # 10 seconds to decide
-            # Number of short beeps
-            for i in range(duration_index + 1):
-                if button_pressed.is_set():
-                    button_pressed.clear()
-                    duration_index = (duration_index + 1) % 8  # Loop back to 0 after reaching 7
-                    break  # Break the inner loop
-                play_note('A', 0.1)  # Short beep
-                p.ChangeDutyCycle(0)  # Short pause
-                time.sleep(0.1)
-            else:
-                # Long pause
-                p.ChangeDutyCycle(0)
-                time.sleep(0.7)
-                continue  # Continue if the inner loop wasn't broken
-            break  # Break the outer loop
-        else:
-            p.ChangeDutyCycle(0)
-            return duration  # Return the recording time in minutes
-
-# Add shutdown function
-def shutdown():
-    start_time = time.time()
-    while time.time() - start_time < 10:  # 10 seconds to confirm
-        if button_pressed.is_set():
-            p.ChangeDutyCycle(0)
-            os.system("sudo shutdown -h now")  # shutdown the Pi
-            return  # Exit function in case shutdown does not happen immediately
-        play_note('A', 0.2)  # Single beep
-        p.ChangeDutyCycle(0)  # Pause
-        time.sleep(0.8)  # Wait for the remainder of the second
-    p.ChangeDutyCycle(0)  # Make rest notes silent
-    p.stop()  # Stop PWM output
-    GPIO.cleanup()  # Cleanup GPIO channels
-    sys.exit(0)  # Exit the Python script if the button is not pressed within 10 seconds
-
-# Function to play melody
-def play_melody():
-    global play_melody_flag
-    melody = [('C', 0.2), ('D', 0.2), ('E', 0.2), ('F', 0.2), ('G', 0.2), ('A', 0.15), ('C2', 0.1)]
-    while play_melody_flag:
-        p.ChangeDutyCycle(0)  # Make rest notes silent
-        time.sleep(2)
-        for note, duration in melody:
-            play_note(note, duration)
-
-
-
-def capture_photo():
-    global play_melody_flag
-    # Set flag to start playing melody
-    play_melody_flag = True
-    # Start melody in a separate thread
-    threading.Thread(target=play_melody).start()
-    # Create directory if it doesn't exist
-    if not os.path.exists(base_dir + "photos"):
-        os.mkdir(base_dir + "photos")
-    
-    # Generate the filename
-    filename = datetime.now().strftime(base_dir + "photos/photo_%Y%m%d_%H%M%S.jpg")
-
-    # Capture the photo
-    os.system(f"libcamera-still -o {filename}")
-
-    # Create directories if they don't exist
-    photos_thumbnail_dir = thumbnail_dir + "photos/"
-    if not os.path.exists(photos_thumbnail_dir):
-        os.mkdir(photos_thumbnail_dir)
-
-    # Create a thumbnail
-    with Image.open(filename) as img:
-        img.thumbnail((128, 128))  # Resize image in-place
-        img.save(photos_thumbnail_dir + os.path.basename(filename))  # Save thumbnail
-
-    # Set flag to stop playing melody
-    play_melody_flag = False
-
-def record_video(duration):
-    global play_melody_flag
-    # Set flag to start playing melody
-    play_melody_flag = True
-    # Start melody in a separate thread
-    threading.Thread(target=play_melody).start()
-    # Create directory if it doesn't exist
-    if not os.path.exists(base_dir + "videos"):
-        os.mkdir(base_dir + "videos")
-
-    # Generate filename
-    filename_h264 = datetime.now().strftime(base_dir + "videos/video_%Y%m%d_%H%M%S.h264")
-    filename_mp4 = filename_h264.replace('.h264', '.mp4')
-
-    # Record the video
-    os.system(f"libcamera-vid -t {duration * 60 * 1000} --framerate 24 --width 1920 --height 1080 -o {filename_h264}")
-    
-    # Convert the video to mp4
-    os.system(f"ffmpeg -i {filename_h264} -vcodec copy {filename_mp4}")
-
-    # Delete the original .h264 file
-    os.remove(filename_h264)
-
-    # Create directories if they don't exist
-    videos_thumbnail_dir = thumbnail_dir + "videos/"
-    if not os.path.exists(videos_thumbnail_dir):
-        os.mkdir(videos_thumbnail_dir)
-
-    # Create a thumbnail
-    thumbnail_filename = os.path.splitext(os.path.basename(filename_mp4))[0] + ".jpg"
-    os.system(f"ffmpeg -i {filename_mp4} -ss 00:00:01 -vframes 1 {videos_thumbnail_dir + thumbnail_filename}")
-    with Image.open(videos_thumbnail_dir + thumbnail_filename) as img:
-        img.thumbnail((128, 128))  # Resize image in-place
-        img.save(videos_thumbnail_dir + thumbnail_filename)  # Overwrite the full-size frame with thumbnail
-
-    # Set flag to stop playing melody
-    play_melody_flag = False
-
-
-
-# Function to capture a timelapse with melody
-def capture_timelapse(duration):
-
-    global play_melody_flag
-    # Set flag to start playing melody
-    play_melody_flag = True
-    # Start melody in a separate thread
-    threading.Thread(target=play_melody).start()
-    # Create directory if it doesn't exist
-    if not os.path.exists(base_dir + "timelapses"):
-        os.mkdir(base_dir + "timelapses")
-    
-    # Generate the folder and filename
-    foldername = datetime.now().strftime(base_dir + "timelapses/timelapse_%Y%m%d_%H%M%S")
-    os.mkdir(foldername)
-    filename = foldername + "/image%04d.jpg"
-
-    # Capture the timelapse
-    os.system(f"libcamera-still -t {duration * 60000} --timelapse 1000 --framestart 1 -o {filename}")
-
-    # Create directories if they don't exist
-    timelapse_thumbnail_dir = thumbnail_dir + "timelapses/"
-    if not os.path.exists(timelapse_thumbnail_dir):
-        os.mkdir(timelapse_thumbnail_dir)
-
-    # Create a thumbnail from the first image in the timelapse
-    first_image_filename = os.path.join(foldername, "image0001.jpg")
-    with Image.open(first_image_filename) as img:
-        img.thumbnail((128, 128))  # Resize image in-place
-        img.save(timelapse_thumbnail_dir + os.path.basename(foldername) + ".jpg")  # Save thumbnail for timelapse
-
-    # Set flag to stop playing melody
-    play_melody_flag = False
-
-# Button press handler
-def button_press(channel):
-    button_pressed.set()
-
-# Set the callback for button press
-GPIO.add_event_detect(BUTTON_PIN, GPIO.RISING, callback=button_press, bouncetime=200)
-
-
-
-
-
-
-# Modify the main loop to handle the shutdown mode
-while True:
-    # Play initial beep
-    initial_beep()
-    # Clear the initial button press event
-    button_pressed.clear()
-    for mode, tune in tunes.items():
-        print(f"Select {mode} mode")
-        if play_tune(mode, tune):
-            print(f"{mode} mode selected")
-            if mode == 'video':
-                duration = recording_duration()
-                print(f"Recording {mode} for {duration} minute(s)")
-                record_video(duration)
-            elif mode == 'photo':
-                print("Taking a photo")
-                capture_photo()
-            elif mode == 'timelapse':
-                duration = recording_duration()
-                print(f"Capturing a timelapse for {duration} minute(s)")
-                capture_timelapse(duration)
-            elif mode == 'shutdown':
-                shutdown()  # start shutdown procedure
-            p.ChangeDutyCycle(0)  # Make rest notes silent
-            time.sleep(10)  # 10 second delay after selection
-            p.ChangeDutyCycle(90)  # Resume notes
-            # Clear the button press event after each action
-            button_pressed.clear()
-            # Break out of the for loop to start the mode selection from the beginning
+        job = capture.wait(job["id"], timeout=0.2)
+        if job["status"] not in (QUEUED, RUNNING):
             break
-        time.sleep(1)  # Short delay between modes
-
-
-# Clean up
-p.stop()
-GPIO.cleanup()
\ No newline at end of file
+        if stop_event is not None and stop_event.is_set():
+            capture.cancel(job["id"])
+            stop_event = None  # keep waiting for the capture to wind down
+    if job["error"]:
+        print(f"{kind} failed: {job['error']}")
+    return job
+
+
+class Actions:
+    """What the button UI can do, called from the UI's threads."""
+
+    def __init__(self, gpio):
+        self.gpio = gpio
+        self._offered = None
+        self._offer_changed = threading.Event()
+        threading.Thread(target=self._get_ready, name="button-ready", daemon=True).start()
+
+    def select(self, mode):
+        # Runs on the UI thread, which must not wait for the camera to switch
+        # modes: only note the offer and let _get_ready() act on it
+        self._offered = mode
+        self._offer_changed.set()
+
+    def _get_ready(self):
+        # Arm the video pre-roll as soon as that mode is offered, so it is
+        # filling by the time the duration is chosen, and the burst
+        # pre-trigger too with ACTIONPI_BUTTON_BURST_PRE=1 (its ring takes up
+        # to ACTIONPI_BURST_MB while armed). Only the latest offer counts, so
+        # stepping quickly through the modes costs nothing. The burst is
+        # released for the other capture modes; the pre-roll (a camera mode
+        # switch each way) is kept until the UI is idle again, only shutdown
+        # is offered after video.
+        while True:
+            self._offer_changed.wait()
+            self._offer_changed.clear()
+            mode = self._offered
+            try:
+                if mode == 'burst':
+                    if ARM_BURST_ON_OFFER:
+                        capture.arm_burst()
+                elif mode == 'video':
+                    capture.arm_preroll()
+                elif mode in ('photo', 'timelapse'):
+                    capture.disarm_burst()
+                elif mode is None:
+                    capture.disarm_burst()
+                    capture.disarm_preroll()
+            except (OSError, RuntimeError) as e:  # including ConnectionError
+                print(e)
+
+    def photo(self, stop_event):
+        run_capture('photo', stop_event)
+
+    def burst(self, stop_event):
+        # count=0 keeps going until cancelled, which releasing the button does
+        released = threading.Event()
+        watcher = threading.Thread(target=self._watch_release, args=(released, stop_event), daemon=True)
+        watcher.start()
+        job = run_capture('burst', released, count=0)
+        released.set()
+        if job and job["result"]:
+            print(f"Burst of {len(job['result']['files'])} frames at {job['result']['fps']} fps")
+
+    def _watch_release(self, released, stop_event):
+        while self.gpio.is_pressed() and not stop_event.is_set() and not released.is_set():
+            released.wait(0.02)
+        released.set()
+
+    def video(self, minutes, stop_event):
+        run_capture('video', stop_event, duration=minutes * 60)
+
+    def timelapse(self, minutes, stop_event):
+        run_capture('timelapse', stop_event, interval=1, duration=minutes)
+
+    def shutdown(self):
+        runner.run(["sudo", "shutdown", "-h", "now"], timeout=30)  # shutdown the Pi
+
+    def exit(self):
+        # Shutdown was not confirmed within 10 seconds: leave the script
+        self.gpio.cleanup()
+
+
+if __name__ == '__main__':
+    if not os.environ.get('ACTIONPI_CAPTURE_SOCKET'):
+        # Warm the camera up now rather than on the first press
+        capture.start(background=True)
+    gpio = open_gpio(button_pin=BUTTON_PIN, buzzer_pin=BUZZER_PIN)
+    ui = ButtonUI(gpio, Actions(gpio), notes, tunes)
+    ui.start()
+    # Everything runs on button events and timers; just wait for the UI to exit
+    try:
+        ui.wait()
+    except KeyboardInterrupt:
+        gpio.cleanup()
+    sys.exit(0)
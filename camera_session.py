@@ -0,0 +1,346 @@
+import io
+import threading
+import time
+
+# Camera modes. "dual" keeps a high-resolution main stream for stills next to a
+# small lores stream for the preview, so a still never interrupts streaming.
+PREVIEW = 'preview'
+DUAL = 'dual'
+STILL = 'still'
+VIDEO = 'video'
+
+DEFAULT_STILL_SIZE = (2028, 1520)
+DEFAULT_PREVIEW_SIZE = (320, 240)
+DEFAULT_VIDEO_SIZE = (1920, 1080)
+
+
+class CameraSession:
+    """Keeps one camera open with pre-built configurations and switches only when needed.
+
+    Every configuration is created once up front. Stills are served from the
+    main stream of the dual-stream mode; only a full-resolution still needs a
+    real mode switch, done with switch_mode_and_capture_file which is much
+    cheaper than stop/configure/start. How long each switch took is recorded
+    in `switch_times`.
+
+    With `idle_framerate` the sensor keeps streaming between captures, so
+    exposure and white balance stay converged, but at that lower frame rate
+    unless something holds the session (hold()/release()): a stream with
+    viewers, an armed burst, a recording.
+    """
+
+    def __init__(self, picam2, mode=DUAL, still_size=DEFAULT_STILL_SIZE,
+                 preview_size=DEFAULT_PREVIEW_SIZE, video_size=DEFAULT_VIDEO_SIZE, framerate=24,
+                 idle_framerate=None):
+        self.picam2 = picam2
+        self.framerate = framerate
+        self.idle_framerate = idle_framerate
+        self.holders = set()
+        self.current_framerate = None
+        self.still_size = still_size
+        self.preview_size = preview_size
+        self.configs = {
+            PREVIEW: picam2.create_preview_configuration(main={"size": preview_size}),
+            DUAL: picam2.create_still_configuration(main={"size": still_size},
+                                                     lores={"size": preview_size},
+                                                     buffer_count=2),
+            STILL: picam2.create_still_configuration(),
+            VIDEO: picam2.create_video_configuration(main={"size": video_size},
+                                                     lores={"size": preview_size},
+                                                     controls={"FrameRate": framerate}),
+        }
+        self.mode = None
+        self.switch_times = []  # (from_mode, to_mode, seconds)
+        self.captures = 0
+        self.encode_ms = 0.0  # moving average of the preview JPEG encode
+        # Software preview encode settings, lowered by the thermal governor
+        self.preview_quality = 75
+        self.preview_reduce = 1  # downscale factor
+        self._lock = threading.RLock()
+        self.set_mode(mode)
+
+    def _record_switch(self, old, new, seconds):
+        self.switch_times.append((old, new, seconds))
+        del self.switch_times[:-50]
+        print(f"Camera mode {old} -> {new} took {seconds * 1000:.0f} ms")
+
+    def set_mode(self, mode):
+        """Reconfigure the camera into `mode`; a no-op if it is already there."""
+        with self._lock:
+            if mode == self.mode:
+                return 0.0
+            t0 = time.monotonic()
+            self.picam2.stop()
+            self.picam2.configure(self.configs[mode])
+            self.picam2.start()
+            seconds = time.monotonic() - t0
+            self._record_switch(self.mode, mode, seconds)
+            self.mode = mode
+            self.current_framerate = None  # the new configuration brings its own
+            self._apply_framerate()
+            return seconds
+
+    def hold(self, holder):
+        """Keep the sensor at the full frame rate until release(holder)."""
+        with self._lock:
+            self.holders.add(holder)
+            self._apply_framerate()
+
+    def release(self, holder):
+        with self._lock:
+            self.holders.discard(holder)
+            self._apply_framerate()
+
+    def _apply_framerate(self):
+        if self.idle_framerate is None or self.mode == VIDEO:
+            return  # recordings set their own frame rate
+        framerate = self.framerate if self.holders else self.idle_framerate
+        if framerate != self.current_framerate:
+            self.picam2.set_controls({"FrameRate": framerate})
+            self.current_framerate = framerate
+
+    def warm_up(self, max_frames=30):
+        """Let auto exposure settle before the first capture; returns the frames it took.
+
+        Waits for the AeLocked metadata flag where the camera reports it, and
+        for a fixed handful of frames where it does not.
+        """
+        with self._lock:
+            for frames in range(1, max_frames + 1):
+                metadata = self.picam2.capture_metadata()
+                if metadata.get("AeLocked", frames >= 6):
+                    return frames
+            return max_frames
+
+    @property
+    def preview_stream(self):
+        """Name of the stream the preview should be taken from in the current mode."""
+        return 'lores' if self.mode in (DUAL, VIDEO) else 'main'
+
+    def capture_still(self, file_output, full_resolution=False, format=None):
+        """Capture a still to a path or file object.
+
+        Without full_resolution the running main stream is used as is. With
+        it, the camera switches to the full sensor configuration for one
+        frame and back.
+        """
+        with self._lock:
+            self.captures += 1
+            if full_resolution and self.mode != STILL:
+                t0 = time.monotonic()
+                self.picam2.switch_mode_and_capture_file(self.configs[STILL], file_output, format=format)
+                self._record_switch(self.mode, STILL, time.monotonic() - t0)
+                return
+            self.picam2.capture_file(file_output, format=format)
+
+    def lores_image(self):
+        """The next frame of the running lores stream as a PIL YCbCr image, without any encoding.
+
+        The lores stream is YUV420. JPEG stores YCbCr anyway, so the planes
+        go to PIL as they are instead of being converted through RGB.
+        """
+        from PIL import Image
+        request = self.picam2.capture_request()
+        try:
+            yuv = request.make_buffer('lores')
+            stride = self.picam2.stream_configuration('lores')['stride']
+        finally:
+            request.release()
+        width, height = self.preview_size
+        y_size = stride * height
+        y = Image.frombuffer('L', (stride, height), yuv[:y_size], 'raw', 'L', 0, 1)
+        uv_size = (stride // 2, height // 2)
+        u = Image.frombuffer('L', uv_size, yuv[y_size:y_size + y_size // 4], 'raw', 'L', 0, 1)
+        v = Image.frombuffer('L', uv_size, yuv[y_size + y_size // 4:y_size + y_size // 2], 'raw', 'L', 0, 1)
+        img = Image.merge('YCbCr', (y, u.resize((stride, height)), v.resize((stride, height))))
+        return img.crop((0, 0, width, height))
+
+    def preview_jpeg(self):
+        """JPEG-encode one preview frame."""
+        stream = io.BytesIO()
+        if self.preview_stream == 'main':
+            self.picam2.capture_file(stream, format="jpeg")
+            return stream.getvalue()
+        img = self.lores_image()
+        t0 = time.monotonic()
+        if self.preview_reduce > 1:
+            img = img.reduce(self.preview_reduce)
+        img.save(stream, format="jpeg", quality=self.preview_quality)
+        self.encode_ms += ((time.monotonic() - t0) * 1000 - self.encode_ms) * 0.1
+        return stream.getvalue()
+
+    def stats(self):
+        return {
+            "mode": self.mode,
+            "captures": self.captures,
+            "encode_ms": round(self.encode_ms, 2),
+            "preview_quality": self.preview_quality,
+            "preview_reduce": self.preview_reduce,
+            "framerate": self.current_framerate,
+            "holders": sorted(str(holder) for holder in self.holders),
+            "switches": [{"from": a, "to": b, "ms": round(s * 1000, 1)} for a, b, s in self.switch_times],
+        }
+
+
+class CameraSessionSource:
+    """Broadcaster frame source that takes preview frames from a CameraSession."""
+
+    def __init__(self, session):
+        self.session = session
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def read(self):
+        return self.session.preview_jpeg()
+
+
+class HeldSource:
+    """Wraps a broadcaster source so the session runs at full frame rate while it is started."""
+
+    def __init__(self, session, source, name):
+        self.session = session
+        self.source = source
+        self.name = name
+        self.pushed = getattr(source, 'pushed', False)
+
+    def start(self):
+        self.session.hold(self.name)
+        self.source.start()
+
+    def stop(self):
+        try:
+            self.source.stop()
+        finally:
+            self.session.release(self.name)
+
+    def read(self):
+        return self.source.read()
+
+
+class MockRequest:
+    def __init__(self, camera):
+        self.camera = camera
+
+    def make_buffer(self, name):
+        width, height = self.camera.config[name]["size"]
+        return bytes([128]) * (width * height * 3 // 2)
+
+    def release(self):
+        pass
+
+
+class MockPicamera2:
+    """Off-device stand-in for Picamera2 with the calls CameraSession uses.
+
+    Reconfiguring costs `configure_latency` seconds and a capture
+    `capture_latency`, or a frame period if a FrameRate control is set lower,
+    and auto exposure locks `converge_frames` frames after start(), so the
+    session's switching and warm-up behaviour can be timed without a sensor.
+    """
+
+    def __init__(self, configure_latency=0.3, capture_latency=0.02, converge_frames=4):
+        self.configure_latency = configure_latency
+        self.capture_latency = capture_latency
+        self.converge_frames = converge_frames
+        self.config = None
+        self.started = False
+        self.controls = {}
+        self.frames_since_start = 0
+        self.calls = {"configure": 0, "capture_file": 0, "switch_mode_and_capture_file": 0}
+
+    def create_preview_configuration(self, main=None, lores=None, **kwargs):
+        return self._config("preview", main, lores, (640, 480))
+
+    def create_still_configuration(self, main=None, lores=None, **kwargs):
+        return self._config("still", main, lores, (4056, 3040))
+
+    def create_video_configuration(self, main=None, lores=None, **kwargs):
+        return self._config("video", main, lores, (1280, 720))
+
+    def _config(self, use_case, main, lores, default_size):
+        config = {"use_case": use_case, "main": {"size": default_size}}
+        config["main"].update(main or {})
+        if lores:
+            config["lores"] = dict(lores)
+        return config
+
+    def configure(self, config):
+        if self.started:
+            raise RuntimeError("Camera must be stopped before configuring")
+        time.sleep(self.configure_latency)
+        self.config = config
+        self.calls["configure"] += 1
+
+    def start(self):
+        self.started = True
+        self.frames_since_start = 0
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.started = False
+
+    def set_controls(self, controls):
+        self.controls.update(controls)
+
+    def _next_frame(self):
+        if not self.started:
+            raise RuntimeError("Camera is not running")
+        framerate = self.controls.get("FrameRate")
+        time.sleep(max(self.capture_latency, 1.0 / framerate if framerate else 0))
+        self.frames_since_start += 1
+
+    def capture_metadata(self):
+        self._next_frame()
+        return {"AeLocked": self.frames_since_start >= self.converge_frames,
+                "FrameDuration": int(1e6 / self.controls.get("FrameRate", 30))}
+
+    def stream_configuration(self, name="main"):
+        width = self.config[name]["size"][0]
+        return {"size": self.config[name]["size"], "stride": width}
+
+    def frame_data(self):
+        width, height = self.config["main"]["size"]
+        return b"\xff\xd8" + b"%dx%d" % (width, height) + b"\xff\xd9"
+
+    def _write(self, file_output):
+        data = self.frame_data()
+        if isinstance(file_output, str):
+            with open(file_output, "wb") as f:
+                f.write(data)
+        else:
+            file_output.write(data)
+
+    def capture_file(self, file_output, name="main", format=None, **kwargs):
+        self._next_frame()
+        self.calls["capture_file"] += 1
+        self._write(file_output)
+
+    def switch_mode_and_capture_file(self, camera_config, file_output, name="main", format=None, **kwargs):
+        previous = self.config
+        # A mode switch is cheaper than a full restart but still not free
+        time.sleep(self.configure_latency / 2)
+        self.config = camera_config
+        self.capture_file(file_output)
+        self.config = previous
+        self.calls["switch_mode_and_capture_file"] += 1
+
+    def capture_request(self):
+        self._next_frame()
+        return MockRequest(self)
+
+
+if __name__ == '__main__':
+    # Exercise the mode state machine off-device
+    session = CameraSession(MockPicamera2())
+    for _ in range(3):
+        session.capture_still(io.BytesIO())
+    session.capture_still(io.BytesIO(), full_resolution=True)
+    session.set_mode(DUAL)
+    print(session.stats())
+    print(session.picam2.calls)
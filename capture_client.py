@@ -0,0 +1,215 @@
+"""Talking to capture_daemon.py over its Unix socket.
+
+One JSON line per request, {"method": ..., "params": {...}}, answered by one
+JSON line, {"result": ...} or {"error": ..., "type": ...}. Streaming methods
+answer {"result": "stream"} and then send items, each a HEADER (payload
+length, timestamp) followed by the payload, until the client hangs up.
+"""
+import json
+import os
+import socket
+import struct
+import threading
+
+from broadcaster import FrameBroadcaster
+from jobs import QueueFull
+from storage import StorageFull
+
+DEFAULT_SOCKET = "/tmp/actionpi-capture.sock"
+HEADER = struct.Struct(">Id")
+
+# CaptureService methods the daemon serves
+METHODS = {'submit', 'jobs', 'job', 'cancel', 'cancel_kind', 'wait', 'arm_burst', 'disarm_burst',
+           'arm_preroll', 'disarm_preroll', 'start_motion', 'stop_motion', 'sync_now',
+           'status', 'temperature', 'disk_usage', 'telemetry', 'metrics', 'has_stream'}
+STREAM_METHODS = {'stream', 'telemetry_events'}
+
+# Errors that are raised again on the client side, with their own type
+ERRORS = {'QueueFull': QueueFull, 'StorageFull': StorageFull, 'ValueError': ValueError}
+
+
+def connect(path=None):
+    """The capture service: the daemon's if ACTIONPI_CAPTURE_SOCKET (or `path`) names
+    its socket, otherwise the capture core loaded into this process."""
+    path = path or os.environ.get('ACTIONPI_CAPTURE_SOCKET')
+    if path:
+        return CaptureClient(path)
+    import capture_core
+    return capture_core.service
+
+
+class CaptureClient:
+    """The methods of capture_core.CaptureService, called in the capture daemon.
+
+    Every call uses a fresh connection, which costs little on a Unix socket
+    and survives daemon restarts. Failing to reach the daemon raises
+    ConnectionError.
+    """
+
+    def __init__(self, path=DEFAULT_SOCKET, timeout=10.0):
+        self.path = path
+        self.timeout = timeout
+        self._broadcasters = {}
+        self._lock = threading.Lock()
+
+    def _connect(self, timeout):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.path)
+        except OSError as e:
+            sock.close()
+            raise ConnectionError(f"capture daemon at {self.path}: {e}")
+        return sock
+
+    def _request(self, sock, method, params):
+        f = sock.makefile('rwb')
+        f.write(json.dumps({"method": method, "params": params}).encode() + b"\n")
+        f.flush()
+        line = f.readline()
+        if not line:
+            raise ConnectionError("capture daemon closed the connection")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise ERRORS.get(reply.get("type"), RuntimeError)(reply["error"])
+        return f, reply["result"]
+
+    def _call(self, method, params=None, socket_timeout=None):
+        with self._connect(socket_timeout or self.timeout) as sock:
+            return self._request(sock, method, params or {})[1]
+
+    def _stream(self, method, params=None):
+        """Yield (timestamp, payload) of a streaming method until closed."""
+        sock = self._connect(self.timeout)
+        try:
+            f, _ = self._request(sock, method, params or {})
+            sock.settimeout(None)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                length, timestamp = HEADER.unpack(header)
+                yield timestamp, f.read(length)
+        finally:
+            sock.close()
+
+    # Jobs
+
+    def submit(self, kind, **params):
+        return self._call('submit', {"kind": kind, **params})
+
+    def jobs(self):
+        return self._call('jobs')
+
+    def job(self, job_id):
+        return self._call('job', {"job_id": job_id})
+
+    def cancel(self, job_id):
+        return self._call('cancel', {"job_id": job_id})
+
+    def cancel_kind(self, kind):
+        return self._call('cancel_kind', {"kind": kind})
+
+    def wait(self, job_id, timeout=None):
+        # The socket has to outlast the wait on the daemon's side
+        socket_timeout = None if timeout is None else timeout + self.timeout
+        with self._connect(self.timeout) as sock:
+            sock.settimeout(socket_timeout)
+            return self._request(sock, 'wait', {"job_id": job_id, "timeout": timeout})[1]
+
+    # Burst pre-trigger
+
+    def arm_burst(self):
+        return self._call('arm_burst')
+
+    def disarm_burst(self):
+        return self._call('disarm_burst')
+
+    # Video pre-roll
+
+    def arm_preroll(self):
+        return self._call('arm_preroll')
+
+    def disarm_preroll(self):
+        return self._call('disarm_preroll')
+
+    # Motion trigger
+
+    def start_motion(self, action='photo', pixel_threshold=20, min_area=0.005, roi=None, cooldown=10, fps=4):
+        return self._call('start_motion', {"action": action, "pixel_threshold": pixel_threshold, "min_area": min_area,
+                                           "roi": roi, "cooldown": cooldown, "fps": fps})
+
+    def stop_motion(self):
+        return self._call('stop_motion')
+
+    def sync_now(self):
+        return self._call('sync_now')
+
+    # State
+
+    def status(self, name):
+        return self._call('status', {"name": name})
+
+    def temperature(self):
+        return self._call('temperature')
+
+    def disk_usage(self):
+        return self._call('disk_usage')
+
+    def telemetry(self, history=0):
+        return self._call('telemetry', {"history": history})
+
+    def metrics(self):
+        return self._call('metrics')
+
+    def telemetry_events(self):
+        for _, event in self._stream('telemetry_events'):
+            yield event.decode()
+
+    # Streams
+
+    def has_stream(self, mode):
+        return self._call('has_stream', {"mode": mode})
+
+    def stream(self, mode):
+        return self._stream('stream', {"mode": mode})
+
+    def broadcaster(self, mode):
+        """A local broadcaster relaying the daemon's stream, so all viewers share one connection."""
+        with self._lock:
+            if mode not in self._broadcasters:
+                if not self.has_stream(mode):
+                    return None
+                # Idles like the daemon's own, so an unwatched relay lets the camera idle too
+                self._broadcasters[mode] = FrameBroadcaster(RemoteStreamSource(self, mode),
+                                                            ring_size=256 if mode == 'h264' else 4,
+                                                            idle_after=10)
+            return self._broadcasters[mode]
+
+
+class RemoteStreamSource:
+    """Broadcaster source reading a stream of the capture daemon; reconnects after errors."""
+
+    pushed = True  # the daemon keeps sending whether or not it is read
+
+    def __init__(self, client, mode):
+        self.client = client
+        self.mode = mode
+        self._items = None
+
+    def start(self):
+        pass
+
+    def stop(self):
+        if self._items is not None:
+            self._items.close()
+            self._items = None
+
+    def read(self):
+        if self._items is None:
+            self._items = self.client.stream(self.mode)
+        try:
+            return next(self._items)[1]
+        except (StopIteration, OSError):
+            self._items = None
+            raise ConnectionError(f"{self.mode} stream of the capture daemon ended")
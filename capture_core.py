@@ -0,0 +1,666 @@
+"""The camera-owning half of ActionPi: hardware, capture jobs, streams, storage and telemetry.
+
+Exactly one process should load this. capture_daemon.py does, and serves
+`service` to the web (server.py) and button (camera.py) front-ends over a
+Unix socket; without ACTIONPI_CAPTURE_SOCKET a front-end loads it in-process
+instead, which is fine as long as it is the only one running.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from broadcaster import FrameBroadcaster, FakeCameraSource
+from burst import BurstCapture, make_grabber
+from camera_session import DUAL, STILL, VIDEO, CameraSession, CameraSessionSource, HeldSource
+from governor import Governor
+from hal import is_simulated, open_camera, open_leds
+from jobs import JobQueue, QueueFull
+from media_index import MediaIndex, thumbnail_path
+from passthrough import EncoderChunkSource, FileChunkSource, PipeChunkSource, h264_chunks, libcamera_vid_command
+from preroll import PrerollRecorder
+from process_runner import runner
+from recording import record_with_libcamera, record_with_session
+from startup import StartupTimer
+from storage import StorageFull, StorageManager, estimate_bytes
+from sync import SyncManager
+from telemetry import THERMAL_ZONE, Telemetry, read_temperature, read_throttled
+from thumbnails import ThumbnailCache
+from timelapse import VIDEO_NAME, TimelapseEngine, VideoAssembler, session_capture
+
+BASE_DIR = os.environ.get('ACTIONPI_BASE_DIR', '.')
+DIRECTORIES = ['photos', 'videos', 'timelapses']
+for dir in DIRECTORIES + ['thumbnails']:
+    os.makedirs(os.path.join(BASE_DIR, dir), exist_ok=True)
+
+# Boot-to-ready milestones and trigger-to-file latencies, see /startup
+startup = StartupTimer()
+
+# Hardware is opened by CaptureService.start() (or on first use), not at
+# import, and the backends (real or simulated) are picked by the
+# ACTIONPI_CAMERA/GPIO/LEDS settings, see hal.py. Once open the sensor keeps
+# streaming so exposure stays converged, at ACTIONPI_IDLE_FPS (0: full rate)
+# while no stream, burst or recording needs the full frame rate.
+IDLE_FRAMERATE = float(os.environ.get('ACTIONPI_IDLE_FPS', 10)) or None
+picam2 = None
+session = None
+IS_PICAMERA2 = False
+HARDWARE_ENCODER = False  # the simulated camera has no H.264/MJPEG encoder
+led_strip = None
+hardware_lock = threading.Lock()
+
+def init_hardware():
+    global picam2, session, IS_PICAMERA2, HARDWARE_ENCODER, led_strip
+    if led_strip is not None:
+        return
+    with hardware_lock:
+        if led_strip is not None:
+            return
+        picam2 = open_camera()
+        if picam2 is not None:
+            # Configurations are built once; stills come from the main stream and the
+            # preview from the lores stream of the same running configuration
+            session = CameraSession(picam2, idle_framerate=IDLE_FRAMERATE)
+            IS_PICAMERA2 = True
+            HARDWARE_ENCODER = not is_simulated(picam2)
+            apply_thermal_level()
+            frames = session.warm_up()
+            startup.mark('camera_ready')
+            print(f"Exposure settled after {frames} frames")
+        led_strip = open_leds()
+
+
+# One capture thread per stream mode feeds every client of that mode, and
+# stops STREAM_IDLE_AFTER seconds after the last client has gone.
+# ACTIONPI_FAKE_CAMERA=1 streams synthetic frames on a machine without a camera,
+# ACTIONPI_STREAM_FILE=<file or fifo> replays a recorded encoder stream instead
+# of the hardware encoder.
+STREAM_MODES = ['software', 'mjpeg', 'h264']
+STREAM_IDLE_AFTER = 10
+broadcasters = {}
+broadcasters_lock = threading.Lock()
+
+def make_stream_source(mode):
+    if mode == 'software':
+        if IS_PICAMERA2:
+            return HeldSource(session, CameraSessionSource(session), f'stream_{mode}')
+        if os.environ.get('ACTIONPI_FAKE_CAMERA'):
+            return FakeCameraSource()
+        return None
+    codec = 'h264' if mode == 'h264' else 'mjpeg'
+    stand_in = os.environ.get('ACTIONPI_STREAM_FILE')
+    if stand_in:
+        return FileChunkSource(stand_in, codec, rate=24)
+    if HARDWARE_ENCODER:
+        return HeldSource(session, EncoderChunkSource(picam2, codec, name=session.preview_stream), f'stream_{mode}')
+    return PipeChunkSource(libcamera_vid_command(codec), codec)
+
+def get_broadcaster(mode):
+    init_hardware()
+    with broadcasters_lock:
+        if mode not in broadcasters:
+            source = make_stream_source(mode)
+            # H.264 readers consume every chunk in order, so they need more slack
+            broadcasters[mode] = source and FrameBroadcaster(source, ring_size=256 if mode == 'h264' else 4,
+                                                             idle_after=STREAM_IDLE_AFTER)
+            if broadcasters[mode] is not None:
+                apply_thermal_level()
+                telemetry.register(f'stream_{mode}', lambda b=broadcasters[mode]: stream_metrics(b))
+        return broadcasters[mode]
+
+def stream_metrics(broadcaster):
+    return {
+        "frames_captured_total": broadcaster.frames_captured,
+        "frames_dropped_total": broadcaster.frames_dropped,
+        "frames_skipped_total": broadcaster.frames_skipped,
+        "paused": broadcaster.paused,
+        "clients": broadcaster.clients,
+        "read_ms": round(broadcaster.read_ms, 2),
+    }
+
+
+# Catalog of captured media; pages are served from it instead of listing
+# and stat'ing every file on each request
+media_index = MediaIndex(BASE_DIR, kinds=DIRECTORIES)
+
+# Quotas, free space and retention, see storage.py for the ACTIONPI_* settings
+storage = StorageManager.from_env(BASE_DIR, media_index)
+
+thumbnail_cache = ThumbnailCache(BASE_DIR)
+
+def catch_up_media():
+    # A full rescan of a big card takes a while; it should not hold up the camera
+    media_index.reconcile(force=True)
+    thumbnail_cache.backfill(media_index.iter_paths())
+
+threading.Thread(target=catch_up_media, name="media-catch-up", daemon=True).start()
+
+# Temperature, throttling, system load and pipeline counters, sampled every
+# couple of seconds on one thread; served by /metrics and /telemetry.
+# ACTIONPI_THERMAL_ZONE points the temperature at another file, e.g. to
+# exercise the thermal governor off the Pi.
+THERMAL_ZONE = os.environ.get('ACTIONPI_THERMAL_ZONE', THERMAL_ZONE)
+telemetry = Telemetry(thermal_zone=THERMAL_ZONE)
+telemetry.register('thumbnails', lambda: {
+    "hits_total": thumbnail_cache.hits,
+    "misses_total": thumbnail_cache.misses,
+    "memory_items": thumbnail_cache.stats()["memory_items"],
+})
+telemetry.register('storage', lambda: {"free_bytes": storage.free_bytes()})
+telemetry.register('processes', lambda: {"active": len(runner.active())})
+telemetry.register('startup', startup.metrics)
+telemetry.register('camera', lambda: {
+    "captures_total": session.captures,
+    "encode_ms": round(session.encode_ms, 2),
+} if IS_PICAMERA2 else {})
+telemetry.start()
+
+# Thermal governor: as the SoC heats up the preview gets slower, smaller and
+# more compressed, timelapse frames further apart and the preview pauses
+# while recording; see governor.py for the policy. Recordings are never
+# stopped for heat, they start at the frame rate of the current level.
+recording = threading.Event()  # set while a video is recorded
+current_timelapse = None
+
+def recent_cpu_percent(samples=5):
+    """Mean CPU use over the last few telemetry samples, so only sustained load counts."""
+    values = [s["system"]["cpu_percent"] for s in list(telemetry.history)[-samples:] if "cpu_percent" in s["system"]]
+    return sum(values) / len(values) if values else None
+
+def firmware_throttled():
+    flags = read_throttled()
+    return flags is not None and bool(flags & 0b1110)  # frequency capped, throttled or soft limit
+
+def apply_thermal_level(level=None):
+    level = level or governor.level
+    if IS_PICAMERA2:
+        session.preview_quality = level.jpeg_quality
+        session.preview_reduce = level.preview_reduce
+    for mode, broadcaster in list(broadcasters.items()):
+        if broadcaster is None or mode == 'h264':
+            continue  # H.264 readers need every chunk
+        broadcaster.max_fps = level.preview_fps
+        if recording.is_set() and level.pause_preview_while_recording:
+            broadcaster.pause()
+        else:
+            broadcaster.resume()
+    if current_timelapse is not None:
+        current_timelapse.interval_floor = level.timelapse_interval_floor
+
+governor = Governor(lambda: read_temperature(THERMAL_ZONE), recent_cpu_percent, firmware_throttled)
+governor.add_listener(apply_thermal_level)
+telemetry.register('governor', lambda: {"level": governor.index, "temperature_c": governor.temperature})
+governor.start()
+
+
+# Capture jobs
+# All captures run on the job queue's worker thread, one at a time, so a
+# request returns immediately and two captures never reconfigure the camera
+# at the same time.
+job_queue = JobQueue(maxsize=4)
+telemetry.register('jobs', lambda: {
+    "queued": sum(1 for job in job_queue.active() if job.status == 'queued'),
+    "running": int(job_queue.current is not None),
+})
+
+def capture_space(kind, duration=0, interval=1, video=False, keep_frames=True, count=0):
+    """(media kind, estimated bytes) of a capture job, with the parameters of its route."""
+    if kind == 'photo':
+        if PHOTO_FULL_RESOLUTION and IS_PICAMERA2:
+            return 'photos', estimate_bytes('photos', size=session.configs[STILL]["main"]["size"])
+        return 'photos', estimate_bytes('photos')
+    if kind == 'burst':
+        return 'photos', estimate_bytes('photos') * ((count or BURST_MAX_FRAMES) + BURST_PRE_TRIGGER)
+    if kind == 'video':
+        if preroll is not None and preroll.armed:
+            duration += PREROLL_SECONDS
+        return 'videos', estimate_bytes('videos', duration=duration)  # seconds
+    return 'timelapses', estimate_bytes('timelapses', duration=duration * 60, interval=interval,  # minutes
+                                        video=video, keep_frames=keep_frames)
+
+def turn_on_leds():
+    try:
+        print("Turning on LEDs...")
+        led_strip.turn_on()  # Turn on all LEDs to white
+        time.sleep(0.5)  # Wait for half a second
+    except Exception as e:
+        print(e)
+
+def turn_off_leds():
+    try:
+        print("Turning off LEDs...")
+        led_strip.turn_off()  # Turn off all LEDs
+        time.sleep(1)  # Wait for a second
+    except Exception as e:
+        print(e)
+
+
+# Capturing photo
+# Photos come from the running 2028x1520 main stream: no mode switch, so the
+# preview does not skip. ACTIONPI_PHOTO_FULL_RES=1 uses the full sensor
+# instead (4x the pixels on a 12 MP sensor), switching the camera to the
+# still configuration for that one frame.
+PHOTO_FULL_RESOLUTION = os.environ.get('ACTIONPI_PHOTO_FULL_RES') == '1'
+
+def capture_photo(job):
+    if not IS_PICAMERA2:
+        raise RuntimeError("no camera")
+    # Ensure LEDs are turned on before capturing; their fixed settling pause
+    # is reported on its own rather than inflating the trigger-to-file time
+    t0 = time.monotonic()
+    turn_on_leds()
+    led_seconds = time.monotonic() - t0
+
+    # Generate the filename
+    filename = datetime.now().strftime("%Y%m%d_%H%M%S.jpg")
+    filepath = os.path.join(BASE_DIR, "photos", f"photo_{filename}")
+    print(f"Capturing photo to {filepath}")
+
+    # Capture the photo using Picamera2
+    try:
+        with storage.reserve(*capture_space('photo'), filepath, job.cancel_event):
+            session.capture_still(filepath, full_resolution=PHOTO_FULL_RESOLUTION)
+        latency = time.time() - job.created - led_seconds
+        startup.record_latency('photo', latency)
+        media_index.add(filepath, 'photos')
+        thumbnail_cache.submit(os.path.relpath(filepath, BASE_DIR))
+    finally:
+        # Ensure LEDs are turned off after capturing
+        turn_off_leds()
+    return {"path": os.path.relpath(filepath, BASE_DIR), "trigger_to_file_ms": round(latency * 1000, 1),
+            "led_ms": round(led_seconds * 1000, 1)}
+
+
+# Burst: stills as fast as the running camera delivers them, into a ring of
+# at most ACTIONPI_BURST_MB, encoded by a small pool. The ring only exists
+# during a burst or while armed; arming keeps the last ACTIONPI_BURST_PRE
+# frames from before the trigger.
+BURST_PRE_TRIGGER = int(os.environ.get('ACTIONPI_BURST_PRE', 8))
+BURST_MB = float(os.environ.get('ACTIONPI_BURST_MB', 64))
+BURST_MAX_FRAMES = 200
+burst = None
+
+def get_burst():
+    global burst
+    init_hardware()
+    with hardware_lock:
+        if burst is None and IS_PICAMERA2:
+            burst = BurstCapture(make_grabber(picam2), pre_trigger=BURST_PRE_TRIGGER,
+                                 max_bytes=int(BURST_MB * 2**20))
+        return burst
+
+def capture_burst(job, count):
+    if get_burst() is None:
+        raise RuntimeError("no camera")
+    photos_dir = os.path.join(BASE_DIR, "photos")
+    prefix = datetime.now().strftime("burst_%Y%m%d_%H%M%S")
+    # The storage watch ends an open-ended burst (count=0) when space runs out,
+    # measuring the frames (prefix_0000.jpg, ...) by the start of their names
+    frames_path = os.path.join(photos_dir, prefix + "_")
+    with storage.reserve(*capture_space('burst', count=count), frames_path, job.cancel_event) as reservation:
+        # The LEDs go on without the settling pauses of a single photo
+        try:
+            led_strip.turn_on()
+        except Exception as e:
+            print(e)
+        session.hold('burst_capture')
+        try:
+            summary = burst.burst(photos_dir, prefix, count=count or None, stop_event=job.cancel_event,
+                                  max_frames=BURST_MAX_FRAMES)
+        finally:
+            session.release('burst_capture')
+            try:
+                led_strip.turn_off()
+            except Exception as e:
+                print(e)
+    for filename in summary["files"]:
+        media_index.add(filename, 'photos')
+        thumbnail_cache.submit(os.path.relpath(filename, BASE_DIR))
+    return dict(summary, files=[os.path.relpath(f, BASE_DIR) for f in summary["files"]], stopped=reservation.stopped)
+
+
+# Pre-roll: while armed the H.264 encoder keeps running into a ring of
+# ACTIONPI_PREROLL_MB, and a recording starts with up to the last
+# ACTIONPI_PREROLL_SECONDS from before the trigger. Arming takes the camera
+# into the video mode, so it disarms the burst pre-trigger and vice versa.
+PREROLL_SECONDS = float(os.environ.get('ACTIONPI_PREROLL_SECONDS', 10))
+PREROLL_MB = float(os.environ.get('ACTIONPI_PREROLL_MB', 24))
+PREROLL_BITRATE = 10000000
+preroll = None
+
+def make_preroll_source(framerate):
+    # A keyframe every second, so the pre-roll can start within a second of the limit
+    stand_in = os.environ.get('ACTIONPI_STREAM_FILE')
+    if stand_in:
+        return FileChunkSource(stand_in, 'h264', rate=framerate)
+    if HARDWARE_ENCODER:
+        # Unbounded: a chunk dropped while recording would corrupt the MP4. The
+        # reader thread only copies into the ring, so the queue stays short.
+        return EncoderChunkSource(picam2, 'h264', bitrate=PREROLL_BITRATE, max_pending=None, iperiod=framerate)
+    return PipeChunkSource(libcamera_vid_command('h264', 1920, 1080, framerate, intra=framerate), 'h264')
+
+def arm_preroll():
+    global preroll
+    init_hardware()
+    with hardware_lock:
+        if preroll is not None and preroll.armed:
+            return preroll
+        if burst is not None and burst.armed:
+            burst.disarm()
+            session.release('burst')
+        framerate = governor.level.video_framerate
+        if HARDWARE_ENCODER:
+            session.set_mode(VIDEO)
+            session.picam2.set_controls({"FrameRate": framerate})
+        preroll = PrerollRecorder(make_preroll_source(framerate), int(PREROLL_MB * 2**20),
+                                  PREROLL_SECONDS, framerate=framerate)
+        preroll.arm()
+        return preroll
+
+def disarm_preroll():
+    with hardware_lock:
+        if preroll is None or not preroll.armed or preroll.recording:
+            return  # a recording keeps it until it is done
+        preroll.disarm()
+        if HARDWARE_ENCODER:
+            session.set_mode(DUAL)
+
+
+# Capturing video
+def record_video(job, duration):
+    # Generate filename; the MP4 is muxed while recording, no conversion pass
+    filename_mp4 = datetime.now().strftime(os.path.join(BASE_DIR, "videos", "video_%Y%m%d_%H%M%S.mp4"))
+    thumbnail = os.path.join(BASE_DIR, thumbnail_path('videos', os.path.basename(filename_mp4)))
+
+    # Record the video; the storage watch stops it early when space runs out
+    # Entered right away, so the reservation is released whatever fails
+    with storage.reserve(*capture_space('video', duration=duration), filename_mp4, job.cancel_event) as reservation:
+        level = governor.level
+        recording.set()
+        apply_thermal_level()
+        turn_on_leds()
+        try:
+            if preroll is not None and preroll.armed:
+                result = preroll.record(filename_mp4, duration, thumbnail=thumbnail, stop_event=job.cancel_event)
+            elif HARDWARE_ENCODER:
+                result = record_with_session(session, filename_mp4, duration, framerate=level.video_framerate,
+                                             thumbnail=thumbnail, stop_event=job.cancel_event)
+            else:
+                result = record_with_libcamera(filename_mp4, duration, framerate=level.video_framerate,
+                                               thumbnail=thumbnail, stop_event=job.cancel_event)
+        finally:
+            turn_off_leds()
+            recording.clear()
+            apply_thermal_level()
+    media_index.add(filename_mp4, 'videos', duration=result["seconds"])
+    framerate = preroll.framerate if "preroll_seconds" in result else level.video_framerate
+    return dict(result, stopped=reservation.stopped, thermal_level=level.name, framerate=framerate)
+
+
+# Capturing timelapse
+def capture_timelapse(job, interval, duration, video=False, keep_frames=True):
+    global current_timelapse
+    # Generate the folder and filename
+    foldername = datetime.now().strftime("timelapse_%Y%m%d_%H%M%S")
+    folder_path = os.path.join(BASE_DIR, "timelapses", foldername)
+    space = capture_space('timelapse', duration=duration, interval=interval, video=video, keep_frames=keep_frames)
+    # Entered right away, so the reservation is released whatever fails
+    with storage.reserve(*space, folder_path, job.cancel_event) as reservation:
+        os.makedirs(folder_path)
+        print(f"Capturing timelapse in {folder_path}")
+
+        if IS_PICAMERA2:
+            capture = session_capture(session)
+        else:
+            source = FakeCameraSource(fps=1000)
+            source.start()
+            capture = source.read
+        sinks = [VideoAssembler(os.path.join(folder_path, VIDEO_NAME))] if video else []
+        engine = TimelapseEngine(capture, folder_path, interval, duration=duration * 60,  # duration in minutes
+                                 stop_event=job.cancel_event, sinks=sinks, keep_frames=keep_frames)
+        telemetry.register('timelapse', lambda: {
+            "frames_total": engine.frames,
+            "missed_slots_total": engine.missed,
+            "queue_depth": engine.queue_depth,
+            "max_lateness_ms": round(max(engine.lateness[-10:], default=0) * 1000, 2),
+        })
+        engine.interval_floor = governor.level.timelapse_interval_floor
+        current_timelapse = engine
+        try:
+            summary = engine.run()
+        finally:
+            current_timelapse = None
+            telemetry.unregister('timelapse')
+    print(f"Timelapse finished: {summary}")
+    media_index.add(folder_path, 'timelapses', duration=summary["frames"] * interval)
+    thumbnail_cache.submit(os.path.relpath(folder_path, BASE_DIR))
+    return dict(summary, folder=folder_path, stopped=reservation.stopped)
+
+
+CAPTURES = {
+    'photo': capture_photo,
+    'burst': capture_burst,
+    'video': record_video,
+    'timelapse': capture_timelapse,
+}
+
+
+# Motion trigger: frame differencing on the Y plane of the lores stream at a
+# few fps (motion.py, needs NumPy), queueing one of these captures. A video
+# started by motion also gets the pre-roll if it is armed.
+MOTION_ACTIONS = {'photo': {}, 'burst': {"count": 10}, 'video': {"duration": 20}}
+motion = None
+
+def start_motion(action='photo', pixel_threshold=20, min_area=0.005, roi=None, cooldown=10, fps=4):
+    global motion
+    from motion import MotionDetector, MotionTrigger, lores_luma, parse_roi
+    if action not in MOTION_ACTIONS:
+        raise ValueError(f"motion can start {', '.join(MOTION_ACTIONS)}, not {action}")
+    detector = MotionDetector(pixel_threshold=pixel_threshold, min_area=min_area, roi=parse_roi(roi))
+    init_hardware()
+    if not IS_PICAMERA2:
+        raise RuntimeError("no camera")
+    params = MOTION_ACTIONS[action]
+
+    def on_motion(score):
+        try:
+            storage.check(*capture_space(action, **params))
+            job_queue.submit(action, CAPTURES[action], **params)
+        except (QueueFull, StorageFull) as e:
+            print(f"Motion {action} skipped: {e}")
+
+    stop_motion()
+    motion = MotionTrigger(lambda: lores_luma(session), detector, on_motion, fps=fps, cooldown=cooldown,
+                           busy=lambda: job_queue.current is not None)
+    motion.start()
+    telemetry.register('motion', lambda: {
+        "frames_total": detector.frames,
+        "triggers_total": motion.triggers,
+        "cost_ms": round(detector.cost_ms, 3),
+        "score": round(detector.last_score, 4),
+    })
+    return motion
+
+def stop_motion():
+    if motion is not None:
+        motion.stop()
+
+
+# Offload: with ACTIONPI_SYNC_TARGET set, new media is copied to another host
+# or disk in the background and marked offloaded in the catalog, pausing
+# while a capture runs; see sync.py for the targets and other settings.
+# ACTIONPI_RETENTION=offloaded then frees space with those copies only.
+sync = SyncManager.from_env(BASE_DIR, media_index, busy=lambda: job_queue.current is not None,
+                            delete=storage.delete)
+if sync is not None:
+    sync.start()
+    telemetry.register('sync', lambda: {
+        "items_total": sync.items_total,
+        "bytes_total": sync.bytes_total,
+        "errors_total": sync.errors,
+        "reachable": int(bool(sync.reachable)),
+    })
+
+
+class CaptureService:
+    """Everything a front-end may ask of the capture core.
+
+    Results are plain JSON-able values, so capture_client.CaptureClient can
+    offer the same methods over the daemon's socket; `broadcaster()` and the
+    generators are the exceptions, the client relays those itself.
+    """
+
+    def start(self, background=False):
+        """Open and warm up the camera; in the background so a front-end can serve meanwhile."""
+        if background:
+            threading.Thread(target=init_hardware, name="camera-start", daemon=True).start()
+        else:
+            init_hardware()
+
+    # Jobs
+
+    def submit(self, kind, **params):
+        """Queue a capture; raises StorageFull or QueueFull, returns the job."""
+        if kind not in CAPTURES:
+            raise ValueError(f"unknown capture {kind}")
+        init_hardware()
+        # Refuse right away what cannot fit; the job checks again when it starts
+        storage.check(*capture_space(kind, **params))
+        return job_queue.submit(kind, CAPTURES[kind], **params).to_dict()
+
+    def jobs(self):
+        return [job.to_dict() for job in job_queue.list()]
+
+    def job(self, job_id):
+        job = job_queue.get(job_id)
+        return job and job.to_dict()
+
+    def cancel(self, job_id):
+        job = job_queue.cancel(job_id)
+        return job and job.to_dict()
+
+    def cancel_kind(self, kind):
+        return [job_queue.cancel(job.id).to_dict() for job in job_queue.active(kind)]
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job has finished (or `timeout`) and return it."""
+        job = job_queue.get(job_id)
+        if job is None:
+            return None
+        job.wait(timeout)
+        return job.to_dict()
+
+    # Burst pre-trigger
+
+    def arm_burst(self):
+        if get_burst() is None:
+            return None
+        disarm_preroll()
+        session.hold('burst')
+        burst.arm()
+        return burst.stats()
+
+    def disarm_burst(self):
+        if burst is None:
+            return {"armed": False}
+        burst.disarm()
+        session.release('burst')
+        return burst.stats()
+
+    # Video pre-roll
+
+    def arm_preroll(self):
+        return arm_preroll().stats()
+
+    def disarm_preroll(self):
+        disarm_preroll()
+        return preroll.stats() if preroll is not None else {"armed": False}
+
+    # Motion trigger
+
+    def start_motion(self, action='photo', pixel_threshold=20, min_area=0.005, roi=None, cooldown=10, fps=4):
+        return start_motion(action, pixel_threshold, min_area, roi, cooldown, fps).stats()
+
+    def stop_motion(self):
+        stop_motion()
+        return motion.stats() if motion is not None else {"running": False}
+
+    # Offload
+
+    def sync_now(self):
+        """Start an offload round now; None without a sync target."""
+        if sync is None:
+            return None
+        sync.wake()
+        return sync.stats()
+
+    # State
+
+    def status(self, name):
+        """'storage', 'governor', 'camera_session', 'processes', 'burst', 'preroll', 'motion', 'sync'
+        or 'startup'; None if there is none."""
+        if name == 'storage':
+            return storage.stats()
+        if name == 'governor':
+            return governor.stats()
+        if name == 'camera_session':
+            return session.stats() if IS_PICAMERA2 else None
+        if name == 'burst':
+            return burst.stats() if burst is not None else None
+        if name == 'preroll':
+            return preroll.stats() if preroll is not None else None
+        if name == 'motion':
+            return motion.stats() if motion is not None else None
+        if name == 'sync':
+            return sync.stats() if sync is not None else None
+        if name == 'startup':
+            return startup.stats()
+        if name == 'processes':
+            return {
+                "active": [{"name": p.name, "pid": p.pid, "cmd": p.cmd} for p in runner.active()],
+                "finished": runner.stats(),
+            }
+        raise ValueError(f"unknown status {name}")
+
+    def temperature(self):
+        return read_temperature(THERMAL_ZONE)
+
+    def disk_usage(self):
+        # Cached statvfs of the media directory, cheap enough for every page view
+        total, used, free = storage.disk_usage()
+        # Convert from bytes to gigabytes
+        total_gb = round(total / (2**30), 1)
+        used_gb = round(used / (2**30), 1)
+        free_gb = round(free / (2**30), 1)
+        return {"total_gb": total_gb, "used_gb": used_gb, "free_gb": free_gb}
+
+    def telemetry(self, history=0):
+        return {"latest": telemetry.latest(), "history": list(telemetry.history)[-history:] if history > 0 else []}
+
+    def metrics(self):
+        return telemetry.prometheus()
+
+    def telemetry_events(self):
+        """Server-Sent Events text, one sample at a time."""
+        return telemetry.sse()
+
+    # Streams
+
+    def has_stream(self, mode):
+        return mode in STREAM_MODES and get_broadcaster(mode) is not None
+
+    def broadcaster(self, mode):
+        return get_broadcaster(mode) if mode in STREAM_MODES else None
+
+    def stream(self, mode):
+        """(capture time, chunk) of one stream client; H.264 starts at a keyframe and keeps every chunk."""
+        broadcaster = self.broadcaster(mode)
+        if broadcaster is None:
+            raise ValueError(f"no {mode} stream")
+        if mode == 'h264':
+            return ((time.time(), chunk) for chunk in h264_chunks(broadcaster))
+        return broadcaster.timed_frames()
+
+
+service = CaptureService()
+startup.mark('core_loaded')
@@ -0,0 +1,94 @@
+"""The one process that owns the camera.
+
+python3 capture_daemon.py opens the camera once, keeps it running and
+serves capture_core's CaptureService on a Unix socket (ACTIONPI_CAPTURE_SOCKET,
+default /tmp/actionpi-capture.sock); see capture_client.py for the protocol.
+server.py and camera.py started with the same ACTIONPI_CAPTURE_SOCKET are
+thin clients of it.
+"""
+import json
+import os
+import signal
+import socketserver
+import sys
+
+from capture_client import DEFAULT_SOCKET, HEADER, METHODS, STREAM_METHODS
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                method = request["method"]
+                params = request.get("params") or {}
+                if method in STREAM_METHODS:
+                    items = getattr(service, method)(**params)
+                elif method in METHODS:
+                    reply = {"result": getattr(service, method)(**params)}
+                else:
+                    raise ValueError(f"unknown method {method}")
+            except Exception as e:
+                reply = {"error": str(e), "type": type(e).__name__}
+                method = None
+            if method in STREAM_METHODS:
+                self._send_stream(items)
+                return
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+
+    def _send_stream(self, items):
+        try:
+            self.wfile.write(b'{"result": "stream"}\n')
+            for item in items:
+                if isinstance(item, str):
+                    timestamp, data = 0.0, item.encode()
+                else:
+                    timestamp, data = item
+                self.wfile.write(HEADER.pack(len(data), timestamp))
+                self.wfile.write(data)
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client went away
+        finally:
+            items.close()
+
+
+class CaptureServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.service = service
+        if os.path.exists(path):
+            os.remove(path)  # left over from a daemon that did not exit cleanly
+        super().__init__(path, Handler)
+        os.chmod(path, 0o660)
+
+
+def stop(signum, frame):
+    # Only once: a second SIGTERM while shutting down ends the process outright
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    sys.exit(0)
+
+
+def main():
+    path = os.environ.get('ACTIONPI_CAPTURE_SOCKET', DEFAULT_SOCKET)
+    import capture_core
+    # Camera start-up and warm-up happen here, once, not per client or capture;
+    # clients can connect meanwhile, their first capture waits for the camera
+    capture_core.service.start(background=True)
+    server = CaptureServer(path, capture_core.service)
+    signal.signal(signal.SIGTERM, stop)
+    capture_core.startup.mark('listening')
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.server_close()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
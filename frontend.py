@@ -0,0 +1,58 @@
+"""What the web front-ends (server.py on Flask, async_server.py on FastAPI) share.
+
+Captures, streams, storage limits and telemetry belong to the capture core,
+which owns the camera: in capture_daemon.py when ACTIONPI_CAPTURE_SOCKET
+names its socket, otherwise loaded into this process. Nothing here needs a
+web framework.
+"""
+import os
+
+from capture_client import connect
+from media_index import MediaIndex
+from storage import remove_media
+from thumbnails import ThumbnailCache
+
+BASE_DIR = os.environ.get('ACTIONPI_BASE_DIR', '.')#/home/pi/camera'  # This should be the base directory where your files are located
+DIRECTORIES = ['photos', 'videos', 'timelapses']
+THUMBNAIL_DIRECTORIES = {dir: os.path.join('thumbnails', dir) for dir in DIRECTORIES}
+PAGE_SIZE = 50
+STREAM_MODES = ['software', 'mjpeg', 'h264']
+BURST_MAX_FRAMES = 200  # for count=0, which keeps going until /stop_burst
+
+capture = connect()
+if os.environ.get('ACTIONPI_CAPTURE_SOCKET'):
+    # Only the gallery is served from here; the daemon keeps the catalog up to date
+    for dir in DIRECTORIES + ['thumbnails']:
+        os.makedirs(os.path.join(BASE_DIR, dir), exist_ok=True)
+    media_index = MediaIndex(BASE_DIR, kinds=DIRECTORIES)
+    thumbnail_cache = ThumbnailCache(BASE_DIR)
+else:
+    import capture_core
+    BASE_DIR, media_index, thumbnail_cache = capture_core.BASE_DIR, capture_core.media_index, capture_core.thumbnail_cache
+
+
+def valid_media_path(filepath):
+    """True for a path inside one of the media directories that does not climb out of it."""
+    parts = filepath.split('/')
+    return parts[0] in DIRECTORIES and '..' not in parts
+
+
+def delete_media(filepath):
+    """Delete one photo, video or timelapse and its thumbnail; False if the path is not one."""
+    parts = filepath.split('/')
+    # 'photos', 'photos/' or 'photos/.' would be the whole kind
+    if not valid_media_path(filepath) or len(parts) < 2 or {'', '.'} & set(parts):
+        return False
+    remove_media(BASE_DIR, media_index, filepath)
+    return True
+
+
+def delete_all_media(kind):
+    for entry in os.scandir(os.path.join(BASE_DIR, kind)):
+        remove_media(BASE_DIR, media_index, os.path.join(kind, entry.name))
+    media_index.remove_kind(kind)
+
+
+def cpu_temperature():
+    temperature = capture.temperature()
+    return "n/a" if temperature is None else f"{temperature:.1f}"
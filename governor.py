@@ -0,0 +1,166 @@
+"""Thermal governor: trades preview quality for headroom as the Pi heats up.
+
+Policy (DEFAULT_POLICY). A level is entered when the SoC temperature reaches
+its `enter_c`, and left for a cooler one only once the temperature has
+dropped `hysteresis` °C below that and stayed there for `hold` seconds, so
+the settings do not flap around a threshold. Sustained CPU use above
+`busy_percent` or firmware throttling raises the level by one.
+
+    level     enter  preview      quality  timelapse    preview while  video
+                     fps, scale            interval     recording      fps
+    normal    -      any, 1/1     75       -            on             24
+    warm      65°C   5, 1/1       70       >= 2 s       on             24
+    hot       75°C   2, 1/2       60       >= 5 s       paused         20
+    critical  80°C   1, 1/2       50       >= 10 s      paused         15
+
+Recordings are never stopped for heat: the video frame rate is chosen
+when a recording starts and everything else gives way first.
+"""
+import collections
+import threading
+import time
+
+
+class Level:
+    def __init__(self, name, enter_c, preview_fps, preview_reduce, jpeg_quality,
+                 timelapse_interval_floor, pause_preview_while_recording, video_framerate):
+        self.name = name
+        self.enter_c = enter_c  # °C at which this level starts
+        self.preview_fps = preview_fps  # cap for the preview streams, None for none
+        self.preview_reduce = preview_reduce  # preview frames are downscaled by this factor
+        self.jpeg_quality = jpeg_quality  # of software-encoded preview frames
+        self.timelapse_interval_floor = timelapse_interval_floor  # seconds between timelapse frames, at least
+        self.pause_preview_while_recording = pause_preview_while_recording
+        self.video_framerate = video_framerate  # for recordings started at this level
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+DEFAULT_POLICY = [
+    Level("normal", None, None, 1, 75, 0, False, 24),  # no preview cap, as without a governor
+    Level("warm", 65, 5, 1, 70, 2, False, 24),
+    Level("hot", 75, 2, 2, 60, 5, True, 20),
+    Level("critical", 80, 1, 2, 50, 10, True, 15),
+]
+
+
+class Governor:
+    """Picks a policy level from temperature, load and throttling, and tells listeners.
+
+    The sources are injected: temperature_source() returns °C (or None),
+    load_source() CPU percent (or None) and throttled_source() True while
+    the firmware throttles. update() evaluates once, start() every
+    `interval` seconds. Every change is logged with its reason in
+    `decisions`.
+    """
+
+    def __init__(self, temperature_source, load_source=None, throttled_source=None,
+                 policy=DEFAULT_POLICY, hysteresis=3.0, hold=30.0, busy_percent=90, interval=5.0,
+                 clock=time.monotonic):
+        self.temperature_source = temperature_source
+        self.load_source = load_source
+        self.throttled_source = throttled_source
+        self.policy = policy
+        self.hysteresis = hysteresis
+        self.hold = hold
+        self.busy_percent = busy_percent
+        self.interval = interval
+        self.clock = clock
+        self.index = 0
+        self.temperature = None
+        self.decisions = collections.deque(maxlen=100)
+        self._cool_since = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def level(self):
+        return self.policy[self.index]
+
+    def add_listener(self, callback):
+        """callback(level) on every level change, and once right away."""
+        self._listeners.append(callback)
+        callback(self.level)
+
+    def _thermal_index(self, temperature):
+        index = 0
+        for i, level in enumerate(self.policy):
+            if level.enter_c is not None and temperature >= level.enter_c:
+                index = i
+        return index
+
+    def update(self):
+        """Read the sources, move to the right level and return it."""
+        temperature = self.temperature_source()
+        load = self.load_source() if self.load_source else None
+        throttled = bool(self.throttled_source()) if self.throttled_source else False
+        with self._lock:
+            self.temperature = temperature
+            target = self._thermal_index(temperature) if temperature is not None else 0
+            reasons = [f"{temperature:.1f}°C" if temperature is not None else "no temperature"]
+            if throttled or (load is not None and load >= self.busy_percent):
+                target = min(target + 1, len(self.policy) - 1)
+                reasons.append("firmware throttling" if throttled else f"CPU {load:.0f}%")
+            if target > self.index:
+                self._change(target, reasons)
+            elif target < self.index:
+                # Step down one level at a time, after cooling off for `hold` seconds
+                enter_c = self.level.enter_c
+                cool = temperature is None or enter_c is None or temperature <= enter_c - self.hysteresis
+                now = self.clock()
+                if not cool:
+                    self._cool_since = None
+                elif self._cool_since is None:
+                    self._cool_since = now
+                elif now - self._cool_since >= self.hold:
+                    self._change(self.index - 1, reasons + [f"below {enter_c - self.hysteresis:.0f}°C for {self.hold:.0f} s"])
+            else:
+                self._cool_since = None
+            return self.level
+
+    def _change(self, index, reasons):
+        old = self.level
+        self.index = index
+        self._cool_since = None
+        decision = {"time": time.time(), "from": old.name, "to": self.level.name, "reason": ", ".join(reasons)}
+        self.decisions.append(decision)
+        print(f"Thermal governor: {old.name} -> {self.level.name} ({decision['reason']})")
+        for callback in self._listeners:
+            try:
+                callback(self.level)
+            except Exception as e:
+                print(f"Thermal governor listener failed: {e}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="thermal-governor", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.update()
+            except Exception as e:
+                print(f"Thermal governor update failed: {e}")
+            time.sleep(self.interval)
+
+    def stats(self):
+        return {
+            "level": self.level.to_dict(),
+            "temperature_c": self.temperature,
+            "decisions": list(self.decisions),
+        }
+
+
+if __name__ == '__main__':
+    # Replay a heat-up and cool-down with an injected temperature source and clock
+    ramp = [50, 60, 66, 70, 76, 81, 83, 79, 76, 74, 72, 70, 68, 64, 62, 60, 58]
+    now = [0.0]
+    readings = iter(ramp)
+    governor = Governor(lambda: next(readings), clock=lambda: now[0], hold=20)
+    for _ in ramp:
+        level = governor.update()
+        print(f"t={now[0]:>4.0f}s {governor.temperature:>4.0f}°C -> {level.name}")
+        now[0] += 10
@@ -0,0 +1,238 @@
+import io
+import os
+import struct
+import threading
+import time
+
+from camera_session import MockPicamera2
+
+# Hardware backends. Every backend has a real implementation for the Pi and a
+# simulated one so the same code paths run headless on any Linux box.
+#
+# The backend is chosen by environment variables:
+#   ACTIONPI_CAMERA=auto|picamera2|sim|none  (auto: Picamera2 if it opens, else none)
+#   ACTIONPI_GPIO=auto|rpi|sim               (auto: RPi.GPIO if importable, else sim)
+#   ACTIONPI_LEDS=auto|neopixel|sim          (auto: rpi_ws281x if importable, else sim)
+#   ACTIONPI_SIM_SIZE=4056x3040              sensor size of the simulated camera
+#   ACTIONPI_SIM_LATENCY=0.03                seconds per simulated frame
+
+
+class RpiGpio:
+    """Magnet button and piezo buzzer on the Pi's GPIO header."""
+
+    def __init__(self, button_pin=10, buzzer_pin=11, bouncetime=200):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.button_pin = button_pin
+        self.bouncetime = bouncetime
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(button_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+        GPIO.setup(buzzer_pin, GPIO.OUT)
+        # Initialize PWM for the buzzer
+        self._pwm = GPIO.PWM(buzzer_pin, 100)
+        self._pwm.start(1)
+        self._pwm.ChangeDutyCycle(0)  # stop the buzzer initially
+
+    def on_button(self, callback):
+        """Call callback() on every (debounced) button press, from the GPIO thread."""
+        self.GPIO.add_event_detect(self.button_pin, self.GPIO.RISING,
+                                   callback=lambda channel: callback(), bouncetime=self.bouncetime)
+
+    def is_pressed(self):
+        return self.GPIO.input(self.button_pin) == self.GPIO.HIGH
+
+    def tone(self, frequency):
+        self._pwm.ChangeFrequency(frequency)
+        self._pwm.ChangeDutyCycle(90)
+
+    def silence(self):
+        self._pwm.ChangeDutyCycle(0)
+
+    def cleanup(self):
+        self._pwm.stop()
+        self.GPIO.cleanup()
+
+
+class SimulatedGpio:
+    """GPIO stand-in: press() fakes the button, tones are recorded instead of played."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.tones = []  # (monotonic time, frequency or None for silence)
+        self.held = False
+        self._callbacks = []
+
+    def on_button(self, callback):
+        self._callbacks.append(callback)
+
+    def press(self, hold=False):
+        """A short press, or with hold=True one that lasts until release()."""
+        self.held = hold
+        for callback in self._callbacks:
+            callback()
+
+    def release(self):
+        self.held = False
+
+    def is_pressed(self):
+        return self.held
+
+    def tone(self, frequency):
+        self.tones.append((time.monotonic(), frequency))
+        if self.verbose:
+            print(f"buzzer {frequency:.0f} Hz")
+
+    def silence(self):
+        if self.tones and self.tones[-1][1] is not None:
+            self.tones.append((time.monotonic(), None))
+
+    def cleanup(self):
+        pass
+
+
+class SimulatedCamera(MockPicamera2):
+    """Picamera2 stand-in that delivers frames of the configured size.
+
+    Full-resolution stills come out at `sensor_size`, every capture takes
+    `frame_latency` seconds and reconfiguring `configure_latency`, so capture,
+    streaming and storage paths see realistic sizes and timings. Frames are
+    real JPEGs when Pillow is installed and JPEG-shaped filler otherwise;
+    each carries a frame counter so no two are identical.
+    """
+
+    def __init__(self, sensor_size=(4056, 3040), frame_latency=0.03, configure_latency=0.3):
+        super().__init__(configure_latency=configure_latency, capture_latency=frame_latency)
+        self.sensor_size = tuple(sensor_size)
+        self.frames = 0
+        self._images = {}  # size -> encoded frame without the counter
+        self._lock = threading.Lock()
+
+    def create_still_configuration(self, main=None, lores=None, **kwargs):
+        return self._config("still", main, lores, self.sensor_size)
+
+    def frame_data(self):
+        size = tuple(self.config["main"]["size"])
+        with self._lock:
+            self.frames += 1
+            counter = b"frame %d" % self.frames
+            if size not in self._images:
+                self._images[size] = synthetic_jpeg(size)
+        image = self._images[size]
+        # SOI, then a comment segment with the counter, then the rest of the image
+        return image[:2] + b"\xff\xfe" + struct.pack(">H", len(counter) + 2) + counter + image[2:]
+
+
+def synthetic_jpeg(size):
+    """A JPEG of `size`; a gradient if Pillow is available, filler of a typical size if not."""
+    try:
+        from PIL import Image
+    except ImportError:
+        width, height = size
+        # About 1.5 bits per pixel, like a camera JPEG at default quality
+        return b"\xff\xd8" + bytes(width * height * 3 // 16) + b"\xff\xd9"
+    stream = io.BytesIO()
+    Image.linear_gradient('L').resize(size).convert('RGB').save(stream, format="jpeg")
+    return stream.getvalue()
+
+
+def is_simulated(camera):
+    return isinstance(camera, MockPicamera2)
+
+
+class NeoPixelLeds:
+    """The NeoPixel ring around the lens, driven with rpi_ws281x."""
+
+    def __init__(self, led_count=10, led_pin=18, led_freq_hz=800000, led_dma=10,
+                 led_brightness=255, led_invert=False, led_channel=0):
+        from rpi_ws281x import PixelStrip, Color
+        self.Color = Color
+        self.strip = PixelStrip(led_count, led_pin, led_freq_hz, led_dma, led_invert,
+                                led_brightness, led_channel)
+        self.strip.begin()
+
+    def set_color(self, color):
+        """Set the color (r, g, b) of the whole strip."""
+        for i in range(self.strip.numPixels()):
+            self.strip.setPixelColor(i, self.Color(*color))
+        self.strip.show()
+
+    def turn_on(self, color=(255, 255, 255)):
+        """Turn on all pixels to white or specified color."""
+        self.set_color(color)
+
+    def turn_off(self):
+        self.set_color((0, 0, 0))
+
+
+class SimulatedLeds:
+    """LED stand-in that remembers the current color."""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.color = (0, 0, 0)
+        self.changes = 0
+
+    def set_color(self, color):
+        self.color = tuple(color)
+        self.changes += 1
+        if self.verbose:
+            print(f"LEDs {self.color}")
+
+    def turn_on(self, color=(255, 255, 255)):
+        self.set_color(color)
+
+    def turn_off(self):
+        self.set_color((0, 0, 0))
+
+
+def _backend(name, backend):
+    return (backend or os.environ.get(f"ACTIONPI_{name}") or "auto").lower()
+
+
+def _sim_size():
+    width, height = os.environ.get("ACTIONPI_SIM_SIZE", "4056x3040").lower().split("x")
+    return int(width), int(height)
+
+
+def open_camera(backend=None):
+    """Open the camera backend; returns a Picamera2 (or a stand-in) or None."""
+    backend = _backend("CAMERA", backend)
+    if backend == "none":
+        return None
+    if backend == "sim":
+        print("Using the simulated camera")
+        return SimulatedCamera(_sim_size(), float(os.environ.get("ACTIONPI_SIM_LATENCY", 0.03)))
+    try:
+        from picamera2 import Picamera2
+        return Picamera2()
+    except Exception as e:
+        if backend != "auto":
+            raise
+        print("Picamera2 not found")
+        print(e)
+        return None
+
+
+def open_gpio(backend=None, **kwargs):
+    backend = _backend("GPIO", backend)
+    if backend == "sim":
+        return SimulatedGpio()
+    try:
+        return RpiGpio(**kwargs)
+    except (ImportError, RuntimeError):
+        if backend != "auto":
+            raise
+        print("RPi.GPIO not available, using the simulated GPIO")
+        return SimulatedGpio()
+
+
+def open_leds(backend=None, **kwargs):
+    backend = _backend("LEDS", backend)
+    if backend == "sim":
+        return SimulatedLeds()
+    try:
+        return NeoPixelLeds(**kwargs)
+    except Exception:
+        if backend != "auto":
+            raise
+        return SimulatedLeds()
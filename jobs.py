@@ -0,0 +1,147 @@
+import collections
+import itertools
+import queue
+import threading
+import time
+import traceback
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class Job:
+    def __init__(self, job_id, kind, func, params):
+        self.id = job_id
+        self.kind = kind
+        self.func = func
+        self.params = params
+        self.status = QUEUED
+        self.error = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def cancelled(self):
+        """Capture loops poll this to stop early."""
+        return self._cancel.is_set()
+
+    @property
+    def cancel_event(self):
+        """Event that is set on cancel, for code that takes a stop event."""
+        return self._cancel
+
+    def wait_cancelled(self, timeout):
+        """Sleep for `timeout` seconds or until the job is cancelled; True if cancelled."""
+        return self._cancel.wait(timeout)
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished, failed or been dropped; True unless timed out."""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "error": self.error,
+            "result": self.result,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """Runs capture jobs one at a time on a worker thread that owns the camera.
+
+    Jobs that arrive while the camera is busy wait in a bounded queue; once
+    `maxsize` jobs are waiting, further submissions raise QueueFull instead
+    of piling up.
+    """
+
+    def __init__(self, maxsize=4, history=50):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._jobs = collections.OrderedDict()
+        self._history = history
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.current = None
+        self._thread = threading.Thread(target=self._worker, name="capture-jobs", daemon=True)
+        self._thread.start()
+
+    def submit(self, kind, func, **params):
+        """Queue func(job, **params) and return the Job right away."""
+        with self._lock:
+            job = Job(next(self._ids), kind, func, params)
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"{self._queue.qsize()} jobs already waiting")
+            self._jobs[job.id] = job
+            self._trim()
+        return job
+
+    def _trim(self):
+        # Forget the oldest finished jobs beyond the history limit
+        finished = [j for j in self._jobs.values() if j.finished is not None]
+        for job in finished[:max(0, len(finished) - self._history)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or ask a running one to stop. Returns the job or None."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        if job.status == QUEUED:
+            job.status = CANCELLED
+        return job
+
+    def active(self, kind=None):
+        """Jobs that are queued or running, optionally of one kind."""
+        return [j for j in self._jobs.values()
+                if j.status in (QUEUED, RUNNING) and (kind is None or j.kind == kind)]
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            if job.cancelled:
+                job.status = CANCELLED
+                job.finished = time.time()
+                job._done.set()
+                continue
+            self.current = job
+            job.status = RUNNING
+            job.started = time.time()
+            try:
+                job.result = job.func(job, **job.params)
+                job.status = CANCELLED if job.cancelled else DONE
+            except Exception as e:
+                traceback.print_exc()
+                job.status = FAILED
+                job.error = str(e)
+            job.finished = time.time()
+            job._done.set()
+            self.current = None
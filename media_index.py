@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import threading
+import time
+
+KINDS = ['photos', 'videos', 'timelapses']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,      -- relative to the base directory, e.g. photos/photo_x.jpg
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    ctime REAL NOT NULL,
+    mtime REAL NOT NULL,
+    duration REAL,              -- seconds, for videos and timelapses
+    thumbnail TEXT,
+    offloaded REAL              -- when a copy was made elsewhere, see mark_offloaded()
+);
+CREATE INDEX IF NOT EXISTS media_kind_ctime ON media (kind, ctime DESC);
+CREATE INDEX IF NOT EXISTS media_ctime ON media (ctime);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+
+def thumbnail_path(kind, name):
+    """Where the thumbnail of a media item lives, relative to the base directory."""
+    if kind == 'photos':
+        return os.path.join('thumbnails', kind, name)
+    return os.path.join('thumbnails', kind, os.path.splitext(name)[0] + '.jpg')
+
+
+class MediaIndex:
+    """SQLite catalog of captured media so listing a page does not stat every file.
+
+    Capture code calls add() for what it writes. reconcile() picks up changes
+    made behind our back (deleted files, copies over SSH) by comparing
+    directory mtimes and only listing directories that changed.
+    """
+
+    def __init__(self, base_dir, db_path=None, kinds=KINDS, reconcile_interval=10):
+        self.base_dir = base_dir
+        self.kinds = kinds
+        self.reconcile_interval = reconcile_interval
+        self._last_reconcile = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path or os.path.join(base_dir, 'media.db'), check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(media)")]
+        if columns and 'offloaded' not in columns:
+            self._db.execute("ALTER TABLE media ADD COLUMN offloaded REAL")
+        self._db.executescript(SCHEMA)
+
+    def _stat_item(self, path):
+        full_path = os.path.join(self.base_dir, path)
+        st = os.stat(full_path)
+        size = st.st_size
+        if os.path.isdir(full_path):
+            size = sum(e.stat().st_size for e in os.scandir(full_path) if e.is_file())
+        return st, size
+
+    def add(self, path, kind=None, duration=None):
+        """Insert or refresh one item; `path` is absolute or relative to the base directory."""
+        path = os.path.relpath(path, self.base_dir) if os.path.isabs(path) else os.path.normpath(path)
+        kind = kind or path.split(os.sep)[0]
+        name = os.path.basename(path)
+        try:
+            st, size = self._stat_item(path)
+        except FileNotFoundError:
+            return self.remove(path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO media (path, kind, name, size, ctime, mtime, duration, thumbnail) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size=excluded.size, mtime=excluded.mtime, "
+                "duration=COALESCE(excluded.duration, media.duration), "
+                # A copy made before the item changed is stale; it has to be sent again
+                "offloaded=CASE WHEN excluded.size != media.size OR excluded.mtime != media.mtime "
+                "THEN NULL ELSE media.offloaded END",
+                (path, kind, name, size, st.st_ctime, st.st_mtime, duration, thumbnail_path(kind, name)))
+
+    def remove(self, path):
+        path = os.path.relpath(path, self.base_dir) if os.path.isabs(path) else os.path.normpath(path)
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM media WHERE path = ?", (path,))
+
+    def remove_kind(self, kind):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM media WHERE kind = ?", (kind,))
+
+    def reconcile(self, force=False):
+        """Bring the index in line with the disk, touching only directories that changed."""
+        now = time.monotonic()
+        if not force and now - self._last_reconcile < self.reconcile_interval:
+            return
+        self._last_reconcile = now
+        for kind in self.kinds:
+            dir_path = os.path.join(self.base_dir, kind)
+            try:
+                mtime = os.stat(dir_path).st_mtime
+            except FileNotFoundError:
+                self.remove_kind(kind)
+                continue
+            with self._lock:
+                row = self._db.execute("SELECT mtime FROM dirs WHERE path = ?", (kind,)).fetchone()
+                known = {r[0]: r[1] for r in self._db.execute(
+                    "SELECT name, mtime FROM media WHERE kind = ?", (kind,))}
+            if force or row is None or row['mtime'] != mtime:
+                on_disk = set(os.listdir(dir_path))
+                for name in on_disk - set(known):
+                    self.add(os.path.join(kind, name), kind)
+                for name in set(known) - on_disk:
+                    self.remove(os.path.join(kind, name))
+                with self._lock, self._db:
+                    self._db.execute("INSERT OR REPLACE INTO dirs (path, mtime) VALUES (?, ?)", (kind, mtime))
+            if kind == 'timelapses':
+                # Frames land inside the timelapse folders, which does not
+                # change the mtime of timelapses/ itself
+                for name, item_mtime in known.items():
+                    path = os.path.join(kind, name)
+                    try:
+                        if os.stat(os.path.join(self.base_dir, path)).st_mtime != item_mtime:
+                            self.add(path, kind)
+                    except FileNotFoundError:
+                        self.remove(path)
+
+    def page(self, kind=None, offset=0, limit=50):
+        """Newest-first items, using the (kind, ctime) index."""
+        query = "SELECT * FROM media"
+        args = []
+        if kind:
+            query += " WHERE kind = ?"
+            args.append(kind)
+        query += " ORDER BY ctime DESC LIMIT ? OFFSET ?"
+        args += [limit, offset]
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, args)]
+
+    def iter_paths(self, kind=None, batch=500):
+        """Walk every item path newest first, one page at a time."""
+        offset = 0
+        while True:
+            items = self.page(kind, offset, batch)
+            if not items:
+                return
+            for item in items:
+                yield item['path']
+            offset += len(items)
+
+    def oldest(self, kind=None, offloaded_only=False, limit=50):
+        """Oldest-first items, the candidates for pruning."""
+        query = "SELECT * FROM media WHERE 1"
+        args = []
+        if kind:
+            query += " AND kind = ?"
+            args.append(kind)
+        if offloaded_only:
+            query += " AND offloaded IS NOT NULL"
+        query += " ORDER BY ctime LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._db.execute(query, args)]
+
+    def not_offloaded(self, limit=50):
+        """Oldest-first items without a copy elsewhere, the candidates for sync.py."""
+        with self._lock:
+            return [dict(row) for row in self._db.execute(
+                "SELECT * FROM media WHERE offloaded IS NULL ORDER BY ctime LIMIT ?", (limit,))]
+
+    def mark_offloaded(self, path, when=None):
+        """Record that `path` has a copy elsewhere, so it may be pruned first."""
+        path = os.path.relpath(path, self.base_dir) if os.path.isabs(path) else os.path.normpath(path)
+        with self._lock, self._db:
+            self._db.execute("UPDATE media SET offloaded = ? WHERE path = ?", (when or time.time(), path))
+
+    def count(self, kind=None):
+        with self._lock:
+            if kind:
+                return self._db.execute("SELECT COUNT(*) FROM media WHERE kind = ?", (kind,)).fetchone()[0]
+            return self._db.execute("SELECT COUNT(*) FROM media").fetchone()[0]
+
+    def counts(self):
+        with self._lock:
+            rows = self._db.execute("SELECT kind, COUNT(*), SUM(size) FROM media GROUP BY kind").fetchall()
+        result = {kind: {"count": 0, "size": 0} for kind in self.kinds}
+        for kind, count, size in rows:
+            result[kind] = {"count": count, "size": size or 0}
+        return result
@@ -0,0 +1,221 @@
+import collections
+import threading
+import time
+
+import numpy as np
+
+
+class MotionDetector:
+    """Frame differencing against a running background, on small greyscale frames.
+
+    A pixel counts as changed when it differs from the background by more
+    than `pixel_threshold` grey levels; a frame is motion when more than
+    `min_area` of the pixels in the region of interest changed. `roi` is
+    (left, top, right, bottom) as fractions of the frame. Frames are
+    subsampled by `step` first, so a 320x240 lores frame costs about as
+    much as a 160x120 one. `cost_ms` is the moving average time per frame.
+    """
+
+    def __init__(self, pixel_threshold=20, min_area=0.005, roi=None, step=2, adapt=0.05):
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.roi = roi
+        self.step = step
+        self.adapt = adapt  # how fast the background follows slow changes (light, drift)
+        self.frames = 0
+        self.cost_ms = 0.0
+        self.last_score = 0.0
+        self._background = None
+
+    def _crop(self, frame):
+        frame = frame[::self.step, ::self.step]
+        if self.roi is None:
+            return frame
+        height, width = frame.shape
+        left, top, right, bottom = self.roi
+        return frame[int(top * height):int(bottom * height) or 1, int(left * width):int(right * width) or 1]
+
+    def reset(self):
+        """Forget the background, e.g. after the LEDs or the camera mode changed the picture."""
+        self._background = None
+
+    def score(self, frame):
+        """Fraction of region pixels that changed; `frame` is a 2-D uint8 array."""
+        t0 = time.perf_counter()
+        region = self._crop(frame).astype(np.float32)
+        if self._background is None or self._background.shape != region.shape:
+            self._background = region
+            score = 0.0
+        else:
+            changed = np.abs(region - self._background) > self.pixel_threshold
+            score = float(np.count_nonzero(changed)) / changed.size
+            # Follow the scene slowly, so gradual changes never add up to motion
+            self._background += (region - self._background) * self.adapt
+        self.frames += 1
+        self.last_score = score
+        self.cost_ms += ((time.perf_counter() - t0) * 1000 - self.cost_ms) * 0.1
+        return score
+
+    def detect(self, frame):
+        return self.score(frame) > self.min_area
+
+
+def parse_roi(text):
+    """'left,top,right,bottom' fractions, or None for the whole frame."""
+    if not text:
+        return None
+    roi = tuple(float(v) for v in text.split(','))
+    if len(roi) != 4 or not (0 <= roi[0] < roi[2] <= 1 and 0 <= roi[1] < roi[3] <= 1):
+        raise ValueError(f"roi must be left,top,right,bottom fractions, not {text}")
+    return roi
+
+
+def lores_luma(session):
+    """The Y plane of the running lores stream as a (height, width) uint8 array.
+
+    The lores stream is YUV420, so its first plane already is the greyscale
+    picture; nothing is converted or encoded.
+    """
+    request = session.picam2.capture_request()
+    try:
+        buffer = request.make_buffer('lores')
+        stride = session.picam2.stream_configuration('lores')['stride']
+    finally:
+        request.release()
+    width, height = session.preview_size
+    return np.frombuffer(buffer, dtype=np.uint8, count=stride * height).reshape(height, stride)[:, :width]
+
+
+def synthetic_frames(count, size=(320, 240), moving=range(0), noise=4, seed=0):
+    """Noisy grey frames with a bright square crossing the picture during the frames in `moving`."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    for index in range(count):
+        frame = np.full((height, width), 90, dtype=np.int16) + rng.integers(-noise, noise + 1, (height, width))
+        if index in moving:
+            x = int((index - moving.start) / max(len(moving), 1) * (width - 40))
+            frame[height // 2 - 20:height // 2 + 20, x:x + 40] = 200
+        yield frame.clip(0, 255).astype(np.uint8)
+
+
+def image_frames(paths):
+    """Greyscale frames of recorded JPEGs, e.g. the frames of a timelapse."""
+    from PIL import Image
+    for path in paths:
+        with Image.open(path) as img:
+            img.draft('L', (320, 240))  # let the JPEG decoder downscale
+            yield np.asarray(img.convert('L'))
+
+
+class MotionTrigger:
+    """Runs a MotionDetector on `grab()` frames at `fps` and calls `on_motion(score)`.
+
+    Nothing fires within `cooldown` seconds of the last trigger, and no
+    frames are looked at while `busy()` is true (a capture is running); the
+    background is re-learnt afterwards, so the capture's own lights or mode
+    switch do not count as motion.
+    """
+
+    def __init__(self, grab, detector, on_motion, fps=4, cooldown=10, busy=None, history=50):
+        self.grab = grab
+        self.detector = detector
+        self.on_motion = on_motion
+        self.fps = fps
+        self.cooldown = cooldown
+        self.busy = busy or (lambda: False)
+        self.triggers = 0
+        self.suppressed = 0  # motion seen during the cooldown
+        self.events = collections.deque(maxlen=history)  # (time, score)
+        self._last_trigger = float('-inf')  # monotonic time starts near 0 at boot
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and not self._stop.is_set()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="motion", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        next_due = time.monotonic()
+        while not self._stop.is_set():
+            next_due += 1.0 / self.fps
+            if self.busy():
+                self.detector.reset()
+            else:
+                try:
+                    self.feed(self.grab())
+                except Exception as e:
+                    print(f"Motion detection failed: {e}")
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_due = time.monotonic()  # fell behind; do not try to catch up
+
+    def feed(self, frame, now=None):
+        """Look at one frame; returns True if it triggered."""
+        if not self.detector.detect(frame):
+            return False
+        now = time.monotonic() if now is None else now
+        if now - self._last_trigger < self.cooldown:
+            self.suppressed += 1
+            return False
+        self._last_trigger = now
+        self.triggers += 1
+        score = self.detector.last_score
+        self.events.append((time.time(), round(score, 4)))
+        print(f"Motion: {score:.1%} of the picture changed")
+        self.on_motion(score)
+        return True
+
+    def stats(self):
+        detector = self.detector
+        return {
+            "running": self.running,
+            "fps": self.fps,
+            "cooldown": self.cooldown,
+            "pixel_threshold": detector.pixel_threshold,
+            "min_area": detector.min_area,
+            "roi": detector.roi,
+            "frames": detector.frames,
+            "cost_ms": round(detector.cost_ms, 3),
+            "score": round(detector.last_score, 4),
+            "triggers": self.triggers,
+            "suppressed": self.suppressed,
+            "events": [{"time": t, "score": s} for t, s in self.events],
+        }
+
+
+if __name__ == '__main__':
+    # Offline run: python3 motion.py [frame.jpg ...]; without files two
+    # synthetic sequences, one after the other, with motion in each
+    import sys
+    if len(sys.argv) > 1:
+        frames = image_frames(sorted(sys.argv[1:]))
+    else:
+        parts = [(200, range(40, 60)), (100, range(20, 40))]  # (frames, moving)
+        frames = (f for seed, (count, moving) in enumerate(parts)
+                  for f in synthetic_frames(count, moving=moving, seed=seed))
+        spans, start = [], 0
+        for count, moving in parts:
+            spans.append(f"{start + moving.start}-{start + moving.stop - 1}")
+            start += count
+        print(f"Synthetic motion at frames {', '.join(spans)}")
+    trigger = MotionTrigger(None, MotionDetector(), lambda score: None, cooldown=3)
+    for index, frame in enumerate(frames):
+        if trigger.feed(frame, now=index / trigger.fps):
+            print(f"  at frame {index}")
+    stats = trigger.stats()
+    print({k: v for k, v in stats.items() if k != "events"})
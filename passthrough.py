@@ -0,0 +1,280 @@
+import collections
+import os
+import queue
+import time
+
+from process_runner import PIPE, runner
+
+# Hardware-encoded streaming: the encoder (Picamera2 or libcamera-vid) produces
+# MJPEG frames or H.264 NAL units and we only split and forward the bytes.
+
+JPEG_EOI = b"\xff\xd9"
+H264_START = b"\x00\x00\x01"
+
+
+class MjpegSplitter:
+    """Splits a concatenated MJPEG byte stream into single JPEG frames."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        frames = []
+        while True:
+            start = self._buffer.find(b"\xff\xd8")
+            if start < 0:
+                # A trailing 0xff may be the first half of the next frame's SOI
+                keep = 1 if self._buffer.endswith(b"\xff") else 0
+                del self._buffer[:len(self._buffer) - keep]
+                break
+            end = self._buffer.find(JPEG_EOI, start + 2)
+            if end < 0:
+                del self._buffer[:start]
+                break
+            frames.append(bytes(self._buffer[start:end + 2]))
+            del self._buffer[:end + 2]
+        return frames
+
+
+class H264Splitter:
+    """Splits an Annex-B H.264 byte stream into NAL units (start code included)."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        units = []
+        start = self._buffer.find(H264_START)
+        if start < 0:
+            return units
+        if start > 0 and self._buffer[start - 1] == 0:
+            start -= 1
+        while True:
+            end = self._buffer.find(H264_START, start + 3)
+            if end < 0:
+                break
+            # A 4-byte start code belongs to the next unit
+            if self._buffer[end - 1] == 0:
+                end -= 1
+            units.append(bytes(self._buffer[start:end]))
+            start = end
+        del self._buffer[:start]
+        return units
+
+
+def is_keyframe(chunk):
+    """True if an H.264 chunk starts with an SPS or IDR slice, i.e. a decoder can join here."""
+    i = chunk.find(H264_START)
+    if i < 0 or i + 3 >= len(chunk):
+        return False
+    return chunk[i + 3] & 0x1f in (5, 7)
+
+
+def make_splitter(codec):
+    return H264Splitter() if codec == "h264" else MjpegSplitter()
+
+
+def libcamera_vid_command(codec="mjpeg", width=640, height=480, framerate=24, intra=None):
+    """libcamera-vid invocation that writes the encoded stream to stdout."""
+    cmd = ["libcamera-vid", "-t", "0", "-n", "--codec", codec,
+           "--width", str(width), "--height", str(height),
+           "--framerate", str(framerate), "-o", "-"]
+    if codec == "h264":
+        cmd[-2:-2] = ["--inline"]  # repeat SPS/PPS so clients can join mid-stream
+        if intra:
+            cmd[-2:-2] = ["--intra", str(intra)]  # frames between keyframes
+    return cmd
+
+
+class PipeChunkSource:
+    """Reads encoded chunks from the stdout of an encoder process."""
+
+    pushed = True  # frames keep coming whether they are read or not
+
+    def __init__(self, cmd, codec="mjpeg", read_size=64 * 1024):
+        self.cmd = cmd
+        self.codec = codec
+        self.read_size = read_size
+        self._process = None
+        self._pending = collections.deque()
+        self._splitter = None
+
+    def start(self):
+        self._splitter = make_splitter(self.codec)
+        self._process = runner.start(self.cmd, stdout=PIPE, grace=2)
+
+    def stop(self):
+        if self._process is not None:
+            self._process.cancel()
+            self._process.wait(timeout=5)
+            self._process = None
+
+    def read(self):
+        while not self._pending:
+            data = os.read(self._process.stdout.fileno(), self.read_size)
+            if not data:
+                raise EOFError(f"{self.cmd[0]} exited: {' '.join(self._process.log()[-3:])}")
+            self._pending.extend(self._splitter.feed(data))
+        return self._pending.popleft()
+
+
+class FileChunkSource:
+    """Stand-in encoder that replays a recorded .mjpeg/.h264 file or a named pipe.
+
+    With rate=None chunks are returned as fast as they can be split, which
+    is what throughput measurements want; otherwise they are paced at `rate`
+    chunks per second.
+    """
+
+    pushed = True  # it stands in for an encoder
+
+    def __init__(self, path, codec="mjpeg", rate=None, loop=True, read_size=64 * 1024):
+        self.path = path
+        self.codec = codec
+        self.rate = rate
+        self.loop = loop
+        self.read_size = read_size
+        self._file = None
+        self._pending = collections.deque()
+        self._next = None
+
+    def start(self):
+        self._file = open(self.path, "rb")
+        self._splitter = make_splitter(self.codec)
+        self._next = time.monotonic()
+
+    def stop(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def read(self):
+        while not self._pending:
+            data = self._file.read(self.read_size)
+            if not data:
+                if not self.loop:
+                    raise EOFError(self.path)
+                self._file.seek(0)
+                continue
+            self._pending.extend(self._splitter.feed(data))
+        if self.rate:
+            self._next += 1.0 / self.rate
+            delay = self._next - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        return self._pending.popleft()
+
+
+class EncoderChunkSource:
+    """Takes frames straight from a Picamera2 hardware encoder output.
+
+    Up to `max_pending` frames wait for read(); newer ones are dropped and
+    counted in `dropped`. With max_pending=None nothing is ever dropped,
+    for readers that must keep every chunk (a recording).
+    """
+
+    pushed = True  # frames keep coming whether they are read or not
+
+    def __init__(self, picam2, codec="mjpeg", bitrate=None, max_pending=8, name="main", iperiod=None):
+        self.picam2 = picam2
+        self.codec = codec
+        self.name = name  # "lores" encodes the small preview stream of a dual-stream setup
+        self.bitrate = bitrate
+        self.iperiod = iperiod  # frames between H.264 keyframes
+        self._queue = queue.Queue(maxsize=max_pending or 0)
+        self.dropped = 0
+        self._encoder = None
+
+    def start(self):
+        from picamera2.encoders import H264Encoder, MJPEGEncoder
+        from picamera2.outputs import Output
+
+        chunks = self._queue
+        source = self
+
+        class QueueOutput(Output):
+            def outputframe(self, frame, keyframe=True, *args, **kwargs):
+                try:
+                    chunks.put_nowait(bytes(frame))
+                except queue.Full:
+                    source.dropped += 1  # the broadcaster is behind, drop at the source
+
+        if self.codec == "h264":
+            self._encoder = H264Encoder(bitrate=self.bitrate or 2000000, repeat=True, iperiod=self.iperiod)
+        else:
+            self._encoder = MJPEGEncoder(bitrate=self.bitrate or 8000000)
+        self.picam2.start_encoder(self._encoder, QueueOutput(), name=self.name)
+        self.picam2.start()
+
+    def stop(self):
+        if self._encoder is not None:
+            self.picam2.stop_encoder(self._encoder)
+            self._encoder = None
+
+    def read(self):
+        return self._queue.get(timeout=5)
+
+
+def h264_chunks(broadcaster, timeout=5.0):
+    """Yield every H.264 chunk in order for one client.
+
+    Unlike MJPEG, H.264 frames depend on each other, so a client that falls
+    behind the ring waits for the next keyframe instead of taking the newest
+    chunk.
+    """
+    with broadcaster.client() as ring:
+        seq = ring.seq + 1
+        synced = False
+        while broadcaster.running:
+            chunk = ring.get(seq, timeout=timeout)
+            if chunk == b"":
+                continue
+            if chunk is None:
+                broadcaster.frames_dropped += ring.seq - seq
+                seq = ring.seq
+                synced = False
+                continue
+            seq += 1
+            if not synced:
+                if not is_keyframe(chunk):
+                    continue
+                synced = True
+            yield chunk
+
+
+
+async def h264_chunks_async(async_broadcaster):
+    """h264_chunks() for an AsyncFrameBroadcaster bridging h264_chunks."""
+    synced = False
+    async for chunk in async_broadcaster.chunks():
+        if chunk is None:
+            synced = False
+            continue
+        if not synced:
+            if not is_keyframe(chunk):
+                continue
+            synced = True
+        yield chunk
+
+
+if __name__ == '__main__':
+    # Throughput of the passthrough path: python3 passthrough.py stream.mjpeg [mjpeg|h264] [seconds]
+    import sys
+    from broadcaster import FrameBroadcaster
+    codec = sys.argv[2] if len(sys.argv) > 2 else "mjpeg"
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    broadcaster = FrameBroadcaster(FileChunkSource(sys.argv[1], codec), ring_size=256)
+    reader = h264_chunks(broadcaster) if codec == "h264" else broadcaster.frames()
+    t0 = time.monotonic()
+    count = 0
+    size = 0
+    for chunk in reader:
+        count += 1
+        size += len(chunk)
+        if time.monotonic() - t0 > seconds:
+            break
+    elapsed = time.monotonic() - t0
+    broadcaster.stop()
+    print(f"{count / elapsed:.1f} chunks/s, {size / elapsed / 2**20:.1f} MiB/s")
@@ -0,0 +1,202 @@
+import collections
+import threading
+import time
+
+from passthrough import H264_START
+from recording import KeyframeGrabber, Mp4Muxer
+
+
+def starts_gop(chunk):
+    """True if an H.264 chunk starts with an SPS, so a decoder can start from it on its own."""
+    i = bytes(chunk[:8]).find(H264_START)
+    return 0 <= i and i + 3 < len(chunk) and chunk[i + 3] & 0x1f == 7
+
+
+class PrerollBuffer:
+    """The last `seconds` of an H.264 stream in a ring of `max_bytes` allocated once.
+
+    Chunks are copied into the ring as they arrive; the oldest are dropped
+    when they are older than `seconds` or their space is needed, so memory
+    stays at `max_bytes` whatever the bitrate. drain() starts at the oldest
+    SPS still held, so what it returns is always decodable on its own.
+    """
+
+    def __init__(self, max_bytes, seconds):
+        self.buffer = bytearray(max_bytes)
+        self.seconds = seconds
+        self.chunks_dropped = 0  # too large for the whole ring
+        self._chunks = collections.deque()  # (offset, length, arrival time, starts a GOP)
+        self._head = 0
+
+    def append(self, chunk, now=None):
+        now = time.monotonic() if now is None else now
+        length = len(chunk)
+        if length > len(self.buffer):
+            self.chunks_dropped += 1
+            return
+        start = self._head
+        if start + length > len(self.buffer):
+            # Wrap; whatever was left past the head is older than anything at the start
+            while self._chunks and self._chunks[0][0] >= start:
+                self._chunks.popleft()
+            start = 0
+        end = start + length
+        while self._chunks and self._chunks[0][0] < end and self._chunks[0][0] + self._chunks[0][1] > start:
+            self._chunks.popleft()
+        while self._chunks and self._chunks[0][2] < now - self.seconds:
+            self._chunks.popleft()
+        self.buffer[start:end] = chunk
+        self._chunks.append((start, length, now, starts_gop(chunk)))
+        self._head = end
+
+    def drain(self):
+        """Memoryviews of the held stream from its oldest GOP on, oldest first; empties the ring.
+
+        The views point into the ring, so they must be used before the next append().
+        """
+        chunks = list(self._chunks)
+        self._chunks.clear()
+        self._head = 0
+        first = next((i for i, chunk in enumerate(chunks) if chunk[3]), len(chunks))
+        view = memoryview(self.buffer)
+        return [view[offset:offset + length] for offset, length, _, _ in chunks[first:]], \
+            (chunks[-1][2] - chunks[first][2] if first < len(chunks) else 0.0)
+
+    def stats(self):
+        held = sum(length for _, length, _, _ in self._chunks)
+        return {
+            "max_bytes": len(self.buffer),
+            "bytes": held,
+            "chunks": len(self._chunks),
+            "seconds": round(self._chunks[-1][2] - self._chunks[0][2], 2) if self._chunks else 0.0,
+            "chunks_dropped": self.chunks_dropped,
+        }
+
+
+class PrerollRecorder:
+    """Keeps the encoder running into a PrerollBuffer while armed.
+
+    `source` is a passthrough-style H.264 chunk source (the hardware
+    encoder, libcamera-vid or a file). record() writes the buffered pre-roll
+    to the new file and then switches the live chunks over to it without
+    losing or repeating one, so the video starts up to `seconds` before the
+    trigger. The ring is only allocated while armed.
+    """
+
+    def __init__(self, source, max_bytes, seconds, framerate=24):
+        self.source = source
+        self.max_bytes = max_bytes
+        self.seconds = seconds
+        self.framerate = framerate
+        self.buffer = None
+        self.recordings = 0
+        self._sink = None  # list (backlog during the flush) or writer while recording
+        self._lock = threading.Lock()
+        self._thread = None
+        self._armed = threading.Event()
+
+    @property
+    def armed(self):
+        return self._armed.is_set()
+
+    @property
+    def recording(self):
+        return self._sink is not None
+
+    def arm(self):
+        if self._armed.is_set():
+            return
+        self.buffer = PrerollBuffer(self.max_bytes, self.seconds)
+        self.source.start()
+        self._armed.set()
+        self._thread = threading.Thread(target=self._run, name="preroll", daemon=True)
+        self._thread.start()
+
+    def disarm(self):
+        self._armed.clear()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.source.stop()
+        self.buffer = None  # give the memory back
+
+    def _run(self):
+        while self._armed.is_set():
+            try:
+                chunk = self.source.read()
+            except Exception as e:
+                print(f"Pre-roll encoder stopped: {e}")
+                self._armed.clear()
+                return
+            with self._lock:
+                if isinstance(self._sink, list):
+                    self._sink.append(chunk)
+                elif self._sink is not None:
+                    self._sink(chunk)
+                else:
+                    self.buffer.append(chunk)
+
+    def record(self, path, duration, stop_event=None, thumbnail=None, crash_safe=True):
+        """Save the pre-roll and `duration` more seconds (or until `stop_event`) to an MP4."""
+        if not self.armed:
+            raise RuntimeError("pre-roll is not armed")
+        stop_event = stop_event or threading.Event()
+        muxer = Mp4Muxer(path, self.framerate, crash_safe)
+        grabber = KeyframeGrabber(skip_seconds=0) if thumbnail else None
+
+        def write(chunk):
+            muxer.write(chunk)
+            if grabber:
+                grabber.feed(bytes(chunk))
+
+        muxer.start()
+        dropped = getattr(self.source, 'dropped', 0)
+        t0 = time.monotonic()
+        backlog = []
+        with self._lock:
+            # New chunks wait in the backlog while the ring is written out
+            self._sink = backlog
+            views, preroll_seconds = self.buffer.drain()
+        try:
+            for view in views:
+                write(view)
+            with self._lock:
+                for chunk in backlog:
+                    write(chunk)
+                self._sink = write
+            stop_event.wait(duration)
+        finally:
+            with self._lock:
+                self._sink = None
+            muxer.close()
+        self.recordings += 1
+        if grabber:
+            grabber.thumbnail(thumbnail)
+        lost = getattr(self.source, 'dropped', 0) - dropped
+        if lost:
+            # The frames after a lost chunk do not decode until the next keyframe
+            raise RuntimeError(f"{lost} H.264 chunks were lost while recording {path}")
+        return {"path": path, "bytes": muxer.bytes_in, "preroll_seconds": round(preroll_seconds, 2),
+                "seconds": round(preroll_seconds + time.monotonic() - t0, 2)}
+
+    def stats(self):
+        stats = {"armed": self.armed, "max_bytes": self.max_bytes, "seconds": self.seconds,
+                 "recording": self.recording, "recordings": self.recordings}
+        with self._lock:
+            if self.buffer is not None:
+                stats["buffer"] = self.buffer.stats()
+        return stats
+
+
+if __name__ == '__main__':
+    # Fill a ring from a synthetic stream (one GOP per second, 24 chunks each) and drain it
+    ring = PrerollBuffer(max_bytes=2 * 1024 * 1024, seconds=5)
+    sps, idr, p = H264_START + b"\x67" + bytes(20), H264_START + b"\x65" + bytes(30000), H264_START + b"\x41" + bytes(8000)
+    t0 = time.perf_counter()
+    for frame in range(24 * 30):
+        ring.append(sps + idr if frame % 24 == 0 else p, now=frame / 24)
+    per_chunk_us = (time.perf_counter() - t0) / (24 * 30) * 1e6
+    print(ring.stats(), f"{per_chunk_us:.1f} us per chunk")
+    views, seconds = ring.drain()
+    print(f"drained {len(views)} chunks, {sum(len(v) for v in views)} bytes, {seconds:.2f} s,"
+          f" starts with an SPS: {starts_gop(views[0])}")
@@ -0,0 +1,242 @@
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+PIPE = subprocess.PIPE
+DEVNULL = subprocess.DEVNULL
+
+
+class ProcessError(Exception):
+    """Raised by ProcessResult.check() when a command did not exit cleanly."""
+
+    def __init__(self, result):
+        self.result = result
+        log = "\n".join(result.log[-5:])
+        super().__init__(f"{result.name} exited with {result.returncode}"
+                         f"{' (timed out)' if result.timed_out else ''}: {log}")
+
+
+class ProcessResult:
+    def __init__(self, name, cmd):
+        self.name = name
+        self.cmd = cmd
+        self.returncode = None
+        self.wall_time = None  # seconds
+        self.cpu_time = None  # user + system seconds of the child
+        self.max_rss_kb = None  # peak resident set size of the child
+        self.timed_out = False
+        self.cancelled = False
+        self.log = []  # last lines of stderr
+        self.stdout = None  # only for ProcessRunner.run(capture_stdout=True)
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def check(self):
+        if not self.ok:
+            raise ProcessError(self)
+        return self
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "cmd": self.cmd,
+            "returncode": self.returncode,
+            "wall_time": self.wall_time and round(self.wall_time, 3),
+            "cpu_time": self.cpu_time and round(self.cpu_time, 3),
+            "max_rss_kb": self.max_rss_kb,
+            "timed_out": self.timed_out,
+            "cancelled": self.cancelled,
+        }
+
+
+class ManagedProcess:
+    """A running command with cancellation, timeout, log capture and resource accounting.
+
+    The child is reaped with os.wait4 on a helper thread, which gives CPU
+    time and peak RSS; use wait() instead of the Popen methods, which could
+    reap it first (signals go out with os.kill for the same reason).
+    """
+
+    def __init__(self, cmd, name=None, stdin=None, stdout=DEVNULL, timeout=None,
+                 grace=5, log_lines=200, on_exit=None):
+        self.cmd = list(cmd)
+        self.name = name or os.path.basename(self.cmd[0])
+        self.timeout = timeout
+        self.grace = grace
+        self.result = ProcessResult(self.name, self.cmd)
+        self._log = collections.deque(maxlen=log_lines)
+        self._done = threading.Event()
+        self._on_exit = on_exit
+        self._t0 = time.monotonic()
+        self._popen = subprocess.Popen(self.cmd, stdin=stdin, stdout=stdout, stderr=PIPE)
+        self.pid = self._popen.pid
+        self.stdin = self._popen.stdin
+        self.stdout = self._popen.stdout
+        self._log_thread = threading.Thread(target=self._read_log, name=f"{self.name}-log", daemon=True)
+        self._log_thread.start()
+        threading.Thread(target=self._reap, name=f"{self.name}-wait", daemon=True).start()
+
+    def _read_log(self):
+        for line in iter(self._popen.stderr.readline, b""):
+            self._log.append(line.decode(errors="replace").rstrip())
+        self._popen.stderr.close()
+
+    def _reap(self):
+        deadline = None if self.timeout is None else self._t0 + self.timeout
+        while True:
+            try:
+                pid, status, rusage = os.wait4(self.pid, os.WNOHANG if deadline else 0)
+            except ChildProcessError:
+                # Reaped by someone else; it is gone, but its status and usage are lost
+                pid, status, rusage = self.pid, None, None
+            if pid:
+                break
+            if time.monotonic() >= deadline:
+                self.result.timed_out = True
+                self._terminate()
+                deadline = None  # now block until it is gone
+                continue
+            time.sleep(0.05)
+        if status is not None:
+            self._popen.returncode = os.waitstatus_to_exitcode(status)
+        elif self._popen.returncode is None:
+            self._popen.returncode = -1
+        result = self.result
+        result.wall_time = time.monotonic() - self._t0
+        self._log_thread.join(timeout=1)
+        result.returncode = self._popen.returncode
+        if rusage is not None:
+            result.cpu_time = rusage.ru_utime + rusage.ru_stime
+            result.max_rss_kb = rusage.ru_maxrss
+        result.log = list(self._log)
+        self._done.set()
+        if self._on_exit:
+            self._on_exit(self)
+
+    def _signal(self, sig):
+        if self._done.is_set():
+            return False
+        try:
+            os.kill(self.pid, sig)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def _terminate(self):
+        if not self._signal(signal.SIGTERM):
+            return
+
+        def kill_later():
+            if not self._done.wait(self.grace):
+                self._signal(signal.SIGKILL)
+
+        threading.Thread(target=kill_later, daemon=True).start()
+
+    def cancel(self):
+        """Ask the process to stop (SIGTERM), killing it if it ignores that for `grace` seconds."""
+        if self._done.is_set():
+            return
+        self.result.cancelled = True
+        self._terminate()
+
+    def running(self):
+        return not self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the process exits; returns the ProcessResult (None on timeout)."""
+        if not self._done.wait(timeout):
+            return None
+        return self.result
+
+    def log(self):
+        return list(self._log)
+
+
+class ProcessRunner:
+    """Launches libcamera/ffmpeg commands without blocking the caller.
+
+    If `bin_dir` (or the ACTIONPI_BIN_DIR environment variable) is set, a
+    command whose executable exists there is run from there instead of PATH,
+    so stub libcamera-vid or ffmpeg scripts can stand in for the real tools.
+    The last `history` results are kept for resource accounting.
+    """
+
+    def __init__(self, bin_dir=None, workers=4, history=50):
+        self.bin_dir = bin_dir if bin_dir is not None else os.environ.get("ACTIONPI_BIN_DIR")
+        self.history = collections.deque(maxlen=history)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="process-runner")
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def resolve(self, cmd):
+        cmd = list(cmd)
+        if self.bin_dir:
+            stub = os.path.join(self.bin_dir, os.path.basename(cmd[0]))
+            if os.access(stub, os.X_OK):
+                cmd[0] = stub
+        return cmd
+
+    def start(self, cmd, **kwargs):
+        """Launch cmd and return its ManagedProcess right away."""
+        def finished(process):
+            with self._lock:
+                self._active.discard(process)
+                self.history.append(process.result)
+
+        process = ManagedProcess(self.resolve(cmd), on_exit=finished, **kwargs)
+        with self._lock:
+            if process.running():
+                self._active.add(process)
+        return process
+
+    def run(self, cmd, input=None, capture_stdout=False, timeout=None, **kwargs):
+        """Run cmd to completion and return its ProcessResult."""
+        process = self.start(cmd, stdin=PIPE if input is not None else DEVNULL,
+                             stdout=PIPE if capture_stdout else DEVNULL, timeout=timeout, **kwargs)
+        stdout = None
+        try:
+            if input is not None:
+                writer = threading.Thread(target=_feed, args=(process.stdin, input), daemon=True)
+                writer.start()
+            if capture_stdout:
+                stdout = process.stdout.read()
+                process.stdout.close()
+        except BaseException:
+            process.cancel()
+            raise
+        result = process.wait()
+        result.stdout = stdout
+        return result
+
+    def submit(self, cmd, **kwargs):
+        """run() on the runner's thread pool; returns a Future of the ProcessResult."""
+        return self._pool.submit(self.run, cmd, **kwargs)
+
+    def active(self):
+        with self._lock:
+            return list(self._active)
+
+    def cancel_all(self):
+        for process in self.active():
+            process.cancel()
+
+    def stats(self):
+        return [result.to_dict() for result in self.history]
+
+
+def _feed(pipe, data):
+    try:
+        pipe.write(data)
+        pipe.close()
+    except BrokenPipeError:
+        pass
+
+
+# Shared by every module that runs external tools
+runner = ProcessRunner()
@@ -0,0 +1,183 @@
+import os
+import threading
+import time
+
+from passthrough import H264Splitter
+from process_runner import PIPE, ProcessError, runner
+
+# Fragmented MP4: every keyframe starts a self-contained fragment, so a file cut
+# short by a power loss is still playable up to the last complete fragment
+CRASH_SAFE_MOVFLAGS = "+frag_keyframe+empty_moov+default_base_moof"
+
+
+class Mp4Muxer:
+    """Muxes an H.264 elementary stream into MP4 as it is recorded.
+
+    The stream is copied, not re-encoded, and every byte is written to the
+    card once. crash_safe=False writes a regular MP4 whose index is only
+    written at the end.
+    """
+
+    def __init__(self, path, framerate=24, crash_safe=True):
+        self.path = path
+        self.cmd = ["ffmpeg", "-loglevel", "error", "-y",
+                    "-f", "h264", "-framerate", str(framerate), "-i", "-", "-c:v", "copy"]
+        if crash_safe:
+            self.cmd += ["-movflags", CRASH_SAFE_MOVFLAGS]
+        self.cmd += [path]
+        self.bytes_in = 0
+        self._process = None
+
+    def start(self):
+        self._process = runner.start(self.cmd, stdin=PIPE, name="ffmpeg-mux")
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        self._process.stdin.write(data)
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        return self._process.wait().check()
+
+    def cancel(self):
+        """Stop ffmpeg without waiting for more input, e.g. when the camera did not start."""
+        self._process.cancel()
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._process.wait()
+
+
+class KeyframeGrabber:
+    """Keeps the first keyframe seen after `skip_seconds` so a thumbnail can be
+    decoded from memory instead of from the finished file."""
+
+    def __init__(self, skip_seconds=1.0):
+        self.skip_seconds = skip_seconds
+        self.keyframe = None
+        self._started = time.monotonic()
+        self._splitter = H264Splitter()
+        self._collecting = None
+
+    def feed(self, data):
+        if self.keyframe is not None or time.monotonic() - self._started < self.skip_seconds:
+            return
+        for unit in self._splitter.feed(data):
+            nal_type = unit[unit.find(b"\x00\x00\x01") + 3] & 0x1f
+            if self._collecting is None:
+                if nal_type == 7:  # SPS, the start of a decodable group
+                    self._collecting = [unit]
+                continue
+            self._collecting.append(unit)
+            if nal_type == 5:  # IDR slice: SPS, PPS and picture are complete
+                self.keyframe = b"".join(self._collecting)
+                return
+
+    def thumbnail(self, path, size=(128, 128)):
+        """Decode the kept keyframe and write a thumbnail JPEG to `path`."""
+        if self.keyframe is None:
+            return False
+        result = runner.run(
+            ["ffmpeg", "-loglevel", "error", "-f", "h264", "-i", "-", "-vframes", "1",
+             "-vf", f"scale={size[0]}:-2", "-f", "image2", "-c:v", "mjpeg", "pipe:1"],
+            input=self.keyframe, capture_stdout=True, timeout=30, name="ffmpeg-thumbnail")
+        if not result.ok or not result.stdout:
+            return False
+        write_thumbnail(path, result.stdout)
+        return True
+
+
+def write_thumbnail(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def record_with_libcamera(path, duration, width=1920, height=1080, framerate=24,
+                          crash_safe=True, thumbnail=None, stop_event=None):
+    """Record `duration` seconds with libcamera-vid piped straight into the MP4 muxer."""
+    stop_event = stop_event or threading.Event()
+    cmd = ["libcamera-vid", "-n", "-t", str(int(duration * 1000)), "--framerate", str(framerate),
+           "--width", str(width), "--height", str(height), "--inline", "-o", "-"]
+    muxer = Mp4Muxer(path, framerate, crash_safe)
+    grabber = KeyframeGrabber() if thumbnail else None
+    muxer.start()
+    t0 = time.monotonic()
+    try:
+        # A hung camera must not hold the pipeline forever
+        camera = runner.start(cmd, stdout=PIPE, timeout=duration + 30)
+    except BaseException:
+        muxer.cancel()  # or ffmpeg waits for input forever
+        raise
+
+    def watch():
+        # Stop early on request; libcamera-vid flushes its output on SIGTERM
+        while not stop_event.wait(0.2):
+            if not camera.running():
+                return
+        camera.cancel()
+
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        while True:
+            data = os.read(camera.stdout.fileno(), 64 * 1024)
+            if not data:
+                break
+            muxer.write(data)
+            if grabber:
+                grabber.feed(data)
+    finally:
+        camera_result = camera.wait()
+        muxer.close()
+    if not camera_result.ok and not camera_result.cancelled:
+        raise ProcessError(camera_result)
+    if grabber:
+        grabber.thumbnail(thumbnail)
+    return {"path": path, "bytes": muxer.bytes_in, "seconds": round(time.monotonic() - t0, 2),
+            "camera": camera_result.to_dict()}
+
+
+def record_with_session(session, path, duration, framerate=24, bitrate=10000000,
+                        crash_safe=True, thumbnail=None, stop_event=None):
+    """Record from a running CameraSession using the hardware H.264 encoder.
+
+    The thumbnail is made from a frame of the lores stream that runs next
+    to the recording (already in memory, no full-frame JPEG encode) and
+    written once the video is closed, so it is newer than the video.
+    """
+    from picamera2.encoders import H264Encoder
+    from picamera2.outputs import Output
+    from camera_session import VIDEO
+
+    stop_event = stop_event or threading.Event()
+    muxer = Mp4Muxer(path, framerate, crash_safe)
+
+    class MuxerOutput(Output):
+        def outputframe(self, frame, keyframe=True, *args, **kwargs):
+            muxer.write(frame)
+
+    previous_mode = session.mode
+    session.set_mode(VIDEO)
+    # The muxer timestamps frames at `framerate`, so the sensor has to deliver exactly that
+    session.picam2.set_controls({"FrameRate": framerate})
+    encoder = H264Encoder(bitrate=bitrate, repeat=True)
+    muxer.start()
+    t0 = time.monotonic()
+    session.picam2.start_encoder(encoder, MuxerOutput())
+    thumbnail_data = None
+    try:
+        if thumbnail and not stop_event.wait(min(1.0, duration)):
+            from thumbnails import encode_thumbnail
+            thumbnail_data = encode_thumbnail(session.lores_image())
+        stop_event.wait(max(0, duration - (time.monotonic() - t0)))
+    finally:
+        session.picam2.stop_encoder(encoder)
+        muxer.close()
+        session.set_mode(previous_mode)
+    if thumbnail_data:
+        write_thumbnail(thumbnail, thumbnail_data)
+    return {"path": path, "bytes": muxer.bytes_in, "seconds": round(time.monotonic() - t0, 2)}
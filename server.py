@@ -1,336 +1,335 @@
-from flask import Flask, send_from_directory, render_template, request, redirect, url_for, Response
-from zipfile import ZipFile
+from flask import Flask, send_from_directory, render_template, request, redirect, url_for, Response, jsonify
 import os
-import shutil
-import threading
-from datetime import datetime
-from subprocess import call
-from PIL import Image
-import psutil
-import io
+
+import frontend
+from frontend import (BASE_DIR, BURST_MAX_FRAMES, DIRECTORIES, PAGE_SIZE, STREAM_MODES, capture, media_index,
+                      thumbnail_cache)
+from jobs import QueueFull
+from process_runner import runner
+from storage import StorageFull
+from passthrough import h264_chunks
 
 app = Flask(__name__)
 
-import time
-try:
-    from rpi_ws281x import PixelStrip, Color
-    IS_NEOPIXEL = True
-except:
-    IS_NEOPIXEL = False
-
-try:
-    from picamera2.picamera2 import Picamera2
-    IS_PICAMERA2 = True
-    # Initialize your camera
-    picam2 = Picamera2()
-    preview_config = picam2.create_preview_configuration(main={"size": (320, 240)})
-    still_config = picam2.create_still_configuration()
-
-    # Set an initial configuration; can be changed later
-    picam2.configure(still_config)
-    picam2.start()
-    picam2.capture_file("/home/pi/camera/test.jpg", format="jpeg")
-    
-
-except Exception as e:
-    print("Picamera2 not found")
-    print(e)
-    IS_PICAMERA2 = False
+
+@app.errorhandler(ConnectionError)
+def capture_unavailable(e):
+    return jsonify({"error": str(e)}), 503
 
 
 @app.route('/stream')
 def stream():
-    """Streams the camera images as a multipart HTTP response."""
-    return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
-
-def gen_frames():
-    if not IS_PICAMERA2:
-        return
-    picam2.configure(preview_config)  # Configure for preview
-    while True:
-        stream = io.BytesIO()
-        picam2.capture_file(stream, format="jpeg")
-        stream.seek(0)
-        frame = stream.read()
-
-        boundary = "--frameboundary"
-        yield (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')        
-        time.sleep(0.1)
-
-
-def ____gen_frames():
-    """Generator function that captures images and yields them as frames."""
-    while True:
-        frame = picam2.capture_array()  # Capture an image from the camera
-        ret, buffer = cv2.imencode('.jpg', frame)
-        frame = buffer.tobytes()
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-
-class NeoPixelStrip:
-    def __init__(self, led_count=10, led_pin=18, led_freq_hz=800000, led_dma=10,
-                 led_brightness=255, led_invert=False, led_channel=0):
-        self.led_count = led_count
-        self.led_pin = led_pin
-        self.led_freq_hz = led_freq_hz
-        self.led_dma = led_dma
-        self.led_brightness = led_brightness
-        self.led_invert = led_invert
-        self.led_channel = led_channel
-        
-        if not IS_NEOPIXEL:
-            return
-        self.strip = PixelStrip(self.led_count, self.led_pin, self.led_freq_hz,
-                                self.led_dma, self.led_invert, self.led_brightness,
-                                self.led_channel)
-        self.strip.begin()
-    
-    def set_color(self, color):
-        """Set the color of the whole strip."""
-        for i in range(self.strip.numPixels()):
-            self.strip.setPixelColor(i, color)
-        self.strip.show()
-    
-    def turn_off(self):
-        """Turn off all pixels."""
-        if not IS_NEOPIXEL:
-            return
-
-        self.colorWipe(Color(0, 0, 0))
-    
-    def turn_on(self, color=(255, 255, 255)):
-        """Turn on all pixels to white or specified color."""
-        if not IS_NEOPIXEL:
-            return
-        self.colorWipe(Color(color))
-
-    # Define functions which animate LEDs in various ways.
-    def colorWipe(self, color, wait_ms=0):
-        """Wipe color across display a pixel at a time."""
-        for i in range(self.strip.numPixels()):
-            self.strip.setPixelColor(i, color)
-            self.strip.show()
-            time.sleep(wait_ms / 1000.0)
-
-
-
-
-# Create an instance of the NeoPixelStrip class
-led_strip = NeoPixelStrip()
-    
- 
-
-
-BASE_DIR = '.'#/home/pi/camera'  # This should be the base directory where your files are located
-DIRECTORIES = ['photos', 'videos', 'timelapses']
-# make all directories if they don't exist
-for dir in DIRECTORIES:
-    if not os.path.exists(os.path.join(BASE_DIR, dir)):
-        os.mkdir(os.path.join(BASE_DIR, dir))
-THUMBNAIL_DIRECTORIES = {dir: os.path.join('thumbnails', dir) for dir in DIRECTORIES}
-
-thumbnail_base_dir = os.path.join(BASE_DIR, 'thumbnails')
-if not os.path.exists(thumbnail_base_dir):
-    os.mkdir(thumbnail_base_dir)
+    """Streams the camera images as a multipart HTTP response.
+
+    ?mode=software (default) JPEG-encodes preview frames in Python,
+    ?mode=mjpeg forwards frames from the hardware MJPEG encoder and
+    ?mode=h264 forwards the raw H.264 elementary stream.
+    """
+    mode = request.args.get('mode', default='software')
+    if mode not in STREAM_MODES:
+        return Response(f"Unknown stream mode {mode}", status=400)
+    broadcaster = capture.broadcaster(mode)
+    if broadcaster is None:
+        return Response(status=503)
+    if mode == 'h264':
+        return Response(h264_chunks(broadcaster), mimetype='video/h264')
+    return Response(broadcaster.mjpeg(), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/')
 def index():
-    all_files = {}
-    for directory in DIRECTORIES:
-        dir_path = os.path.join(BASE_DIR, directory)
-        if os.path.exists(dir_path):
-            files = os.listdir(dir_path)
-            # Sort files by creation time, newest first
-            files.sort(key=lambda x: os.path.getctime(os.path.join(dir_path, x)), reverse=True)
-            all_files[directory] = files
-        else:
-            all_files[directory] = []
+    media_index.reconcile()
+    # Only the counts are rendered; the gallery pages itself in from /api/media
+    counts = media_index.counts()
+
+    temperature = frontend.cpu_temperature()
+    disk_space = capture.disk_usage()
+
+    return render_template('index.html', counts=counts, page_size=PAGE_SIZE, temperature=temperature, disk_space=disk_space)
+
+
+@app.route('/api/media')
+def api_media():
+    kind = request.args.get('kind') or None
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+    limit = min(max(request.args.get('limit', default=PAGE_SIZE, type=int), 1), 500)
+    if kind is not None and kind not in DIRECTORIES:
+        return jsonify({"error": f"unknown kind {kind}"}), 400
+    media_index.reconcile()
+    return jsonify({
+        "items": media_index.page(kind, offset, limit),
+        "offset": offset,
+        "limit": limit,
+        "total": media_index.count(kind),
+    })
+
+
+@app.route('/thumbnail/<path:filepath>')
+def thumbnail(filepath):
+    """Thumbnail of a photo, video or timelapse, generated on first request."""
+    if not frontend.valid_media_path(filepath):
+        return Response(status=404)
+    try:
+        data = thumbnail_cache.get(filepath)
+    except Exception as e:
+        print(f"Thumbnail for {filepath} failed: {e}")
+        return Response(status=404)
+    return Response(data, mimetype='image/jpeg', headers={'Cache-Control': 'max-age=86400'})
 
-    temperature = cpu_temperature()
-    disk_space = disk_usage()
 
-    return render_template('index.html', all_files=all_files, temperature=temperature, disk_space=disk_space)
+@app.route('/delete', methods=['POST'])
+def delete():
+    filepath = request.form['filepath']
+    if not frontend.delete_media(filepath):
+        return jsonify({"error": "invalid path"}), 400
+    return redirect(url_for('index'))
+
+
+@app.route('/delete_all/<directory>', methods=['POST'])
+def delete_all(directory):
+    if directory not in DIRECTORIES:
+        return jsonify({"error": "invalid directory"}), 400
+    frontend.delete_all_media(directory)
+    return redirect(url_for('index'))
+
+
+# Capture jobs
+# Captures run one at a time on the capture core's job queue, so a request
+# returns immediately and two captures never reconfigure the camera at once.
+
+def submit_job(kind, **params):
+    """Queue a capture and answer with its job id (JSON) or go back to the index (browser)."""
+    try:
+        job = capture.submit(kind, **params)
+    except QueueFull as e:
+        return jsonify({"error": f"camera busy: {e}"}), 429
+    except StorageFull as e:
+        return jsonify({"error": f"not enough space: {e}"}), 507
+    if request.accept_mimetypes.accept_html:
+        return redirect(url_for('index', job=job["id"]))
+    return jsonify({"job_id": job["id"], "status": job["status"]}), 202
+
+@app.route('/jobs')
+def list_jobs():
+    return jsonify(capture.jobs())
+
+@app.route('/jobs/<int:job_id>', methods=['GET', 'DELETE'])
+def job_status(job_id):
+    if request.method == 'DELETE':
+        job = capture.cancel(job_id)
+    else:
+        job = capture.job(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job)
+
+@app.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    if capture.cancel(job_id) is None:
+        return jsonify({"error": "unknown job"}), 404
+    return redirect(url_for('index'))
 
 
 # Capturing photo
 @app.route('/start_photo_capture', methods=['GET'])
 def start_photo_capture():
-    capture_photo()
+    return submit_job('photo')
+
+
+# Burst; count=0 keeps going until /stop_burst
+@app.route('/arm_burst', methods=['GET'])
+def arm_burst():
+    stats = capture.arm_burst()
+    if stats is None:
+        return jsonify({"error": "no camera"}), 503
+    return jsonify(stats)
+
+@app.route('/disarm_burst', methods=['GET'])
+def disarm_burst():
+    return jsonify(capture.disarm_burst())
+
+@app.route('/start_burst', methods=['GET'])
+def start_burst():
+    count = min(max(request.args.get('count', default=10, type=int), 0), BURST_MAX_FRAMES)
+    return submit_job('burst', count=count)
+
+@app.route('/stop_burst', methods=['GET'])
+def stop_burst():
+    capture.cancel_kind('burst')
     return redirect(url_for('index'))
 
-def turn_on_leds():
-    try:
-        print("Turning on LEDs...")
-        led_strip.turn_on()  # Turn on all LEDs to white
-        time.sleep(0.5)  # Wait for half a second
-    except Exception as e:
-        print(e)
-        
-def turn_off_leds():
+
+# Capturing video; with the pre-roll armed a video starts before the trigger
+@app.route('/arm_preroll', methods=['GET'])
+def arm_preroll():
     try:
-        print("Turning off LEDs...")
-        led_strip.turn_off()  # Turn off all LEDs
-        time.sleep(1)  # Wait for a second
-    except Exception as e:
-        print(e)
-        
-def capture_photo():
-    # Ensure LEDs are turned on before capturing
-    turn_on_leds()
-
-    # Check and create the photos directory if it doesn't exist
-    photos_dir = os.path.join(BASE_DIR, "photos")
-    if not os.path.exists(photos_dir):
-        os.makedirs(photos_dir)
-
-    # Generate the filename
-    filename = datetime.now().strftime("%Y%m%d_%H%M%S.jpg")
-    filepath = os.path.join(photos_dir, f"photo_{filename}")
-    print(f"Capturing photo to {filepath}")
-
-    # Capture the photo using Picamera2
-    if IS_PICAMERA2:
-        #picam2.configure(still_config)
-        picam2.capture_file(filepath)
-    
-    # Ensure LEDs are turned off after capturing
-    turn_off_leds()
-      
-    
-
-# Capturing video
+        return jsonify(capture.arm_preroll())
+    except (OSError, RuntimeError) as e:
+        return jsonify({"error": f"no encoder for the pre-roll: {e}"}), 503
+
+@app.route('/disarm_preroll', methods=['GET'])
+def disarm_preroll():
+    return jsonify(capture.disarm_preroll())
+
 @app.route('/start_video_capture', methods=['GET'])
 def start_video_capture():
     duration = request.args.get('duration', default=1, type=int)
-    record_video(duration)
-    return redirect(url_for('index'))
-
-def record_video(duration):
-    # Create directory if it doesn't exist
-    if not os.path.exists(BASE_DIR + "/videos"):
-        os.mkdir(BASE_DIR + "/videos")
-
-    # Generate filename
-    filename_h264 = datetime.now().strftime(BASE_DIR + "/videos/video_%Y%m%d_%H%M%S.h264")
-    filename_mp4 = filename_h264.replace('.h264', '.mp4')
+    return submit_job('video', duration=duration)
 
-    # Record the video
-    turn_on_leds()
-    os.system(f"libcamera-vid -t {duration * 1000} --framerate 24 --width 1920 --height 1080 -o {filename_h264}")
-    turn_off_leds()
-    
-    # Convert the video to mp4
-    os.system(f"ffmpeg -i {filename_h264} -vcodec copy {filename_mp4}")
 
-    # Delete the original .h264 file
-    os.remove(filename_h264)
+# Motion trigger: captures whenever the lores picture changes
+@app.route('/start_motion', methods=['GET'])
+def start_motion():
+    # threshold: grey levels a pixel must change by; area: fraction of the
+    # region that must change; roi: left,top,right,bottom fractions
+    try:
+        stats = capture.start_motion(action=request.args.get('action', default='photo'),
+                                     pixel_threshold=request.args.get('threshold', default=20, type=int),
+                                     min_area=request.args.get('area', default=0.005, type=float),
+                                     roi=request.args.get('roi') or None,
+                                     cooldown=request.args.get('cooldown', default=10, type=float),
+                                     fps=min(max(request.args.get('fps', default=4, type=float), 0.5), 15))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (ImportError, RuntimeError) as e:
+        return jsonify({"error": f"motion detection unavailable: {e}"}), 503
+    if request.accept_mimetypes.accept_html:
+        return redirect(url_for('index'))
+    return jsonify(stats)
+
+@app.route('/stop_motion', methods=['GET'])
+def stop_motion():
+    stats = capture.stop_motion()
+    if request.accept_mimetypes.accept_html:
+        return redirect(url_for('index'))
+    return jsonify(stats)
+
+@app.route('/motion')
+def motion_status():
+    """Detector settings, cost per frame and recent triggers."""
+    return jsonify(capture.status('motion') or {"running": False})
 
 
 # Capturing timelapse
-is_capture_timelapse = False
 @app.route('/start_timelapse', methods=['GET'])
 def start_timelapse():
-    global is_capture_timelapse
-    is_capture_timelapse = True
     interval = request.args.get('interval', default=1, type=int)
     duration = request.args.get('duration', default=1, type=int)
-
-    capture_timelapse(interval, duration)
-    return redirect(url_for('index'))
+    # video=1 assembles an MP4 while capturing, keep_frames=0 then skips the JPEGs
+    video = request.args.get('video', default=0, type=int) == 1
+    keep_frames = request.args.get('keep_frames', default=1, type=int) == 1 or not video
+    return submit_job('timelapse', interval=interval, duration=duration, video=video, keep_frames=keep_frames)
 
 @app.route('/stop_timelapse', methods=['GET'])
 def stop_timelapse():
-    global is_capture_timelapse
-    is_capture_timelapse = False
+    capture.cancel_kind('timelapse')
     return redirect(url_for('index'))
 
-
-def capture_timelapse(interval, duration):
-    # Create directory if it doesn't exist
-    global is_capture_timelapse
-    timelapse_dir = os.path.join(BASE_DIR, "timelapses")
-    if not os.path.exists(timelapse_dir):
-        os.makedirs(timelapse_dir)
-    
-    # Generate the folder and filename
-    foldername = datetime.now().strftime("timelapse_%Y%m%d_%H%M%S")
-    folder_path = os.path.join(timelapse_dir, foldername)
-    os.makedirs(folder_path)
-    print(f"Capturing timelapse in {folder_path}")
-
-    t0 = time.time()
-    count = 0
-    while is_capture_timelapse and time.time() - t0 < duration * 60:  # duration in minutes
-        filename = os.path.join(folder_path, f"image_{count:04d}.jpg")
-        if IS_PICAMERA2:
-            #picam2.configure(still_config)
-            picam2.capture_file(filename)
-        time.sleep(interval)
-        count += 1
-
 @app.route('/download/<path:filepath>')
 def download(filepath):
+    if not frontend.valid_media_path(filepath):
+        return Response(status=404)
     full_filepath = os.path.join(BASE_DIR, filepath)
-    # If it's a directory, zip it first
+    # If it's a directory, stream it as a zip built on the fly
     if os.path.isdir(full_filepath):
-        output_filename = f"{os.path.basename(filepath)}.zip"
-        output_filepath = os.path.join(os.path.dirname(full_filepath), output_filename)
-        # Create a Zip file
-        with ZipFile(output_filepath, 'w') as zipf:
-            for foldername, subfolders, filenames in os.walk(full_filepath):
-                for filename in filenames:
-                    # create complete filepath of file in directory
-                    file_to_zip = os.path.join(foldername, filename)
-                    # Add file to zip
-                    zipf.write(file_to_zip, os.path.relpath(file_to_zip, full_filepath))
-        return send_from_directory(*os.path.split(output_filepath), as_attachment=True)
+        return zip_response(full_filepath, f"{os.path.basename(filepath)}.zip")
     else:
         dirpath, filename = os.path.split(full_filepath)
-        return send_from_directory(dirpath, filename, as_attachment=True)
+        # conditional=True answers Range requests, so interrupted downloads can resume
+        return send_from_directory(dirpath, filename, as_attachment=True, conditional=True)
 
 
 @app.route('/download_all/<directory>')
 def download_all(directory):
+    if directory not in DIRECTORIES:
+        return Response(status=404)
     dir_path = os.path.join(BASE_DIR, directory)
-    output_filename = f"{directory}.zip"
-    output_filepath = os.path.join(BASE_DIR, output_filename)
-
-    # Create a Zip file
-    with ZipFile(output_filepath, 'w') as zipf:
-        for foldername, subfolders, filenames in os.walk(dir_path):
-            for filename in filenames:
-                # create complete filepath of file in directory
-                filepath = os.path.join(foldername, filename)
-                # Add file to zip
-                zipf.write(filepath, os.path.relpath(filepath, dir_path))
+    return zip_response(dir_path, f"{directory}.zip")
 
-    return send_from_directory(BASE_DIR, output_filename, as_attachment=True)
 
+def zip_response(dir_path, output_filename):
+    """Send a directory as a zip that is built while it is being sent, without a temp file."""
+    from zipstream import walk_files, zip_chunks  # zipfile/zlib only when someone downloads
+    return Response(zip_chunks(walk_files(dir_path)), mimetype='application/zip',
+                    headers={'Content-Disposition': f'attachment; filename="{output_filename}"'})
 
+@app.route('/camera_session')
+def camera_session():
+    """Current camera mode and how long recent mode switches took."""
+    stats = capture.status('camera_session')
+    if stats is None:
+        return jsonify({"error": "no camera"}), 503
+    return jsonify(stats)
 
+@app.route('/startup')
+def startup_status():
+    """Boot-to-ready milestones and recent trigger-to-file latencies."""
+    return jsonify(capture.status('startup'))
 
 @app.route('/cpu_temperature')
 def cpu_temperature():
-    return str("all good")
+    return frontend.cpu_temperature()
+
+
+@app.route('/governor')
+def governor_status():
+    """Current thermal level with its settings, and the recent level changes with their reasons."""
+    return jsonify(capture.status('governor'))
+
+
+@app.route('/metrics')
+def metrics():
+    """Latest telemetry sample for Prometheus."""
+    return Response(capture.metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/telemetry')
+def telemetry_status():
+    """Latest telemetry sample; ?history=N adds the last N samples for charts."""
+    return jsonify(capture.telemetry(request.args.get('history', default=0, type=int)))
+
+
+@app.route('/telemetry/stream')
+def telemetry_stream():
+    """Telemetry samples as Server-Sent Events."""
+    return Response(capture.telemetry_events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/disk_usage')
 def disk_usage():
-    total, used, free = shutil.disk_usage('/')
-    # Convert from bytes to gigabytes
-    total_gb = round(total / (2**30), 1)
-    used_gb = round(used / (2**30), 1)
-    free_gb = round(free / (2**30), 1)
-    return {"total_gb": total_gb, "used_gb": used_gb, "free_gb": free_gb}
+    return jsonify(capture.disk_usage())
+
 
 
+@app.route('/storage')
+def storage_status():
+    """Free space, quotas, running reservations and recently pruned media."""
+    return jsonify(capture.status('storage'))
+
+
+@app.route('/sync')
+def sync_status():
+    """Offload target, progress and errors; ?now=1 starts a round right away."""
+    if request.args.get('now'):
+        stats = capture.sync_now()
+    else:
+        stats = capture.status('sync')
+    return jsonify(stats or {"enabled": False})
+
 
 @app.route('/shutdown', methods=['POST'])
 def shutdown():
-    call("sudo shutdown -h now", shell=True)
+    runner.run(["sudo", "shutdown", "-h", "now"], timeout=30)
     return redirect(url_for('index'))
 
 
+@app.route('/processes')
+def processes():
+    """Running external tools and exit status, wall/CPU time and peak RSS of recent ones."""
+    return jsonify(capture.status('processes'))
+
+
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8000)
\ No newline at end of file
+    if not os.environ.get('ACTIONPI_CAPTURE_SOCKET'):
+        capture.start(background=True)  # the page is up while the camera warms up
+    app.run(host='0.0.0.0', port=int(os.environ.get('ACTIONPI_PORT', 8000)))
\ No newline at end of file
@@ -0,0 +1,81 @@
+import collections
+import os
+import time
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def system_uptime():
+    """Seconds since the kernel booted, or None off Linux."""
+    try:
+        with open("/proc/uptime") as f:
+            return float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def process_start_uptime():
+    """System uptime at which this process was started, from /proc/self/stat."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The command name may contain spaces; the fields after it do not
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[19]) / CLOCK_TICKS  # field 22, starttime
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class StartupTimer:
+    """Milestones of bringing the camera up, and how long triggers take to become files.
+
+    mark() records a milestone both as seconds since the process started
+    and since the Pi booted, so a slow boot and a slow start-up can be told
+    apart. Trigger-to-file latencies are kept per capture kind for the last
+    `history` captures.
+    """
+
+    def __init__(self, history=50):
+        self.started_uptime = process_start_uptime()
+        self._t0 = time.monotonic()
+        self._uptime_at_t0 = system_uptime()
+        if self.started_uptime is None or self._uptime_at_t0 is None:
+            self.started_uptime = self._uptime_at_t0  # count from now
+        self.milestones = {}  # name -> (seconds since process start, seconds since boot)
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=history))
+
+    def mark(self, name):
+        elapsed = time.monotonic() - self._t0
+        since_boot = None if self._uptime_at_t0 is None else self._uptime_at_t0 + elapsed
+        since_start = elapsed if since_boot is None else since_boot - self.started_uptime
+        self.milestones[name] = (since_start, since_boot)
+        boot = "" if since_boot is None else f", {since_boot:.2f} s after boot"
+        print(f"Startup: {name} {since_start:.2f} s after start{boot}")
+        return since_start
+
+    def record_latency(self, kind, seconds):
+        """Time from a capture being triggered until its file was written."""
+        self.latencies[kind].append(seconds)
+
+    def stats(self):
+        latencies = {}
+        for kind, values in self.latencies.items():
+            ordered = sorted(values)
+            latencies[kind] = {
+                "count": len(values),
+                "last_ms": round(values[-1] * 1000, 1),
+                "median_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                "max_ms": round(ordered[-1] * 1000, 1),
+            }
+        return {
+            "milestones": {name: {"since_start_s": round(start, 3),
+                                  "since_boot_s": None if boot is None else round(boot, 3)}
+                           for name, (start, boot) in self.milestones.items()},
+            "trigger_to_file": latencies,
+        }
+
+    def metrics(self):
+        """Flat numbers for telemetry."""
+        metrics = {f"{name}_s": round(start, 3) for name, (start, _) in self.milestones.items()}
+        for kind, values in self.latencies.items():
+            metrics[f"{kind}_trigger_to_file_ms"] = round(values[-1] * 1000, 1)
+        return metrics
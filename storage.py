@@ -0,0 +1,294 @@
+import os
+import shutil
+import threading
+import time
+
+from media_index import thumbnail_path
+
+MB = 1 << 20
+
+# Rough sizes of what the camera writes, for admission estimates
+JPEG_BYTES_PER_PIXEL = 0.35  # default libcamera/Picamera2 JPEG quality
+VIDEO_BITRATE = 10000000  # bits/s, the H.264 encoder bitrate of recording.py
+TIMELAPSE_MP4_BYTES_PER_PIXEL = 0.02  # per frame of the assembled x264 video
+ESTIMATE_MARGIN = 1.2  # estimates are padded by 20%
+
+RETENTION_POLICIES = (None, 'oldest', 'offloaded')
+
+
+def remove_media(base_dir, media_index, path):
+    """Remove a photo, video or timelapse folder with its thumbnail and catalog entry."""
+    full_path = os.path.join(base_dir, path)
+    if os.path.isdir(full_path):
+        shutil.rmtree(full_path, ignore_errors=True)
+    else:
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
+    kind, name = path.split(os.sep)[0], os.path.basename(path)
+    try:
+        os.remove(os.path.join(base_dir, thumbnail_path(kind, name)))
+    except FileNotFoundError:
+        pass
+    media_index.remove(path)
+
+
+class StorageFull(Exception):
+    """Raised when a capture would not fit in the free space or its kind's quota."""
+
+
+def estimate_bytes(kind, size=(2028, 1520), duration=0, interval=1, bitrate=VIDEO_BITRATE,
+                   video=False, keep_frames=True):
+    """Bytes a capture will write; `duration` and `interval` in seconds."""
+    width, height = size
+    frame = width * height * JPEG_BYTES_PER_PIXEL
+    if kind == 'photos':
+        estimate = frame
+    elif kind == 'videos':
+        estimate = bitrate / 8 * duration
+    elif kind == 'timelapses':
+        frames = duration / max(interval, 1e-3) + 1
+        estimate = frames * (frame if keep_frames else 0)
+        if video:
+            estimate += frames * width * height * TIMELAPSE_MP4_BYTES_PER_PIXEL
+    else:
+        raise ValueError(f"unknown kind {kind}")
+    return int(estimate * ESTIMATE_MARGIN)
+
+
+class StorageManager:
+    """Keeps captures from filling the card.
+
+    check() admits a capture only if its estimated size fits into the free
+    space (minus `min_free`) and the kind's quota. reserve() does the same
+    when the capture actually starts and then watches the output while it
+    is written, setting the capture's stop event when the quota or the free
+    space runs out. Free space comes from a statvfs cached for
+    `statvfs_ttl` seconds. With a retention policy, 'oldest' media or media
+    already 'offloaded' (see MediaIndex.mark_offloaded) are pruned to make
+    room instead of refusing the capture.
+    """
+
+    def __init__(self, base_dir, media_index, quotas=None, min_free=256 * MB, retention=None,
+                 statvfs_ttl=2.0, watch_interval=2.0):
+        if retention not in RETENTION_POLICIES:
+            raise ValueError(f"unknown retention policy {retention}")
+        self.base_dir = base_dir
+        self.media_index = media_index
+        self.quotas = dict(quotas or {})  # kind -> bytes
+        self.min_free = min_free
+        self.retention = retention
+        self.statvfs_ttl = statvfs_ttl
+        self.watch_interval = watch_interval
+        self.pruned = []  # (path, bytes) of the last pruned items
+        self._statvfs = None
+        self._statvfs_time = 0
+        self._reservations = set()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls, base_dir, media_index):
+        """Settings from ACTIONPI_MIN_FREE_MB, ACTIONPI_QUOTAS ("videos=8000,timelapses=4000",
+        in MB) and ACTIONPI_RETENTION (oldest or offloaded)."""
+        quotas = {}
+        for item in filter(None, os.environ.get('ACTIONPI_QUOTAS', '').split(',')):
+            kind, _, megabytes = item.partition('=')
+            quotas[kind.strip()] = int(float(megabytes) * MB)
+        return cls(base_dir, media_index, quotas=quotas,
+                   min_free=int(float(os.environ.get('ACTIONPI_MIN_FREE_MB', 256)) * MB),
+                   retention=os.environ.get('ACTIONPI_RETENTION') or None)
+
+    # Free space
+
+    def statvfs(self, refresh=False):
+        now = time.monotonic()
+        with self._lock:
+            if refresh or self._statvfs is None or now - self._statvfs_time > self.statvfs_ttl:
+                self._statvfs = os.statvfs(self.base_dir)
+                self._statvfs_time = now
+            return self._statvfs
+
+    def free_bytes(self, refresh=False):
+        st = self.statvfs(refresh)
+        return st.f_bavail * st.f_frsize
+
+    def disk_usage(self):
+        st = self.statvfs()
+        total = st.f_blocks * st.f_frsize
+        free = st.f_bavail * st.f_frsize
+        return total, total - st.f_bfree * st.f_frsize, free
+
+    def kind_usage(self, kind):
+        return self.media_index.counts().get(kind, {}).get("size", 0)
+
+    # Admission
+
+    def _reserved(self, kind=None):
+        return sum(r.remaining() for r in self._reservations if kind is None or r.kind == kind)
+
+    def check(self, kind, estimate):
+        """Raise StorageFull unless `estimate` more bytes of `kind` fit, pruning first if allowed."""
+        with self._lock:
+            quota = self.quotas.get(kind)
+            if quota is not None:
+                used = self.kind_usage(kind) + self._reserved(kind)
+                if used + estimate > quota and self.retention:
+                    self.prune(used + estimate - quota, kind=kind)
+                    used = self.kind_usage(kind) + self._reserved(kind)
+                if used + estimate > quota:
+                    raise StorageFull(f"{kind} quota: {estimate / MB:.0f} MB needed, "
+                                      f"{max(quota - used, 0) / MB:.0f} MB left")
+            short = estimate + self._reserved() + self.min_free - self.free_bytes(refresh=True)
+            if short > 0 and self.retention:
+                self.prune(short)
+                short = estimate + self._reserved() + self.min_free - self.free_bytes(refresh=True)
+            if short > 0:
+                raise StorageFull(f"{estimate / MB:.0f} MB needed, "
+                                  f"{max(estimate - short, 0) / MB:.0f} MB available")
+
+    def reserve(self, kind, estimate, path, stop_event):
+        """Admit a capture that writes to `path` and watch it while it runs.
+
+        Use as a context manager around the capture. If the quota or the free
+        space runs out, `stop_event` is set and the reason is kept in
+        `reservation.stopped`. `path` is a file, a folder or, for a series of
+        files that do not exist yet (a burst), the start of their names.
+        """
+        with self._lock:
+            self.check(kind, estimate)
+            reservation = Reservation(self, kind, estimate, path, stop_event)
+            self._reservations.add(reservation)
+        return reservation
+
+    def _release(self, reservation):
+        with self._lock:
+            self._reservations.discard(reservation)
+        # The capture's own bytes are now on disk and in the index
+        self.statvfs(refresh=True)
+
+    # Retention
+
+    def prune(self, needed, kind=None):
+        """Delete media oldest first (only offloaded ones under that policy) until
+        `needed` bytes are freed; returns the bytes freed."""
+        busy = {os.path.relpath(r.path, self.base_dir) for r in self._reservations}
+        freed = 0
+        skipped = 0
+        while freed < needed:
+            items = self.media_index.oldest(kind, offloaded_only=self.retention == 'offloaded',
+                                            limit=skipped + 50)[skipped:]
+            if not items:
+                break
+            for item in items:
+                if item['path'] in busy:
+                    skipped += 1
+                    continue
+                self.delete(item)
+                freed += item['size']
+                if freed >= needed:
+                    break
+        if freed:
+            print(f"Pruned {freed / MB:.0f} MB of {kind or 'media'} ({self.retention})")
+            self.statvfs(refresh=True)
+        return freed
+
+    def delete(self, item):
+        """Remove a catalog item with its thumbnail."""
+        remove_media(self.base_dir, self.media_index, item['path'])
+        self.pruned.append((item['path'], item['size']))
+        del self.pruned[:-50]
+
+    def stats(self):
+        total, used, free = self.disk_usage()
+        with self._lock:
+            reservations = [r.to_dict() for r in self._reservations]
+        return {
+            "total_bytes": total,
+            "used_bytes": used,
+            "free_bytes": free,
+            "min_free_bytes": self.min_free,
+            "quotas": {kind: {"quota": quota, "used": self.kind_usage(kind)} for kind, quota in self.quotas.items()},
+            "retention": self.retention,
+            "reservations": reservations,
+            "pruned": [{"path": p, "bytes": b} for p, b in self.pruned],
+        }
+
+
+class Reservation:
+    """Space admitted for one running capture; watches its output on a thread."""
+
+    GROWING = 10  # seconds since its last change a file may still be being written
+
+    def __init__(self, manager, kind, estimate, path, stop_event):
+        self.manager = manager
+        self.kind = kind
+        self.estimate = estimate
+        self.path = path
+        self.stop_event = stop_event
+        self.written = 0
+        self.stopped = None  # why the capture was stopped, if it was
+        self._sizes = {}  # name -> (size, mtime) of the files in a folder or series
+        self._done = threading.Event()
+        self._thread = None
+
+    def remaining(self):
+        """Admitted bytes not written yet."""
+        return max(self.estimate - self.written, 0)
+
+    def _measure(self):
+        try:
+            if os.path.isdir(self.path):
+                folder, prefix = self.path, ""
+            elif os.path.exists(self.path):
+                return os.stat(self.path).st_size
+            else:
+                folder, prefix = os.path.split(self.path)
+            # Only stat new files and those changed lately: frames are written
+            # once, but the current one, an assembled video or a manifest grow
+            now = time.time()
+            for entry in os.scandir(folder):
+                if not entry.name.startswith(prefix):
+                    continue
+                seen = self._sizes.get(entry.name)
+                if seen is None or now - seen[1] < self.GROWING:
+                    stat = entry.stat()
+                    self._sizes[entry.name] = (stat.st_size, stat.st_mtime)
+            return sum(size for size, _ in self._sizes.values())
+        except FileNotFoundError:
+            return 0
+
+    def _watch(self):
+        manager = self.manager
+        quota = manager.quotas.get(self.kind)
+        base = manager.kind_usage(self.kind)
+        while not self._done.wait(manager.watch_interval):
+            self.written = self._measure()
+            reason = None
+            if quota is not None and base + self.written > quota:
+                reason = f"{self.kind} quota reached"
+            elif manager.free_bytes() < manager.min_free:
+                with manager._lock:
+                    if manager.retention:
+                        manager.prune(manager.min_free - manager.free_bytes(refresh=True) + 64 * MB)
+                    if manager.free_bytes(refresh=True) < manager.min_free:
+                        reason = "card full"
+            if reason:
+                print(f"Stopping capture to {self.path}: {reason}")
+                self.stopped = reason
+                self.stop_event.set()
+                return
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._watch, name="storage-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join(timeout=5)
+        self.manager._release(self)
+
+    def to_dict(self):
+        return {"kind": self.kind, "path": self.path, "estimate": self.estimate,
+                "written": self.written, "stopped": self.stopped}
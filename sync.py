@@ -0,0 +1,556 @@
+import abc
+import hashlib
+import http.client
+import os
+import re
+import shutil
+import socket
+import threading
+import time
+import urllib.parse
+from base64 import b64encode
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from process_runner import runner
+
+CHUNK_SIZE = 1 << 20
+KB = 1024
+
+
+def file_sha256(path, block=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(block), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def item_files(base_dir, path):
+    """Relative paths of the files of one catalog item; a timelapse is a folder of them."""
+    full_path = os.path.join(base_dir, path)
+    if os.path.isdir(full_path):
+        return sorted(os.path.join(path, e.name) for e in os.scandir(full_path) if e.is_file())
+    return [path]
+
+
+class RateLimit:
+    """Token bucket: take(n) waits as long as needed to keep to `rate` bytes/s on average."""
+
+    def __init__(self, rate, wait=time.sleep):
+        self.rate = rate  # bytes/s, 0 for no limit
+        self.wait = wait
+        self._tokens = rate
+        self._last = time.monotonic()
+
+    def take(self, n):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        # At most one second worth of bursting
+        self._tokens = min(self.rate, self._tokens + (now - self._last) * self.rate) - n
+        self._last = now
+        if self._tokens < 0:
+            self.wait(-self._tokens / self.rate)
+
+
+def _port_open(host, port, timeout=3):
+    try:
+        socket.create_connection((host, port), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+class ChunkedTarget(abc.ABC):
+    """A target that takes a file in chunks and can say how much of it it already has.
+
+    upload() asks for the remote state first; if the remote holds a prefix
+    whose checksum matches the local file, only the rest is sent, otherwise
+    the file starts over. The file counts as copied once the remote reports
+    the full size and the SHA-256 of the whole local file.
+    """
+
+    chunk_size = CHUNK_SIZE
+
+    @abc.abstractmethod
+    def reachable(self):
+        """Whether sending can start now."""
+
+    @abc.abstractmethod
+    def remote_state(self, path):
+        """(bytes held, SHA-256 of those bytes), (0, None) if there is nothing."""
+
+    @abc.abstractmethod
+    def write(self, path, offset, data, total):
+        """Store `data` at `offset` of the remote copy of `path`, `total` bytes long once complete."""
+
+    def finish(self, path, size, sha256):
+        return self.remote_state(path) == (size, sha256)
+
+    def upload(self, path, full_path, sync):
+        size = os.path.getsize(full_path)
+        if size == 0:
+            return True  # nothing worth keeping
+        offset, remote_sha256 = self.remote_state(path)
+        digest = hashlib.sha256()
+        with open(full_path, 'rb') as f:
+            if 0 < offset <= size:
+                remaining = offset
+                while remaining:
+                    data = f.read(min(self.chunk_size, remaining))
+                    digest.update(data)
+                    remaining -= len(data)
+                if digest.hexdigest() != remote_sha256:
+                    offset = 0
+            else:
+                offset = 0
+            if offset == 0:
+                digest = hashlib.sha256()
+                f.seek(0)
+            elif offset < size:
+                print(f"Sync: resuming {path} at {offset} of {size} bytes")
+            while offset < size:
+                data = f.read(self.chunk_size)
+                if not data:
+                    raise OSError(f"{path} shrank while being sent")
+                sync.throttle(len(data))
+                self.write(path, offset, data, size)
+                digest.update(data)
+                offset += len(data)
+                sync.progress(path, offset, size, len(data))
+        return self.finish(path, size, digest.hexdigest())
+
+
+class LocalTarget(ChunkedTarget):
+    """A directory on another disk or a network mount.
+
+    Chunks go to `<name>.part`, which is renamed once its checksum matches.
+    It only counts as reachable while it is on another filesystem than
+    `base_dir`, so an unmounted mount point does not fill the SD card.
+    """
+
+    def __init__(self, root, base_dir=None):
+        self.root = root
+        self.base_dir = base_dir
+
+    def __str__(self):
+        return self.root
+
+    def reachable(self):
+        try:
+            if not os.access(self.root, os.W_OK) or not os.path.isdir(self.root):
+                return False
+            return self.base_dir is None or os.stat(self.root).st_dev != os.stat(self.base_dir).st_dev
+        except OSError:
+            return False
+
+    def remote_state(self, path):
+        full_path = os.path.join(self.root, path)
+        for name in (full_path + '.part', full_path):
+            if os.path.exists(name):
+                return os.path.getsize(name), file_sha256(name)
+        return 0, None
+
+    def write(self, path, offset, data, total):
+        full_path = os.path.join(self.root, path)
+        part = full_path + '.part'
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        if offset and not os.path.exists(part):
+            shutil.copyfile(full_path, part)  # a complete copy of a file that has since grown
+        with open(part, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.write(data)
+            f.truncate()
+            if offset + len(data) == total:
+                os.fsync(f.fileno())
+
+    def finish(self, path, size, sha256):
+        full_path = os.path.join(self.root, path)
+        part = full_path + '.part'
+        if os.path.exists(part):
+            if (os.path.getsize(part), file_sha256(part)) != (size, sha256):
+                return False
+            os.replace(part, full_path)
+            return True
+        return super().finish(path, size, sha256)
+
+
+class HttpTarget(ChunkedTarget):
+    """An HTTP server taking resumable PUTs, like the stand-in of StandInHandler.
+
+    HEAD <url>/<path> answers 404, or the bytes held so far in Upload-Offset
+    with their SHA-256 in X-Sha256. PUT sends one chunk with Content-Range
+    and the chunk's SHA-256 in X-Chunk-Sha256; the server answers 204 while
+    the file is incomplete, 201 once it is whole, 400 for a corrupt chunk
+    and 416 if the range does not continue what it has. User and password
+    in the URL are sent as basic auth.
+    """
+
+    def __init__(self, url, timeout=30):
+        parts = urllib.parse.urlsplit(url)
+        self.url = url
+        self.https = parts.scheme == 'https'
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.https else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.headers = {}
+        if parts.username:
+            credentials = f"{urllib.parse.unquote(parts.username)}:{urllib.parse.unquote(parts.password or '')}"
+            self.headers["Authorization"] = "Basic " + b64encode(credentials.encode()).decode()
+        self._conn = None
+
+    def __str__(self):
+        return urllib.parse.urlsplit(self.url)._replace(netloc=f"{self.host}:{self.port}").geturl()
+
+    def reachable(self):
+        return _port_open(self.host, self.port)
+
+    def _request(self, method, path, body=None, headers=None):
+        if self._conn is None:
+            connection = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._conn = connection(self.host, self.port, timeout=self.timeout)
+        try:
+            self._conn.request(method, urllib.parse.quote(f"{self.prefix}/{path}"), body,
+                               {**self.headers, **(headers or {})})
+            response = self._conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self._conn.close()
+            self._conn = None
+            raise
+        return response
+
+    def remote_state(self, path):
+        response = self._request('HEAD', path)
+        if response.status == 404:
+            return 0, None
+        if response.status != 200:
+            raise OSError(f"HEAD {path}: HTTP {response.status}")
+        return int(response.getheader('Upload-Offset', 0)), response.getheader('X-Sha256')
+
+    def write(self, path, offset, data, total):
+        response = self._request('PUT', path, data, {
+            "Content-Range": f"bytes {offset}-{offset + len(data) - 1}/{total}",
+            "X-Chunk-Sha256": hashlib.sha256(data).hexdigest(),
+        })
+        if response.status not in (201, 204):
+            raise OSError(f"PUT {path} at {offset}: HTTP {response.status}")
+
+
+class RsyncTarget:
+    """`[user@]host:path` over SSH with rsync, which checksums and resumes by itself.
+
+    Each file is one rsync run at nice 10 and --bwlimit; a partial file is
+    kept (--partial) and continued after its prefix is verified
+    (--append-verify). A capture starting meanwhile cancels the run, and the
+    file continues in a later round. SSH needs key authentication.
+    """
+
+    def __init__(self, dest, bwlimit=0):
+        self.dest = dest
+        self.host = dest.split(':', 1)[0].rsplit('@', 1)[-1]
+        self.bwlimit = bwlimit  # bytes/s
+
+    def __str__(self):
+        return self.dest
+
+    def reachable(self):
+        return _port_open(self.host, 22)
+
+    def upload(self, path, full_path, sync):
+        sync.throttle(0)  # wait for a running capture to finish
+        cmd = ['nice', '-n', '10', 'rsync', '--relative', '--partial', '--append-verify', '--timeout=60',
+               '-e', 'ssh -o BatchMode=yes -o ConnectTimeout=10']
+        if self.bwlimit:
+            cmd.append(f'--bwlimit={max(1, self.bwlimit // KB)}')
+        # base_dir/./path makes rsync recreate path below the destination
+        cmd += [os.path.join(sync.base_dir, '.', path), self.dest.rstrip('/') + '/']
+        process = runner.start(cmd, name='rsync')
+        while process.wait(timeout=1) is None:
+            if sync.busy() or sync.stopping:
+                process.cancel()
+        result = process.wait()
+        if result.cancelled:
+            return False
+        result.check()
+        size = os.path.getsize(full_path)
+        sync.progress(path, size, size, size)
+        return True
+
+
+def make_target(spec, base_dir=None, bwlimit=0):
+    """http(s)://host[:port]/path, [user@]host:path for rsync, or a directory."""
+    if spec.startswith(('http://', 'https://')):
+        return HttpTarget(spec)
+    if ':' in spec and not spec.startswith(('/', '.')):
+        return RsyncTarget(spec, bwlimit)
+    return LocalTarget(spec, base_dir)
+
+
+class SyncManager:
+    """Copies media from the catalog to a target in the background.
+
+    Every `interval` seconds (or on wake()) the oldest items not yet marked
+    offloaded are sent if the target is reachable, one file at a time.
+    Nothing is sent while `busy()` is true (a capture is running), at most
+    `bwlimit` bytes/s otherwise, from a thread at low CPU priority. Items
+    changed in the last `settle` seconds may still be being written and wait
+    for the next round, as do items that failed; `max_failures` failures in
+    a row end the round. Once the remote copy checks out an item is marked
+    offloaded, and passed to `delete` if that is given.
+    """
+
+    def __init__(self, target, base_dir, media_index, bwlimit=0, interval=60, delete=None, busy=None, settle=30,
+                 max_failures=3):
+        self.target = target
+        self.base_dir = base_dir
+        self.media_index = media_index
+        self.interval = interval
+        self.delete = delete
+        self.busy = busy or (lambda: False)
+        self.settle = settle
+        self.max_failures = max_failures  # failed items in a row that end a round
+        self.state = 'idle'
+        self.reachable = None
+        self.current = None  # {"path", "offset", "size"}
+        self.items_total = 0
+        self.bytes_total = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_round = None
+        self.paused_seconds = 0.0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._rate = RateLimit(bwlimit, wait=self._stop.wait)
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, base_dir, media_index, busy=None, delete=None):
+        """None without ACTIONPI_SYNC_TARGET; ACTIONPI_SYNC_BWLIMIT is in KB/s (default 1024, 0: no
+        limit), ACTIONPI_SYNC_INTERVAL in seconds and ACTIONPI_SYNC_DELETE=1 passes offloaded items to `delete`."""
+        spec = os.environ.get('ACTIONPI_SYNC_TARGET')
+        if not spec:
+            return None
+        bwlimit = int(float(os.environ.get('ACTIONPI_SYNC_BWLIMIT', 1024)) * KB)
+        return cls(make_target(spec, base_dir, bwlimit), base_dir, media_index, bwlimit=bwlimit,
+                   interval=float(os.environ.get('ACTIONPI_SYNC_INTERVAL', 60)), busy=busy,
+                   delete=delete if os.environ.get('ACTIONPI_SYNC_DELETE') == '1' else None)
+
+    @property
+    def stopping(self):
+        return self._stop.is_set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sync", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.state = 'stopped'
+
+    def wake(self):
+        """Start a round now instead of at the next interval."""
+        self._wake.set()
+
+    def _run(self):
+        try:
+            # Checksumming and sending must never compete with a capture
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+        except (AttributeError, OSError):
+            pass
+        while not self._stop.is_set():
+            self.run_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def throttle(self, n):
+        """Called before sending n bytes: waits out captures and keeps to the bandwidth limit."""
+        if self.busy() and not self._stop.is_set():
+            self.state = 'paused'
+            t0 = time.monotonic()
+            while self.busy() and not self._stop.wait(0.5):
+                pass
+            self.paused_seconds += time.monotonic() - t0
+            self.state = 'sending'
+        if self._stop.is_set():
+            raise InterruptedError("sync stopped")
+        self._rate.take(n)
+
+    def progress(self, path, offset, size, sent):
+        self.current = {"path": path, "offset": offset, "size": size}
+        self.bytes_total += sent
+
+    def run_once(self):
+        """Send what is pending; returns the number of items offloaded."""
+        self.last_round = time.time()
+        self.reachable = self.target.reachable()
+        if not self.reachable:
+            self.state = 'unreachable'
+            return 0
+        self.state = 'sending'
+        done = 0
+        skipped = 0
+        failures = 0  # in a row
+        try:
+            while not self._stop.is_set():
+                items = self.media_index.not_offloaded(limit=skipped + 20)[skipped:]
+                if not items:
+                    break
+                for item in items:
+                    if self._stop.is_set():
+                        break
+                    if not self._settled(item):
+                        skipped += 1
+                    elif self.sync_item(item):
+                        done += 1
+                        failures = 0
+                    elif self._stop.is_set():
+                        break
+                    else:
+                        # One bad item must not hold up the newer ones, but a
+                        # target that went away or fails everything ends the round
+                        skipped += 1
+                        failures += 1
+                        if failures >= self.max_failures:
+                            return done
+                        self.reachable = self.target.reachable()
+                        if not self.reachable:
+                            return done
+        finally:
+            self.current = None
+            if self.state != 'stopped':
+                self.state = 'idle'
+        return done
+
+    def _settled(self, item):
+        try:
+            return time.time() - os.stat(os.path.join(self.base_dir, item['path'])).st_mtime >= self.settle
+        except FileNotFoundError:
+            return False  # the catalog catches up on its own
+
+    def sync_item(self, item):
+        try:
+            for path in item_files(self.base_dir, item['path']):
+                if not self.target.upload(path, os.path.join(self.base_dir, path), self):
+                    raise OSError(f"{path} did not check out on {self.target}")
+        except InterruptedError:
+            return False
+        except Exception as e:
+            self.errors += 1
+            self.last_error = f"{item['path']}: {e}"
+            print(f"Sync of {item['path']} failed: {e}")
+            return False
+        self.media_index.mark_offloaded(item['path'])
+        self.items_total += 1
+        print(f"Offloaded {item['path']} to {self.target}")
+        if self.delete is not None:
+            self.delete(item)
+        return True
+
+    def stats(self):
+        return {
+            "target": str(self.target),
+            "state": self.state,
+            "reachable": self.reachable,
+            "bwlimit": self._rate.rate,
+            "current": self.current,
+            "items_total": self.items_total,
+            "bytes_total": self.bytes_total,
+            "paused_seconds": round(self.paused_seconds, 1),
+            "errors": self.errors,
+            "last_error": self.last_error,
+            "last_round": self.last_round,
+            "delete_after": self.delete is not None,
+        }
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """The receiving end of HttpTarget, to test against off the network (see below)."""
+
+    protocol_version = "HTTP/1.1"
+    root = "."
+
+    def _paths(self):
+        path = os.path.normpath(urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).lstrip('/'))
+        if path.startswith('..') or os.path.isabs(path):
+            return None
+        full_path = os.path.join(self.root, path)
+        return full_path, full_path + '.part'
+
+    def _reply(self, status, offset=None):
+        self.send_response(status)
+        if offset is not None:
+            self.send_header('Upload-Offset', str(offset))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_HEAD(self):
+        paths = self._paths()
+        for name in paths or ():
+            if os.path.exists(name):
+                self.send_response(200)
+                self.send_header('Upload-Offset', str(os.path.getsize(name)))
+                self.send_header('X-Sha256', file_sha256(name))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self._reply(404)
+
+    def do_PUT(self):
+        paths = self._paths()
+        match = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+)', self.headers.get('Content-Range', ''))
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if paths is None or match is None:
+            return self._reply(400)
+        full_path, part = paths
+        start, end, total = map(int, match.groups())
+        if hashlib.sha256(data).hexdigest() != self.headers.get('X-Chunk-Sha256') or end - start + 1 != len(data):
+            return self._reply(400)
+        if start and not os.path.exists(part) and os.path.exists(full_path):
+            shutil.copyfile(full_path, part)
+        held = os.path.getsize(part) if os.path.exists(part) else 0
+        if start not in (0, held):
+            return self._reply(416, held)
+        os.makedirs(os.path.dirname(part), exist_ok=True)
+        with open(part, 'r+b' if start else 'wb') as f:
+            f.seek(start)
+            f.write(data)
+            f.truncate()
+        if end + 1 == total:
+            os.replace(part, full_path)
+            return self._reply(201, total)
+        self._reply(204, end + 1)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    # python3 sync.py serve DIR [PORT]            the HTTP stand-in, receiving into DIR
+    # python3 sync.py push BASE_DIR TARGET [KB/s]  one round of sending BASE_DIR's media
+    import sys
+    if len(sys.argv) >= 3 and sys.argv[1] == 'serve':
+        StandInHandler.root = sys.argv[2]
+        port = int(sys.argv[3]) if len(sys.argv) > 3 else 8008
+        print(f"Receiving uploads into {sys.argv[2]} on port {port}")
+        ThreadingHTTPServer(('', port), StandInHandler).serve_forever()
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'push':
+        from media_index import KINDS, MediaIndex
+        base_dir, bwlimit = sys.argv[2], int(float(sys.argv[4]) * KB) if len(sys.argv) > 4 else 0
+        index = MediaIndex(base_dir, kinds=KINDS)
+        index.reconcile(force=True)
+        manager = SyncManager(make_target(sys.argv[3], base_dir, bwlimit), base_dir, index, bwlimit=bwlimit, settle=0)
+        t0 = time.monotonic()
+        count = manager.run_once()
+        stats = manager.stats()
+        print(f"{count} items, {stats['bytes_total']} bytes in {time.monotonic() - t0:.1f} s; {stats}")
+    else:
+        print("usage: sync.py serve DIR [PORT] | push BASE_DIR TARGET [KB/s]")
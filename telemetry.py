@@ -0,0 +1,229 @@
+import collections
+import json
+import os
+import threading
+import time
+
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+# Newer Raspberry Pi kernels expose the firmware's throttle flags here,
+# which is far cheaper than running `vcgencmd get_throttled`
+THROTTLED_PATHS = ["/sys/devices/platform/soc/soc:firmware/get_throttled",
+                   "/sys/devices/platform/soc/soc:firmware/raspberrypi-hwmon/get_throttled"]
+
+# Bits of the firmware throttle word
+THROTTLE_FLAGS = {
+    0: "under_voltage",
+    1: "freq_capped",
+    2: "throttled",
+    3: "soft_temp_limit",
+    16: "under_voltage_occurred",
+    17: "freq_capped_occurred",
+    18: "throttled_occurred",
+    19: "soft_temp_limit_occurred",
+}
+
+
+def read_temperature(zone=THERMAL_ZONE):
+    """SoC temperature in °C, or None where there is no thermal zone."""
+    try:
+        with open(zone) as f:
+            return int(f.read()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+def read_throttled():
+    """The firmware throttle word as an int, or None if it cannot be read cheaply."""
+    for path in THROTTLED_PATHS:
+        try:
+            with open(path) as f:
+                return int(f.read().strip(), 16)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def decode_throttled(value):
+    return {name: bool(value >> bit & 1) for bit, name in THROTTLE_FLAGS.items()}
+
+
+class SystemSampler:
+    """CPU, memory and IO use; with psutil if installed, from /proc otherwise.
+
+    psutil is imported with the first sample, on the telemetry thread, so
+    it does not add to start-up.
+    """
+
+    def __init__(self):
+        self._cpu = None  # (busy, total) jiffies of the last /proc/stat sample
+        self._psutil = None
+        self._process = None
+        self._loaded = False
+
+    def _load_psutil(self):
+        self._loaded = True
+        try:
+            import psutil
+        except ImportError:
+            return
+        self._psutil = psutil
+        self._process = psutil.Process()
+        psutil.cpu_percent(interval=None)  # the first call only sets the baseline
+
+    def sample(self):
+        if not self._loaded:
+            self._load_psutil()
+        psutil = self._psutil
+        sample = {"load_1m": os.getloadavg()[0]}
+        if psutil is not None:
+            memory = psutil.virtual_memory()
+            sample.update(cpu_percent=psutil.cpu_percent(interval=None),
+                          mem_percent=memory.percent,
+                          mem_available_bytes=memory.available,
+                          process_rss_bytes=self._process.memory_info().rss)
+            io = psutil.disk_io_counters()
+            if io is not None:
+                sample.update(disk_read_bytes_total=io.read_bytes, disk_write_bytes_total=io.write_bytes)
+            net = psutil.net_io_counters()
+            sample.update(net_sent_bytes_total=net.bytes_sent, net_recv_bytes_total=net.bytes_recv)
+            return sample
+        try:
+            with open("/proc/stat") as f:
+                fields = [int(x) for x in f.readline().split()[1:]]
+            busy, total = sum(fields) - fields[3] - fields[4], sum(fields)
+            if self._cpu is not None and total > self._cpu[1]:
+                sample["cpu_percent"] = round(100.0 * (busy - self._cpu[0]) / (total - self._cpu[1]), 1)
+            self._cpu = (busy, total)
+            with open("/proc/meminfo") as f:
+                meminfo = {line.split(':')[0]: int(line.split()[1]) * 1024 for line in f}
+            sample["mem_available_bytes"] = meminfo["MemAvailable"]
+            sample["mem_percent"] = round(100.0 * (1 - meminfo["MemAvailable"] / meminfo["MemTotal"]), 1)
+        except (OSError, KeyError, ValueError, IndexError):
+            pass
+        return sample
+
+
+class Telemetry:
+    """Samples system and pipeline metrics on one background thread.
+
+    Pipelines register a function returning a flat dict of numbers. Names
+    ending in `_total` are counters; for those the sample also carries a
+    `_per_s` rate over the last interval. The last `history` samples are
+    kept for charts; prometheus() and sse() expose them.
+    """
+
+    def __init__(self, interval=2.0, history=300, thermal_zone=THERMAL_ZONE):
+        self.interval = interval
+        self.thermal_zone = thermal_zone
+        self.history = collections.deque(maxlen=history)
+        self.seq = 0
+        self._collectors = {}
+        self._system = SystemSampler()
+        self._previous = None
+        self._cond = threading.Condition()
+        self._thread = None
+        self.sample_cost_ms = 0.0  # what the last sample cost, to keep an eye on overhead
+
+    def register(self, name, collect):
+        """Add a pipeline; collect() returns {metric: number} and must be cheap."""
+        self._collectors[name] = collect
+
+    def unregister(self, name):
+        self._collectors.pop(name, None)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.sample()
+            time.sleep(self.interval)
+
+    def sample(self):
+        t0 = time.monotonic()
+        now = time.time()
+        system = self._system.sample()
+        system["temperature_c"] = read_temperature(self.thermal_zone)
+        throttled = read_throttled()
+        if throttled is not None:
+            system["throttle_flags"] = throttled
+            system.update(decode_throttled(throttled))
+        pipelines = {}
+        for name, collect in list(self._collectors.items()):
+            try:
+                pipelines[name] = collect()
+            except Exception as e:
+                pipelines[name] = {"error": str(e)}
+        sample = {"time": now, "system": system, "pipelines": pipelines}
+        if self._previous is not None:
+            self._add_rates(sample, self._previous)
+        self._previous = sample
+        self.sample_cost_ms = (time.monotonic() - t0) * 1000
+        with self._cond:
+            self.seq += 1
+            sample["seq"] = self.seq
+            self.history.append(sample)
+            self._cond.notify_all()
+        return sample
+
+    @staticmethod
+    def _add_rates(sample, previous):
+        elapsed = sample["time"] - previous["time"]
+        if elapsed <= 0:
+            return
+        groups = [(sample["system"], previous["system"])]
+        groups += [(metrics, previous["pipelines"].get(name, {})) for name, metrics in sample["pipelines"].items()]
+        for metrics, before in groups:
+            for key, value in list(metrics.items()):
+                if key.endswith("_total") and isinstance(before.get(key), (int, float)):
+                    metrics[key[:-len("_total")] + "_per_s"] = round((value - before[key]) / elapsed, 3)
+
+    def latest(self):
+        with self._cond:
+            return self.history[-1] if self.history else None
+
+    def wait_next(self, seq, timeout=None):
+        """Block until a sample newer than `seq` exists and return it (None on timeout)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.seq > seq, timeout):
+                return None
+            return self.history[-1]
+
+    def prometheus(self):
+        """The latest sample in the Prometheus text exposition format."""
+        sample = self.latest()
+        if sample is None:
+            return ""
+        lines = []
+        for key, value in sorted(sample["system"].items()):
+            if isinstance(value, (bool, int, float)):
+                lines.append(f"actionpi_{key} {float(value)}")
+        for name, metrics in sorted(sample["pipelines"].items()):
+            for key, value in sorted(metrics.items()):
+                if isinstance(value, (bool, int, float)):
+                    lines.append(f'actionpi_pipeline_{key}{{pipeline="{name}"}} {float(value)}')
+        lines.append(f"actionpi_telemetry_sample_ms {self.sample_cost_ms:.3f}")
+        return "\n".join(lines) + "\n"
+
+    def sse(self, keepalive=15.0):
+        """Server-Sent Events: one `data:` line per sample, comments to keep the connection up."""
+        seq = self.seq - 1 if self.seq else 0
+        while True:
+            sample = self.wait_next(seq, timeout=keepalive)
+            if sample is None:
+                yield ": keepalive\n\n"
+                continue
+            seq = sample["seq"]
+            yield f"id: {seq}\ndata: {json.dumps(sample)}\n\n"
+
+
+if __name__ == '__main__':
+    # python3 telemetry.py: print a few samples of this machine
+    telemetry = Telemetry(interval=1.0)
+    for _ in range(3):
+        sample = telemetry.sample()
+        print(json.dumps(sample["system"]), f"({telemetry.sample_cost_ms:.2f} ms)")
+        time.sleep(telemetry.interval)
+    print(telemetry.prometheus())
@@ -0,0 +1,165 @@
+import asyncio
+import threading
+import time
+
+from broadcaster import AsyncFrameBroadcaster, FrameBroadcaster, FrameRing
+from passthrough import H264_START, h264_chunks
+
+
+class CountingSource:
+    """Pulled source that counts its frames and start/stop calls."""
+
+    def __init__(self, period=0.01, h264=False):
+        self.period = period
+        self.h264 = h264
+        self.frames = 0
+        self.starts = 0
+        self.stops = 0
+
+    def start(self):
+        self.starts += 1
+
+    def stop(self):
+        self.stops += 1
+
+    def read(self):
+        time.sleep(self.period)
+        self.frames += 1
+        if self.h264:
+            # A keyframe (SPS) every 10 chunks, P slices in between
+            return H264_START + (b"\x67" if self.frames % 10 == 1 else b"\x41") + bytes(16)
+        return b"\xff\xd8%d\xff\xd9" % self.frames
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_ring_drops_to_latest():
+    ring = FrameRing(size=4)
+    for i in range(10):
+        ring.put(b"%d" % i)
+    assert ring.latest(after=2) == (10, b"9")
+    assert ring.get(3) is None  # overwritten
+    assert ring.get(9) == b"8"
+
+
+def test_clients_are_counted_and_released():
+    broadcaster = FrameBroadcaster(CountingSource())
+    frames = broadcaster.frames()
+    next(frames)
+    assert broadcaster.clients == 1
+    frames.close()
+    assert broadcaster.clients == 0
+    broadcaster.stop()
+
+
+def test_client_block_starts_and_counts():
+    broadcaster = FrameBroadcaster(CountingSource())
+    assert not broadcaster.running
+    with broadcaster.client() as ring:
+        assert broadcaster.running and broadcaster.clients == 1
+        assert ring.latest(timeout=2)[1] is not None
+    assert broadcaster.clients == 0
+    broadcaster.stop()
+    assert not broadcaster.running
+
+
+def test_source_stops_when_idle_and_restarts_for_a_client():
+    source = CountingSource()
+    broadcaster = FrameBroadcaster(source, idle_after=0.1)
+    frames = broadcaster.frames()
+    next(frames)
+    frames.close()
+    assert wait_until(lambda: broadcaster.idle and source.stops == 1)
+    stopped_at = source.frames
+    time.sleep(0.1)
+    assert source.frames == stopped_at  # nothing read while idle
+    frames = broadcaster.frames()
+    next(frames)
+    assert source.starts == 2
+    frames.close()
+    broadcaster.stop()
+
+
+def test_h264_reader_keeps_an_idle_after_broadcaster_running():
+    # An H.264 reader used to go uncounted, so the source stopped idle_after
+    # seconds in while the reader was still attached
+    source = CountingSource(period=0.005, h264=True)
+    broadcaster = FrameBroadcaster(source, ring_size=64, idle_after=0.1)
+    chunks = h264_chunks(broadcaster, timeout=0.5)
+    received = 0
+    t0 = time.monotonic()
+    for chunk in chunks:
+        received += 1
+        assert broadcaster.clients == 1
+        if time.monotonic() - t0 > 0.5:
+            break
+    assert not broadcaster.idle
+    assert source.stops == 0
+    assert received > 40
+    chunks.close()
+    assert broadcaster.clients == 0
+    assert wait_until(lambda: broadcaster.idle)
+    broadcaster.stop()
+
+
+def test_h264_reader_starts_at_a_keyframe():
+    broadcaster = FrameBroadcaster(CountingSource(period=0.002, h264=True), ring_size=64)
+    chunks = h264_chunks(broadcaster)
+    first = next(chunks)
+    assert first[3] & 0x1f == 7
+    chunks.close()
+    broadcaster.stop()
+
+
+def test_max_fps_caps_a_pulled_source():
+    source = CountingSource(period=0.001)
+    broadcaster = FrameBroadcaster(source, max_fps=20)
+    received = []
+    stop = threading.Event()
+
+    def client():
+        for _ in broadcaster.frames():
+            received.append(time.monotonic())
+            if stop.is_set():
+                break
+
+    thread = threading.Thread(target=client)
+    thread.start()
+    time.sleep(0.5)
+    stop.set()
+    thread.join(timeout=2)
+    broadcaster.stop()
+    assert 5 <= len(received) <= 13
+
+
+def test_async_client_joining_while_the_bridge_winds_down_gets_frames():
+    def slow_to_close(_):
+        try:
+            while True:
+                time.sleep(0.01)
+                yield time.time(), b"frame"
+        finally:
+            time.sleep(0.3)
+
+    async def main():
+        bridge = AsyncFrameBroadcaster(None, reader=slow_to_close)
+        first = bridge.frames()
+        await first.__anext__()
+        await first.aclose()
+        await asyncio.sleep(0.1)  # the bridge noticed and is closing its reader
+        second = bridge.frames()
+        try:
+            await asyncio.wait_for(second.__anext__(), 2)
+        finally:
+            await second.aclose()
+        while bridge._bridge is not None:  # no publishing onto a closed loop
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+import pytest
+
+from burst import BurstCapture
+
+
+class CountingGrabber:
+    """Writes the frame number into each slot, 1 ms per frame."""
+
+    frame_bytes = 1000
+
+    def __init__(self):
+        self.count = 0
+
+    def grab(self, buffer):
+        time.sleep(0.001)
+        self.count += 1
+        data = b"%d" % self.count
+        buffer[:len(data)] = data
+        return len(data)
+
+    def encode(self, data, quality):
+        return bytes(data)
+
+
+def frame_numbers(summary):
+    numbers = []
+    for path in summary["files"]:
+        with open(path, 'rb') as f:
+            numbers.append(int(f.read()))
+    return numbers
+
+
+def test_burst_writes_count_frames_in_order(tmp_path):
+    burst = BurstCapture(CountingGrabber(), workers=2)
+    summary = burst.burst(str(tmp_path), count=20)
+    assert summary["frames"] == 20 and summary["errors"] == 0
+    assert frame_numbers(summary) == list(range(1, 21))
+    assert os.path.basename(summary["files"][0]) == "burst_0000.jpg"
+    burst.close()
+
+
+def test_ring_only_exists_during_a_burst_or_while_armed(tmp_path):
+    burst = BurstCapture(CountingGrabber(), pre_trigger=3)
+    assert burst.stats()["ring_bytes"] == 0
+    burst.burst(str(tmp_path), count=5)
+    assert burst.stats()["ring_bytes"] == 0
+    burst.arm()
+    assert burst.stats()["ring_bytes"] == burst.ring_size * 1000
+    burst.disarm()
+    assert burst.stats()["ring_bytes"] == 0
+    burst.close()
+
+
+def test_armed_burst_starts_with_pre_trigger_frames(tmp_path):
+    grabber = CountingGrabber()
+    burst = BurstCapture(grabber, pre_trigger=4)
+    burst.arm()
+    while grabber.count < 20:
+        time.sleep(0.005)
+    summary = burst.burst(str(tmp_path), count=5)
+    numbers = frame_numbers(summary)
+    assert summary["pre_trigger"] == 4
+    assert numbers == sorted(numbers) and len(set(numbers)) == 9
+    assert summary["offsets_ms"][0] < 0
+    assert burst.armed  # still armed for the next one
+    burst.close()
+    assert burst.stats()["ring_bytes"] == 0
+
+
+def test_max_bytes_caps_the_ring_and_the_pre_trigger():
+    burst = BurstCapture(CountingGrabber(), pre_trigger=8, max_bytes=5500)
+    assert burst.ring_size == 5
+    assert burst.pre_trigger == 3
+    with pytest.raises(ValueError):
+        BurstCapture(CountingGrabber(), pre_trigger=4, ring_size=4)
+
+
+def test_open_ended_burst_stops_on_the_event(tmp_path):
+    burst = BurstCapture(CountingGrabber())
+    stop = threading.Event()
+    threading.Timer(0.05, stop.set).start()
+    summary = burst.burst(str(tmp_path), count=None, stop_event=stop, max_frames=10000)
+    assert 0 < summary["frames"] < 10000
+    burst.close()
@@ -0,0 +1,130 @@
+import threading
+import time
+
+from button_ui import (CAPTURING, CONFIRM_SHUTDOWN, DURATION, IDLE, MODES, SELECT, SELECT_WINDOW, SETTLE,
+                       ButtonUI, Scheduler, TunePlayer)
+from hal import SimulatedGpio
+
+SCALE = 0.01  # 1 s of UI time is 10 ms
+NOTES = {'A': 440, 'C': 261.63, 'R': 1}
+TUNES = {mode: [('A', 0.3)] for mode in MODES}
+
+
+class Actions:
+    def __init__(self):
+        self.calls = []
+        self.offered = []
+        self.stopped = threading.Event()
+
+    def select(self, mode):
+        self.offered.append(mode)
+
+    def photo(self, stop_event):
+        self.calls.append(('photo',))
+
+    def burst(self, stop_event):
+        self.calls.append(('burst',))
+
+    def video(self, minutes, stop_event):
+        self.calls.append(('video', minutes))
+        if stop_event.wait(5):
+            self.stopped.set()
+
+    def timelapse(self, minutes, stop_event):
+        self.calls.append(('timelapse', minutes))
+
+    def shutdown(self):
+        self.calls.append(('shutdown',))
+
+    def exit(self):
+        self.calls.append(('exit',))
+
+
+def wait_until(condition, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.002)
+    return True
+
+
+def make_ui():
+    gpio = SimulatedGpio()
+    actions = Actions()
+    ui = ButtonUI(gpio, actions, NOTES, TUNES, timing_scale=SCALE)
+    ui.start()
+    assert wait_until(lambda: ui.state == IDLE)
+    return gpio, actions, ui
+
+
+def select(gpio, ui, mode):
+    """Press once to start selecting, then wait until `mode` is offered."""
+    gpio.press()
+    assert wait_until(lambda: ui.state == SELECT and MODES[ui.mode_index] == mode)
+
+
+def test_scheduler_runs_callbacks_in_due_order_and_skips_cancelled():
+    scheduler = Scheduler()
+    ran = []
+    scheduler.call_later(0.03, ran.append, 3)
+    cancelled = scheduler.call_later(0.02, ran.append, 2)
+    scheduler.call_later(0.01, ran.append, 1)
+    scheduler.cancel(cancelled)
+    assert wait_until(lambda: len(ran) == 2)
+    time.sleep(0.02)
+    assert ran == [1, 3]
+    scheduler.stop()
+
+
+def test_a_new_tune_replaces_the_old_one():
+    gpio = SimulatedGpio()
+    player = TunePlayer(gpio, NOTES, timing_scale=SCALE)
+    player.play([('C', 10)], repeat=True)
+    assert wait_until(lambda: gpio.tones and gpio.tones[-1][1] == NOTES['C'])
+    player.play([('A', 10)])
+    assert wait_until(lambda: gpio.tones[-1][1] == NOTES['A'])
+    player.stop()
+    assert gpio.tones[-1][1] is None
+
+
+def test_press_in_select_takes_a_photo():
+    gpio, actions, ui = make_ui()
+    select(gpio, ui, 'photo')
+    gpio.press()
+    assert wait_until(lambda: ui.state == IDLE and actions.calls)
+    assert actions.calls == [('photo',)]
+    assert [state for state, _ in ui.history[-3:]] == [CAPTURING, SETTLE, IDLE]
+    assert actions.offered[:2] == [None, 'photo'] and actions.offered[-1] is None
+
+
+def test_modes_are_offered_in_turn_until_idle():
+    gpio, actions, ui = make_ui()
+    gpio.press()
+    assert wait_until(lambda: ui.state == IDLE and len(ui.history) > 2, timeout=len(MODES) * SELECT_WINDOW * SCALE + 2)
+    assert actions.offered == [None] + MODES + [None]
+    assert actions.calls == []
+
+
+def test_each_press_doubles_the_duration_and_a_press_stops_the_capture():
+    gpio, actions, ui = make_ui()
+    select(gpio, ui, 'video')
+    gpio.press()
+    assert wait_until(lambda: ui.state == DURATION)
+    gpio.press()
+    gpio.press()
+    assert wait_until(lambda: ui.state == CAPTURING)
+    assert actions.calls == [('video', 4)]
+    gpio.press()
+    assert actions.stopped.wait(2)
+    assert wait_until(lambda: ui.state == IDLE)
+
+
+def test_shutdown_needs_a_confirming_press():
+    gpio, actions, ui = make_ui()
+    select(gpio, ui, 'shutdown')
+    gpio.press()
+    assert wait_until(lambda: ui.state == CONFIRM_SHUTDOWN)
+    # Not confirmed: the UI exits
+    assert ui.wait(2)
+    assert actions.calls == [('exit',)]
@@ -0,0 +1,65 @@
+import io
+
+from camera_session import DUAL, STILL, VIDEO, CameraSession, HeldSource, MockPicamera2
+
+
+class NullSource:
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def make_session(**kwargs):
+    return CameraSession(MockPicamera2(configure_latency=0, capture_latency=0), **kwargs)
+
+
+def test_configurations_are_built_once_and_switched_only_when_needed():
+    session = make_session()
+    camera = session.picam2
+    assert session.mode == DUAL and camera.calls["configure"] == 1
+    assert session.set_mode(DUAL) == 0.0
+    session.set_mode(VIDEO)
+    session.set_mode(DUAL)
+    assert camera.calls["configure"] == 3
+    assert [(s["from"], s["to"]) for s in session.stats()["switches"]] == [(None, DUAL), (DUAL, VIDEO), (VIDEO, DUAL)]
+
+
+def test_stills_come_from_the_running_stream():
+    session = make_session()
+    stream = io.BytesIO()
+    session.capture_still(stream)
+    assert stream.getvalue() == b"\xff\xd82028x1520\xff\xd9"
+    assert session.picam2.calls["switch_mode_and_capture_file"] == 0
+    assert session.preview_stream == 'lores'
+
+
+def test_full_resolution_switches_for_one_frame():
+    session = make_session()
+    stream = io.BytesIO()
+    session.capture_still(stream, full_resolution=True)
+    assert stream.getvalue() == b"\xff\xd84056x3040\xff\xd9"
+    assert session.picam2.calls["switch_mode_and_capture_file"] == 1
+    assert session.mode == DUAL and session.picam2.config is session.configs[DUAL]
+    assert session.switch_times[-1][:2] == (DUAL, STILL)
+
+
+def test_idle_framerate_until_something_holds_the_session():
+    session = make_session(idle_framerate=10)
+    camera = session.picam2
+    assert camera.controls["FrameRate"] == 10
+    source = HeldSource(session, NullSource(), "stream")
+    source.start()
+    session.hold("burst")
+    assert camera.controls["FrameRate"] == 24
+    source.stop()
+    assert camera.controls["FrameRate"] == 24  # the burst still holds it
+    session.release("burst")
+    assert camera.controls["FrameRate"] == 10
+    assert session.stats()["holders"] == []
+
+
+def test_warm_up_waits_for_exposure_to_lock():
+    session = make_session()
+    assert session.warm_up() == 4  # MockPicamera2 locks after 4 frames
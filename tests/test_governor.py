@@ -0,0 +1,74 @@
+from governor import DEFAULT_POLICY, Governor
+
+
+def make_governor(readings, **kwargs):
+    now = [0.0]
+    temperature = [readings]
+    governor = Governor(lambda: temperature[0], clock=lambda: now[0], **kwargs)
+    return governor, temperature, now
+
+
+def test_levels_follow_the_temperature_up_at_once():
+    governor, temperature, now = make_governor(50.0)
+    assert governor.update().name == "normal"
+    temperature[0] = 66
+    assert governor.update().name == "warm"
+    temperature[0] = 81
+    assert governor.update().name == "critical"  # levels can be skipped going up
+
+
+def test_stepping_down_needs_hysteresis_and_hold():
+    governor, temperature, now = make_governor(66.0, hysteresis=3.0, hold=30.0)
+    governor.update()
+    assert governor.level.name == "warm"
+    temperature[0] = 63  # below 65 but not by the hysteresis
+    for _ in range(10):
+        now[0] += 10
+        assert governor.update().name == "warm"
+    temperature[0] = 61
+    governor.update()
+    now[0] += 29
+    assert governor.update().name == "warm"  # not held long enough
+    now[0] += 1
+    assert governor.update().name == "normal"
+
+
+def test_warming_up_again_restarts_the_hold():
+    governor, temperature, now = make_governor(76.0, hold=30.0)
+    governor.update()
+    temperature[0] = 70
+    governor.update()
+    now[0] += 20
+    temperature[0] = 74  # within the hysteresis of "hot" again
+    governor.update()
+    temperature[0] = 70
+    governor.update()
+    now[0] += 20
+    assert governor.update().name == "hot"
+    now[0] += 10
+    assert governor.update().name == "warm"
+
+
+def test_load_and_throttling_raise_one_level():
+    load = [50.0]
+    governor = Governor(lambda: 50.0, load_source=lambda: load[0], throttled_source=lambda: False)
+    assert governor.update().name == "normal"
+    load[0] = 95
+    assert governor.update().name == "warm"
+    throttled = Governor(lambda: 66.0, throttled_source=lambda: True)
+    assert throttled.update().name == "hot"
+
+
+def test_listeners_hear_every_change():
+    governor, temperature, now = make_governor(50.0)
+    seen = []
+    governor.add_listener(lambda level: seen.append(level.name))
+    temperature[0] = 76
+    governor.update()
+    governor.update()
+    assert seen == ["normal", "hot"]
+    assert governor.decisions[-1]["to"] == "hot"
+
+
+def test_normal_level_does_not_cap_the_preview():
+    assert DEFAULT_POLICY[0].preview_fps is None
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from jobs import CANCELLED, DONE, FAILED, QUEUED, RUNNING, JobQueue, QueueFull
+
+
+def test_jobs_run_one_at_a_time_in_order():
+    jobs = JobQueue()
+    order = []
+    running = []
+
+    def capture(job, name):
+        running.append(name)
+        assert len(running) == 1
+        order.append(name)
+        running.remove(name)
+        return name.upper()
+
+    submitted = [jobs.submit('photo', capture, name=name) for name in "abc"]
+    for job in submitted:
+        assert job.wait(5)
+    assert order == ["a", "b", "c"]
+    assert [job.to_dict()["result"] for job in submitted] == ["A", "B", "C"]
+    assert all(job.status == DONE and job.started <= job.finished for job in submitted)
+
+
+def test_failures_are_recorded():
+    jobs = JobQueue()
+
+    def broken(job):
+        raise RuntimeError("no camera")
+
+    job = jobs.submit('photo', broken)
+    job.wait(5)
+    assert job.status == FAILED and job.error == "no camera"
+
+
+def test_full_queue_refuses_and_cancel_drops_queued_jobs():
+    jobs = JobQueue(maxsize=1)
+    release = threading.Event()
+    first = jobs.submit('video', lambda job: release.wait(5))
+    while first.status != RUNNING:
+        first.wait(0.01)
+    second = jobs.submit('photo', lambda job: "taken")
+    with pytest.raises(QueueFull):
+        jobs.submit('photo', lambda job: "taken")
+    assert [job.id for job in jobs.active()] == [first.id, second.id]
+    assert jobs.cancel(second.id).status == CANCELLED
+    release.set()
+    assert second.wait(5) and second.result is None
+    assert jobs.cancel(12345) is None
+
+
+def test_cancel_asks_a_running_job_to_stop():
+    jobs = JobQueue()
+
+    def timelapse(job):
+        frames = 0
+        while not job.wait_cancelled(0.01):
+            frames += 1
+        return frames
+
+    job = jobs.submit('timelapse', timelapse)
+    while job.status == QUEUED:
+        job.wait(0.01)
+    jobs.cancel(job.id)
+    assert job.wait(5)
+    assert job.status == CANCELLED and job.result is not None
+    assert jobs.active('timelapse') == []
+
+
+def test_history_keeps_the_newest_finished_jobs():
+    jobs = JobQueue(maxsize=10, history=3)
+    submitted = []
+    for i in range(6):
+        submitted.append(jobs.submit('photo', lambda job: None))
+        submitted[-1].wait(5)
+    jobs.submit('photo', lambda job: None).wait(5)
+    assert jobs.get(submitted[0].id) is None
+    assert jobs.get(submitted[-1].id) is submitted[-1]
+    assert len(jobs.list()) <= 4
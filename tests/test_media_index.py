@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from media_index import MediaIndex
+
+KINDS = ['photos', 'videos', 'timelapses']
+
+
+@pytest.fixture
+def index(tmp_path):
+    for kind in KINDS:
+        (tmp_path / kind).mkdir()
+    for i in range(7):
+        path = tmp_path / 'photos' / f'p{i}.jpg'
+        path.write_bytes(b"x" * (i + 1))
+        os.utime(path, (1000 + i, 1000 + i))
+    (tmp_path / 'videos' / 'v.mp4').write_bytes(b"v" * 100)
+    index = MediaIndex(str(tmp_path), db_path=str(tmp_path / "media.db"), kinds=KINDS)
+    index.reconcile(force=True)
+    return index
+
+
+def test_reconcile_and_counts(index):
+    counts = index.counts()
+    assert counts['photos'] == {"count": 7, "size": 28}
+    assert counts['videos'] == {"count": 1, "size": 100}
+    assert counts['timelapses'] == {"count": 0, "size": 0}
+
+
+def test_pages_are_newest_first_and_do_not_overlap(index):
+    pages = [index.page('photos', offset, 3) for offset in (0, 3, 6)]
+    paths = [item['path'] for page in pages for item in page]
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert len(set(paths)) == 7
+    ctimes = [item['ctime'] for page in pages for item in page]
+    assert ctimes == sorted(ctimes, reverse=True)
+    assert list(index.iter_paths('photos', batch=2)) == paths
+
+
+def test_removed_files_leave_the_index(index, tmp_path):
+    os.remove(tmp_path / 'videos' / 'v.mp4')
+    index.reconcile(force=True)
+    assert index.count('videos') == 0
+
+
+def test_offloaded_marks(index):
+    assert len(index.not_offloaded(limit=100)) == 8
+    index.mark_offloaded(os.path.join(index.base_dir, 'videos', 'v.mp4'))  # absolute paths work too
+    assert [item['path'] for item in index.oldest(offloaded_only=True)] == ['videos/v.mp4']
+    assert 'videos/v.mp4' not in [item['path'] for item in index.not_offloaded(limit=100)]
+
+
+def test_changed_item_loses_its_offloaded_mark(index, tmp_path):
+    index.mark_offloaded('videos/v.mp4')
+    index.add('videos/v.mp4')  # unchanged
+    assert index.oldest(offloaded_only=True)
+    with open(tmp_path / 'videos' / 'v.mp4', 'ab') as f:
+        f.write(b"more")
+    index.add('videos/v.mp4')
+    assert index.oldest(offloaded_only=True) == []
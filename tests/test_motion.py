@@ -0,0 +1,59 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from motion import MotionDetector, MotionTrigger, parse_roi, synthetic_frames  # noqa: E402
+
+
+def test_still_noisy_scene_is_not_motion():
+    detector = MotionDetector()
+    assert not any(detector.detect(frame) for frame in synthetic_frames(50, noise=6))
+
+
+def test_moving_object_is_motion():
+    detector = MotionDetector()
+    results = [detector.detect(frame) for frame in synthetic_frames(60, moving=range(30, 50))]
+    assert not any(results[:30])
+    assert any(results[30:50])
+
+
+def test_pixel_threshold_and_area():
+    frames = list(synthetic_frames(2, moving=range(1, 2)))
+    low = MotionDetector(pixel_threshold=20)
+    low.score(frames[0])
+    score = low.score(frames[1])
+    # a 40x40 square in 320x240, minus subsampling effects
+    assert 0.015 < score < 0.03
+    strict = MotionDetector(min_area=0.05)
+    strict.score(frames[0])
+    assert not strict.detect(frames[1])
+    blind = MotionDetector(pixel_threshold=150)
+    blind.score(frames[0])
+    assert blind.score(frames[1]) == 0.0
+
+
+def test_roi_limits_what_is_watched():
+    frames = list(synthetic_frames(2, moving=range(1, 2)))  # the square is at the left edge
+    right_half = MotionDetector(roi=parse_roi("0.5,0,1,1"))
+    right_half.score(frames[0])
+    assert right_half.score(frames[1]) == 0.0
+    with pytest.raises(ValueError):
+        parse_roi("0.5,0,0.4,1")
+
+
+def test_gradual_light_change_is_followed():
+    detector = MotionDetector(adapt=0.2)
+    frame = np.full((240, 320), 90, dtype=np.uint8)
+    for level in range(90, 140, 2):
+        assert not detector.detect(np.full_like(frame, level))
+
+
+def test_trigger_cooldown():
+    fired = []
+    trigger = MotionTrigger(None, MotionDetector(), fired.append, cooldown=5)
+    frames = synthetic_frames(40, moving=range(10, 40))
+    for index, frame in enumerate(frames):
+        trigger.feed(frame, now=index * 0.25)  # 4 fps, 10 s
+    assert trigger.triggers == 2  # at about 2.5 s and 7.5 s
+    assert trigger.suppressed > 0
+    assert len(fired) == 2
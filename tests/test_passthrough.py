@@ -0,0 +1,60 @@
+import pytest
+
+from passthrough import (FileChunkSource, H264Splitter, MjpegSplitter, is_keyframe, libcamera_vid_command,
+                         make_splitter)
+
+JPEGS = [b"\xff\xd8" + bytes([i]) * (10 + i) + b"\xff\xd9" for i in range(5)]
+NALS = [b"\x00\x00\x00\x01\x67" + b"\x42" * 6,  # SPS, 4-byte start code
+        b"\x00\x00\x01\x68" + b"\xce" * 3,  # PPS, 3-byte start code
+        b"\x00\x00\x00\x01\x65" + b"\x88" * 40,  # IDR slice
+        b"\x00\x00\x00\x01\x41" + b"\x9a" * 20]  # P slice
+
+
+def feed_in_pieces(splitter, data, size):
+    out = []
+    for i in range(0, len(data), size):
+        out += splitter.feed(data[i:i + size])
+    return out
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_mjpeg_frames_survive_any_chunking(size):
+    stream = b"garbage" + b"".join(JPEGS)
+    assert feed_in_pieces(MjpegSplitter(), stream, size) == JPEGS
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_h264_units_keep_their_start_codes(size):
+    # The last unit is only complete once the next start code arrives
+    stream = b"".join(NALS) + b"\x00\x00\x00\x01"
+    assert feed_in_pieces(H264Splitter(), stream, size) == NALS
+
+
+def test_keyframes_are_sps_and_idr():
+    assert [is_keyframe(nal) for nal in NALS] == [True, False, True, False]
+    assert not is_keyframe(b"\x00\x00\x01")
+    assert not is_keyframe(b"no start code")
+
+
+def test_h264_command_repeats_headers_and_sets_the_keyframe_interval():
+    cmd = libcamera_vid_command("h264", 1920, 1080, 30, intra=30)
+    assert cmd[-2:] == ["-o", "-"]
+    assert "--inline" in cmd and cmd[cmd.index("--intra") + 1] == "30"
+    assert "--inline" not in libcamera_vid_command("mjpeg")
+    assert isinstance(make_splitter("h264"), H264Splitter)
+    assert isinstance(make_splitter("mjpeg"), MjpegSplitter)
+
+
+def test_file_source_loops_over_a_recording(tmp_path):
+    path = tmp_path / "stream.mjpeg"
+    path.write_bytes(b"".join(JPEGS))
+    source = FileChunkSource(str(path), read_size=16)
+    source.start()
+    assert [source.read() for _ in range(len(JPEGS) * 2)] == JPEGS * 2
+    source.stop()
+    once = FileChunkSource(str(path), loop=False)
+    once.start()
+    assert [once.read() for _ in range(len(JPEGS))] == JPEGS
+    with pytest.raises(EOFError):
+        once.read()
+    once.stop()
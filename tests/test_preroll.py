@@ -0,0 +1,53 @@
+from passthrough import H264_START
+from preroll import PrerollBuffer, starts_gop
+
+SPS = H264_START + b"\x67" + bytes(20)
+IDR = H264_START + b"\x65" + bytes(3000)
+P = H264_START + b"\x41" + bytes(800)
+
+
+def stream(seconds, fps=24, gop=24):
+    """(arrival time, chunk) of a stream with one GOP per second."""
+    for frame in range(seconds * fps):
+        yield frame / fps, (SPS + IDR if frame % gop == 0 else P)
+
+
+def test_starts_gop():
+    assert starts_gop(SPS + IDR)
+    assert not starts_gop(IDR)
+    assert not starts_gop(P)
+
+
+def test_drain_starts_at_an_sps():
+    ring = PrerollBuffer(max_bytes=1 << 20, seconds=3.5)
+    for now, chunk in stream(10):
+        ring.append(chunk, now=now)
+    views, seconds = ring.drain()
+    assert starts_gop(views[0])
+    # 3.5 s are held, the part before the oldest SPS is dropped
+    assert 2.9 < seconds <= 3.5
+    assert ring.stats()["chunks"] == 0
+
+
+def test_ring_size_bounds_memory_not_seconds():
+    ring = PrerollBuffer(max_bytes=50000, seconds=60)
+    for now, chunk in stream(10):
+        ring.append(chunk, now=now)
+        assert ring.stats()["bytes"] <= 50000
+    views, _ = ring.drain()
+    assert views and starts_gop(views[0])
+    # the chunks come out in arrival order, without overlaps
+    assert b"".join(bytes(v) for v in views).count(H264_START + b"\x67") >= 1
+
+
+def test_drain_without_a_keyframe_is_empty():
+    ring = PrerollBuffer(max_bytes=1 << 16, seconds=5)
+    for i in range(10):
+        ring.append(P, now=i / 24)
+    assert ring.drain() == ([], 0.0)
+
+
+def test_oversized_chunks_are_dropped():
+    ring = PrerollBuffer(max_bytes=1000, seconds=5)
+    ring.append(IDR, now=0)
+    assert ring.stats()["chunks_dropped"] == 1
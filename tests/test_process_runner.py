@@ -0,0 +1,68 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from process_runner import PIPE, ManagedProcess, ProcessError, ProcessRunner
+
+PYTHON = sys.executable
+
+
+def test_run_collects_output_and_usage():
+    runner = ProcessRunner(workers=1)
+    result = runner.run([PYTHON, "-c", "import sys; sys.stdout.write(sys.stdin.read().upper())"],
+                        input=b"abc", capture_stdout=True)
+    assert result.ok
+    assert result.stdout == b"ABC"
+    assert result.cpu_time is not None and result.max_rss_kb > 0
+    assert runner.stats()[-1]["returncode"] == 0
+
+
+def test_failure_keeps_the_last_log_lines():
+    result = ProcessRunner(workers=1).run([PYTHON, "-c", "import sys; print('broken', file=sys.stderr); sys.exit(3)"])
+    assert result.returncode == 3
+    with pytest.raises(ProcessError, match="broken"):
+        result.check()
+
+
+def test_timeout_terminates():
+    result = ProcessRunner(workers=1).run([PYTHON, "-c", "import time; time.sleep(30)"], timeout=0.3)
+    assert result.timed_out
+    assert result.returncode != 0
+
+
+def test_cancel_kills_a_child_ignoring_sigterm():
+    process = ManagedProcess([PYTHON, "-c", "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+                                           "print('ready', flush=True); time.sleep(30)"], stdout=PIPE, grace=0.2)
+    assert process.stdout.readline() == b"ready\n"
+    process.cancel()
+    result = process.wait(5)
+    assert result is not None and result.cancelled
+    assert result.returncode == -9
+
+
+def test_wait_returns_when_someone_else_reaps_the_child():
+    process = ManagedProcess([PYTHON, "-c", "import time; time.sleep(0.2)"])
+
+    def reap():
+        try:
+            os.waitpid(process.pid, 0)
+        except ChildProcessError:
+            pass  # the helper thread got there first
+
+    thief = threading.Thread(target=reap)
+    thief.start()
+    assert process.wait(5) is not None
+    thief.join()
+    process.cancel()  # must not signal a pid that is gone
+
+
+def test_bin_dir_stubs_replace_path_commands(tmp_path):
+    stub = tmp_path / "libcamera-still"
+    stub.write_text("#!/bin/sh\necho stub\n")
+    stub.chmod(0o755)
+    runner = ProcessRunner(bin_dir=str(tmp_path), workers=1)
+    assert runner.resolve(["libcamera-still", "-o", "x.jpg"])[0] == str(stub)
+    assert runner.resolve(["ffmpeg"]) == ["ffmpeg"]
+    assert runner.submit(["libcamera-still"], capture_stdout=True).result(5).stdout == b"stub\n"
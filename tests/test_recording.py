@@ -0,0 +1,50 @@
+import sys
+
+import pytest
+
+import recording
+from process_runner import ProcessRunner
+
+FFMPEG = """#!{python}
+import sys
+with open(sys.argv[-1], "wb") as f:
+    f.write(sys.stdin.buffer.read())
+"""
+
+LIBCAMERA_VID = """#!{python}
+import sys
+sys.stdout.buffer.write(b"\\0\\0\\0\\1\\x67" + bytes(100))
+"""
+
+
+def stub(folder, name, script):
+    path = folder / name
+    path.write_text(script.format(python=sys.executable))
+    path.chmod(0o755)
+
+
+@pytest.fixture
+def runner(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    stub(bin_dir, "ffmpeg", FFMPEG)
+    runner = ProcessRunner(bin_dir=str(bin_dir), workers=1)
+    monkeypatch.setattr(recording, "runner", runner)
+    return runner
+
+
+def test_camera_output_goes_straight_into_the_muxer(tmp_path, runner):
+    stub(tmp_path / "bin", "libcamera-vid", LIBCAMERA_VID)
+    path = str(tmp_path / "video.mp4")
+    result = recording.record_with_libcamera(path, duration=1)
+    assert result["bytes"] == 105
+    with open(path, "rb") as f:
+        assert f.read().startswith(b"\0\0\0\1\x67")
+
+
+def test_muxer_is_stopped_when_the_camera_does_not_start(tmp_path, runner, monkeypatch):
+    monkeypatch.setenv("PATH", str(tmp_path / "bin"))  # no libcamera-vid anywhere
+    with pytest.raises(FileNotFoundError):
+        recording.record_with_libcamera(str(tmp_path / "video.mp4"), duration=1)
+    assert runner.active() == []
+    assert runner.history[-1].name == "ffmpeg-mux"
@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+
+import pytest
+
+from media_index import MediaIndex
+from storage import MB, StorageFull, StorageManager, estimate_bytes, remove_media
+
+KINDS = ['photos', 'videos', 'timelapses']
+
+
+@pytest.fixture
+def index(tmp_path):
+    for kind in KINDS + ['thumbnails']:
+        (tmp_path / kind).mkdir()
+    return MediaIndex(str(tmp_path), db_path=str(tmp_path / "media.db"), kinds=KINDS)
+
+
+def add_file(index, path, size, when):
+    full_path = os.path.join(index.base_dir, path)
+    with open(full_path, 'wb') as f:
+        f.write(b"\0" * size)
+    os.utime(full_path, (when, when))
+    index.add(path)
+    return full_path
+
+
+def test_quota_refuses_what_does_not_fit(index):
+    add_file(index, 'photos/a.jpg', 800, 1000)
+    storage = StorageManager(index.base_dir, index, quotas={'photos': 1000}, min_free=0)
+    storage.check('photos', 100)
+    with pytest.raises(StorageFull):
+        storage.check('photos', 300)
+    storage.check('videos', 300)  # other kinds have no quota
+
+
+def test_min_free_refuses_when_the_card_is_full(index):
+    storage = StorageManager(index.base_dir, index, min_free=0)
+    storage.min_free = storage.free_bytes(refresh=True)
+    with pytest.raises(StorageFull):
+        storage.check('photos', 10 * MB)
+
+
+def test_oldest_retention_prunes_to_make_room(index):
+    old = add_file(index, 'photos/old.jpg', 600, 1000)
+    new = add_file(index, 'photos/new.jpg', 300, 2000)
+    storage = StorageManager(index.base_dir, index, quotas={'photos': 1000}, min_free=0, retention='oldest')
+    storage.check('photos', 400)
+    assert not os.path.exists(old)
+    assert os.path.exists(new)
+    assert [item['path'] for item in index.oldest('photos')] == ['photos/new.jpg']
+
+
+def test_offloaded_retention_only_prunes_offloaded_media(index):
+    add_file(index, 'photos/old.jpg', 600, 1000)
+    copied = add_file(index, 'photos/copied.jpg', 300, 2000)
+    index.mark_offloaded('photos/copied.jpg')
+    storage = StorageManager(index.base_dir, index, quotas={'photos': 1000}, min_free=0, retention='offloaded')
+    storage.check('photos', 300)
+    assert not os.path.exists(copied)
+    with pytest.raises(StorageFull):
+        storage.check('photos', 600)  # only an item without a copy is left
+
+
+def test_running_reservations_count_against_the_quota(index, tmp_path):
+    storage = StorageManager(index.base_dir, index, quotas={'videos': 1000}, min_free=0, watch_interval=0.05)
+    with storage.reserve('videos', 600, str(tmp_path / 'videos' / 'v.mp4'), threading.Event()):
+        with pytest.raises(StorageFull):
+            storage.check('videos', 600)
+    storage.check('videos', 600)
+    assert storage.stats()["reservations"] == []
+
+
+def test_reservation_stops_a_capture_over_its_quota(index, tmp_path):
+    storage = StorageManager(index.base_dir, index, quotas={'videos': 1000}, min_free=0, watch_interval=0.02)
+    path = tmp_path / 'videos' / 'v.mp4'
+    stop = threading.Event()
+    with storage.reserve('videos', 500, str(path), stop) as reservation:
+        path.write_bytes(b"\0" * 2000)
+        assert stop.wait(2)
+    assert reservation.stopped == "videos quota reached"
+
+
+def test_reservation_measures_a_series_of_files_by_prefix(index, tmp_path):
+    add_file(index, 'photos/old.jpg', 5000, 1000)  # not part of the burst
+    storage = StorageManager(index.base_dir, index, quotas={'photos': 7000}, min_free=0, watch_interval=0.02)
+    stop = threading.Event()
+    with storage.reserve('photos', 500, str(tmp_path / 'photos' / 'burst_1_'), stop) as reservation:
+        for i in range(4):
+            (tmp_path / 'photos' / f'burst_1_{i:04d}.jpg').write_bytes(b"\0" * 400)
+            time.sleep(0.05)
+        assert not stop.is_set()
+        assert reservation.written == 1600
+        for i in range(4, 8):
+            (tmp_path / 'photos' / f'burst_1_{i:04d}.jpg').write_bytes(b"\0" * 400)
+        assert stop.wait(2)
+    assert reservation.stopped == "photos quota reached"
+
+
+def test_estimates_grow_with_duration():
+    assert estimate_bytes('videos', duration=20) == 2 * estimate_bytes('videos', duration=10)
+    assert estimate_bytes('timelapses', duration=60, interval=1) > estimate_bytes('timelapses', duration=60, interval=10)
+    with pytest.raises(ValueError):
+        estimate_bytes('audio')
+
+
+def test_remove_media_takes_the_thumbnail_along(index):
+    base = index.base_dir
+    os.makedirs(os.path.join(base, 'timelapses', 't1'))
+    os.makedirs(os.path.join(base, 'thumbnails', 'timelapses'))
+    for path in ('timelapses/t1/frame_0001.jpg', 'thumbnails/timelapses/t1.jpg'):
+        open(os.path.join(base, path), 'wb').close()
+    index.reconcile(force=True)
+    assert index.count('timelapses') == 1
+    remove_media(base, index, 'timelapses/t1')
+    assert not os.path.exists(os.path.join(base, 'timelapses', 't1'))
+    assert not os.path.exists(os.path.join(base, 'thumbnails', 'timelapses', 't1.jpg'))
+    assert index.count('timelapses') == 0
+
+
+def test_reservation_keeps_measuring_files_that_grow(index, tmp_path):
+    folder = tmp_path / 'timelapses' / 't1'
+    folder.mkdir()
+    storage = StorageManager(index.base_dir, index, min_free=0)
+    reservation = storage.reserve('timelapses', 100, str(folder), threading.Event())
+    (folder / 'timelapse.mp4').write_bytes(b"\0" * 100)
+    (folder / 'frame_0000.jpg').write_bytes(b"\0" * 10)
+    old = time.time() - 60
+    os.utime(folder / 'frame_0000.jpg', (old, old))
+    (folder / 'frame_0001.jpg').write_bytes(b"\0" * 10)
+    assert reservation._measure() == 120
+    (folder / 'timelapse.mp4').write_bytes(b"\0" * 300)  # the video grows
+    with open(folder / 'frame_0001.jpg', 'ab') as f:
+        f.write(b"\0" * 10)  # and so does the frame being written
+    assert reservation._measure() == 330
+    storage._release(reservation)
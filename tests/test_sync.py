@@ -0,0 +1,187 @@
+import hashlib
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from media_index import MediaIndex
+from sync import ChunkedTarget, HttpTarget, LocalTarget, RateLimit, StandInHandler, SyncManager, file_sha256
+
+KINDS = ['photos', 'videos', 'timelapses']
+
+
+class Recorder:
+    """What upload() needs from a SyncManager."""
+
+    def __init__(self):
+        self.sent = 0
+
+    def throttle(self, n):
+        pass
+
+    def progress(self, path, offset, size, sent):
+        self.sent += sent
+
+
+@pytest.fixture
+def stand_in(tmp_path, monkeypatch):
+    root = tmp_path / "remote"
+    root.mkdir()
+    monkeypatch.setattr(StandInHandler, 'root', str(root))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield root, f"http://127.0.0.1:{server.server_address[1]}/media"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def media(tmp_path):
+    base = tmp_path / "media"
+    for kind in KINDS:
+        (base / kind).mkdir(parents=True)
+    video = base / 'videos' / 'v.mp4'
+    video.write_bytes(os.urandom(5 * 4096 + 123))
+    return base, video
+
+
+class DroppingTarget(HttpTarget):
+    """Loses the connection after `fail_after` chunks."""
+
+    def __init__(self, url, fail_after):
+        super().__init__(url)
+        self.chunk_size = 4096
+        self.fail_after = fail_after
+        self.writes = []
+
+    def write(self, path, offset, data, total):
+        if len(self.writes) == self.fail_after:
+            raise ConnectionResetError("dropped")
+        self.writes.append(offset)
+        super().write(path, offset, data, total)
+
+
+def test_http_upload_resumes_after_a_dropped_write(stand_in, media):
+    root, url = stand_in
+    base, video = media
+    target = DroppingTarget(url, fail_after=2)
+    with pytest.raises(ConnectionResetError):
+        target.upload('videos/v.mp4', str(video), Recorder())
+    assert os.path.getsize(root / 'media' / 'videos' / 'v.mp4.part') == 2 * 4096
+
+    target.fail_after = None
+    recorder = Recorder()
+    assert target.upload('videos/v.mp4', str(video), recorder)
+    assert target.writes[2] == 2 * 4096  # continued, not started over
+    assert recorder.sent == video.stat().st_size - 2 * 4096
+    assert file_sha256(root / 'media' / 'videos' / 'v.mp4') == file_sha256(video)
+
+
+def test_http_upload_starts_over_on_a_foreign_prefix(stand_in, media):
+    root, url = stand_in
+    base, video = media
+    part = root / 'media' / 'videos' / 'v.mp4.part'
+    part.parent.mkdir(parents=True)
+    part.write_bytes(b"not the same bytes")
+    target = DroppingTarget(url, fail_after=None)
+    assert target.upload('videos/v.mp4', str(video), Recorder())
+    assert target.writes[0] == 0
+    assert file_sha256(root / 'media' / 'videos' / 'v.mp4') == file_sha256(video)
+
+
+def test_stand_in_refuses_a_corrupt_chunk(stand_in):
+    _, url = stand_in
+    target = HttpTarget(url)
+    response = target._request('PUT', 'x.bin', b"abcd", {
+        "Content-Range": "bytes 0-3/4",
+        "X-Chunk-Sha256": hashlib.sha256(b"abce").hexdigest(),
+    })
+    assert response.status == 400
+
+
+def test_local_target_resumes_a_part_file(tmp_path, media):
+    base, video = media
+    remote = tmp_path / "remote"
+    target = LocalTarget(str(remote))
+    target.chunk_size = 4096
+    part = remote / 'videos' / 'v.mp4.part'
+    part.parent.mkdir(parents=True)
+    part.write_bytes(video.read_bytes()[:3 * 4096])
+    recorder = Recorder()
+    assert target.upload('videos/v.mp4', str(video), recorder)
+    assert recorder.sent == video.stat().st_size - 3 * 4096
+    assert not part.exists()
+    assert file_sha256(remote / 'videos' / 'v.mp4') == file_sha256(video)
+
+
+class FlakyTarget(LocalTarget):
+    def __init__(self, root, failing):
+        super().__init__(root)
+        self.failing = failing
+
+    def reachable(self):
+        return True
+
+    def upload(self, path, full_path, sync):
+        if path in self.failing:
+            raise OSError("refused")
+        return super().upload(path, full_path, sync)
+
+
+def manager(base, target, **kwargs):
+    index = MediaIndex(str(base), db_path=str(base / "media.db"), kinds=KINDS)
+    index.reconcile(force=True)
+    return SyncManager(target, str(base), index, settle=0, **kwargs), index
+
+
+def test_run_once_skips_a_failing_item(tmp_path, media):
+    base, _ = media
+    (base / 'photos' / 'a.jpg').write_bytes(b"a" * 100)
+    sync, index = manager(base, FlakyTarget(str(tmp_path / "remote"), {'videos/v.mp4'}))
+    assert sync.run_once() == 1
+    assert sync.errors == 1
+    assert [item['path'] for item in index.not_offloaded(limit=10)] == ['videos/v.mp4']
+    assert (tmp_path / "remote" / 'photos' / 'a.jpg').exists()
+
+
+def test_run_once_ends_after_failures_in_a_row(tmp_path, media):
+    base, _ = media
+    failing = {'videos/v.mp4'}
+    for i in range(5):
+        (base / 'photos' / f'{i}.jpg').write_bytes(b"p")
+        failing.add(f'photos/{i}.jpg')
+    sync, _ = manager(base, FlakyTarget(str(tmp_path / "remote"), failing), max_failures=3)
+    assert sync.run_once() == 0
+    assert sync.errors == 3  # the other three wait for the next round
+    assert sync.state == 'idle'
+
+
+def test_throttle_waits_out_captures(tmp_path, media):
+    base, _ = media
+    busy = iter([True, True, False])
+    sync, _ = manager(base, FlakyTarget(str(tmp_path / "remote"), set()), busy=lambda: next(busy, False))
+    sync._stop.wait = lambda timeout: False  # no real sleeping
+    sync.throttle(10)
+    assert sync.state == 'sending'
+
+
+def test_rate_limit_waits_for_the_excess():
+    waits = []
+    limit = RateLimit(1000, wait=waits.append)
+    limit.take(1000)
+    assert not waits
+    limit.take(500)
+    assert waits and waits[0] == pytest.approx(0.5, abs=0.05)
+
+
+def test_a_half_implemented_target_fails_when_created():
+    class NoWrite(ChunkedTarget):
+        def reachable(self):
+            return True
+
+        def remote_state(self, path):
+            return 0, None
+
+    with pytest.raises(TypeError):
+        NoWrite()
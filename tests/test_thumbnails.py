@@ -0,0 +1,100 @@
+import os
+import struct
+import threading
+
+import thumbnails
+from thumbnails import ThumbnailCache, exif_thumbnail
+
+JPEG = b"\xff\xd8thumbnail\xff\xd9"
+
+
+def exif_with_thumbnail(thumb, endian="<"):
+    """A TIFF block with an empty IFD0 and an IFD1 pointing at `thumb`."""
+    order = b"II" if endian == "<" else b"MM"
+    ifd0 = 8
+    ifd1 = ifd0 + 2 + 4
+    start = ifd1 + 2 + 2 * 12 + 4
+    data = order + struct.pack(endian + "HI", 42, ifd0)
+    data += struct.pack(endian + "HI", 0, ifd1)
+    data += struct.pack(endian + "H", 2)
+    data += struct.pack(endian + "HHII", 0x0201, 4, 1, start)
+    data += struct.pack(endian + "HHII", 0x0202, 4, 1, len(thumb))
+    data += struct.pack(endian + "I", 0)
+    return b"Exif\0\0" + data + thumb
+
+
+def test_exif_thumbnail_both_byte_orders():
+    assert exif_thumbnail(exif_with_thumbnail(JPEG)) == JPEG
+    assert exif_thumbnail(exif_with_thumbnail(JPEG, ">")) == JPEG
+
+
+def test_exif_thumbnail_rejects_garbage():
+    assert exif_thumbnail(b"") is None
+    assert exif_thumbnail(b"Exif\0\0XX" + bytes(20)) is None
+    assert exif_thumbnail(exif_with_thumbnail(b"not a jpeg")) is None
+    assert exif_thumbnail(exif_with_thumbnail(JPEG)[:40]) is None
+
+
+def make_photo(base, name="a.jpg"):
+    os.makedirs(os.path.join(base, "photos"), exist_ok=True)
+    with open(os.path.join(base, "photos", name), "wb") as f:
+        f.write(b"photo")
+    return os.path.join("photos", name)
+
+
+def test_cache_generates_once_then_serves_from_memory_and_disk(tmp_path, monkeypatch):
+    made = []
+    monkeypatch.setattr(thumbnails, "make_image_thumbnail", lambda path, size: made.append(path) or JPEG)
+    path = make_photo(str(tmp_path))
+    cache = ThumbnailCache(str(tmp_path))
+    assert cache.get(path) == JPEG
+    assert cache.get(path) == JPEG
+    assert cache.stats() == {"memory_items": 1, "hits": 1, "misses": 1}
+    assert (tmp_path / "thumbnails" / "photos" / "a.jpg").read_bytes() == JPEG
+    # A second cache (another process) finds it on disk
+    assert ThumbnailCache(str(tmp_path)).get(path) == JPEG
+    assert len(made) == 1
+
+
+def test_a_replaced_source_gets_a_new_thumbnail(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, "make_image_thumbnail", lambda path, size: JPEG)
+    path = make_photo(str(tmp_path))
+    ThumbnailCache(str(tmp_path)).get(path)
+    os.utime(tmp_path / path, (2e9, 2e9))
+    monkeypatch.setattr(thumbnails, "make_image_thumbnail", lambda path, size: b"\xff\xd8new\xff\xd9")
+    assert ThumbnailCache(str(tmp_path)).get(path) == b"\xff\xd8new\xff\xd9"
+
+
+def test_concurrent_generation_of_the_same_thumbnail(tmp_path, monkeypatch):
+    barrier = threading.Barrier(8)
+
+    def slow(path, size):
+        barrier.wait(timeout=5)
+        return JPEG
+
+    monkeypatch.setattr(thumbnails, "make_image_thumbnail", slow)
+    path = make_photo(str(tmp_path))
+    errors = []
+
+    def request():
+        try:
+            assert ThumbnailCache(str(tmp_path)).get(path) == JPEG
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert os.listdir(tmp_path / "thumbnails" / "photos") == ["a.jpg"]
+
+
+def test_timelapse_thumbnail_comes_from_its_first_frame(tmp_path, monkeypatch):
+    monkeypatch.setattr(thumbnails, "make_image_thumbnail", lambda path, size: os.path.basename(path).encode())
+    folder = tmp_path / "timelapses" / "t1"
+    folder.mkdir(parents=True)
+    for name in ("frame_0002.jpg", "frame_0001.jpg", "timelapse.mp4"):
+        (folder / name).write_bytes(b"x")
+    assert ThumbnailCache(str(tmp_path)).get(os.path.join("timelapses", "t1")) == b"frame_0001.jpg"
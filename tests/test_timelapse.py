@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+from timelapse import MANIFEST_NAME, TimelapseEngine
+
+
+def manifest(folder):
+    with open(os.path.join(folder, MANIFEST_NAME)) as f:
+        return [json.loads(line) for line in f]
+
+
+class Sink:
+    def __init__(self):
+        self.frames = []
+        self.closed = False
+
+    def start(self):
+        pass
+
+    def write(self, entry, data):
+        self.frames.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+def slow_capture():
+    time.sleep(0.005)
+    return b"jpeg"
+
+
+def test_frames_follow_the_schedule_without_drift(tmp_path):
+    engine = TimelapseEngine(slow_capture, str(tmp_path), 0.02, max_frames=20)
+    summary = engine.run()
+    assert summary["frames"] == 20 and summary["missed_slots"] == 0
+    entries = manifest(tmp_path)
+    assert [e["slot"] for e in entries] == list(range(20))
+    # Every capture starts at its slot, not one period after the last one
+    # finished, which would add up to 19 * 5 ms by the last frame
+    late = [engine.capture_times[i] - (engine.capture_times[0] + i * 0.02) for i in range(20)]
+    assert max(late) < 0.04
+    assert sorted(os.listdir(tmp_path)) == sorted([e["file"] for e in entries] + [MANIFEST_NAME, "summary.json"])
+
+
+def test_overrunning_captures_skip_slots_instead_of_shifting(tmp_path):
+    calls = []
+
+    def capture():
+        calls.append(None)
+        if len(calls) == 3:
+            time.sleep(0.075)  # overruns the next slots
+        return b"jpeg"
+
+    summary = TimelapseEngine(capture, str(tmp_path), 0.02, max_frames=6).run()
+    assert summary["missed_slots"] >= 2
+    entries = manifest(tmp_path)
+    missed = [e["slot"] for e in entries if e.get("missed")]
+    taken = [e["slot"] for e in entries if "frame" in e]
+    assert missed and taken[:3] == [0, 1, 2] and taken[3] == max(missed) + 1
+
+
+def test_interval_floor_throttles_every_other_slot(tmp_path):
+    engine = TimelapseEngine(lambda: b"jpeg", str(tmp_path), 0.05, max_frames=4)
+    engine.interval_floor = 0.1
+    assert engine.stride() == 2
+    summary = engine.run()
+    assert summary["throttled_slots"] == 4
+    assert [e["slot"] for e in manifest(tmp_path) if "frame" in e] == [0, 2, 4, 6]
+
+
+def test_frames_only_to_the_sinks(tmp_path):
+    sink = Sink()
+    TimelapseEngine(lambda: b"jpeg", str(tmp_path), 0.01, max_frames=4, sinks=[sink], keep_frames=False).run()
+    assert sink.frames == [b"jpeg"] * 4 and sink.closed
+    assert sorted(os.listdir(tmp_path)) == [MANIFEST_NAME, "summary.json"]
+
+
+def test_stop_and_duration_end_the_run(tmp_path):
+    summary = TimelapseEngine(lambda: b"jpeg", str(tmp_path / "a"), 0.01, duration=0.1).run()
+    assert 9 <= summary["frames"] <= 10
+    engine = TimelapseEngine(lambda: b"jpeg", str(tmp_path / "b"), 0.01)
+    engine.stop()
+    assert engine.run()["frames"] == 0
@@ -0,0 +1,49 @@
+import io
+import os
+import zipfile
+
+from zipstream import walk_files, zip_chunks
+
+
+def make_tree(root):
+    (root / "t1").mkdir()
+    (root / "t1" / "frame_0001.jpg").write_bytes(os.urandom(200000))
+    (root / "t1" / "manifest.txt").write_text("frame_0001.jpg\n" * 1000)
+    (root / "a.mp4").write_bytes(os.urandom(1000))
+
+
+def test_streamed_archive_unpacks_to_the_tree(tmp_path):
+    make_tree(tmp_path)
+    chunks = list(zip_chunks(walk_files(str(tmp_path)), chunk_size=4096))
+    assert len(chunks) > 10  # sent as it is built, not in one piece
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zipf:
+        assert zipf.testzip() is None
+        assert zipf.namelist() == ["a.mp4", "t1/frame_0001.jpg", "t1/manifest.txt"]
+        assert zipf.read("t1/frame_0001.jpg") == (tmp_path / "t1" / "frame_0001.jpg").read_bytes()
+        # Media is stored as is, text is deflated
+        assert zipf.getinfo("t1/frame_0001.jpg").compress_type == zipfile.ZIP_STORED
+        assert zipf.getinfo("t1/manifest.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_files_deleted_meanwhile_are_left_out(tmp_path):
+    make_tree(tmp_path)
+    files = list(walk_files(str(tmp_path)))
+    os.remove(tmp_path / "a.mp4")
+    with zipfile.ZipFile(io.BytesIO(b"".join(zip_chunks(files)))) as zipf:
+        assert "a.mp4" not in zipf.namelist()
+        assert len(zipf.namelist()) == 2
+
+
+def test_chunks_are_produced_lazily(tmp_path):
+    make_tree(tmp_path)
+    opened = []
+
+    def files():
+        for path, arcname in walk_files(str(tmp_path)):
+            opened.append(arcname)
+            yield path, arcname
+
+    chunks = zip_chunks(files(), chunk_size=4096)
+    next(chunks)
+    assert opened == ["a.mp4"]
+    chunks.close()
@@ -0,0 +1,194 @@
+import collections
+import io
+import os
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from media_index import thumbnail_path
+from process_runner import runner
+
+THUMBNAIL_SIZE = (128, 128)
+
+
+def exif_thumbnail(data):
+    """Return the JPEG thumbnail embedded in a raw EXIF block (APP1 payload), or None."""
+    if data.startswith(b"Exif\0\0"):
+        data = data[6:]
+    if len(data) < 8:
+        return None
+    endian = {b"II": "<", b"MM": ">"}.get(data[:2])
+    if endian is None:
+        return None
+
+    def ifd_entries(offset):
+        count, = struct.unpack_from(endian + "H", data, offset)
+        entries = {}
+        for i in range(count):
+            tag, _, _, value = struct.unpack_from(endian + "HHII", data, offset + 2 + 12 * i)
+            entries[tag] = value
+        next_ifd, = struct.unpack_from(endian + "I", data, offset + 2 + 12 * count)
+        return entries, next_ifd
+
+    try:
+        ifd0 = struct.unpack_from(endian + "I", data, 4)[0]
+        _, ifd1 = ifd_entries(ifd0)
+        if not ifd1:
+            return None
+        entries, _ = ifd_entries(ifd1)
+        start, length = entries.get(0x0201), entries.get(0x0202)
+    except struct.error:
+        return None
+    if not start or not length or start + length > len(data):
+        return None
+    thumb = data[start:start + length]
+    return thumb if thumb.startswith(b"\xff\xd8") else None
+
+
+def make_image_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Thumbnail a JPEG without decoding it at full resolution."""
+    from PIL import Image
+    with Image.open(path) as img:
+        embedded = exif_thumbnail(img.info.get("exif", b""))
+        if embedded:
+            with Image.open(io.BytesIO(embedded)) as thumb:
+                return encode_thumbnail(thumb, size)
+        # draft() makes the JPEG decoder scale by 1/2, 1/4 or 1/8 while decoding
+        img.draft("RGB", (size[0] * 2, size[1] * 2))
+        return encode_thumbnail(img, size)
+
+
+def make_video_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Grab one frame of a video with ffmpeg, scaled down by ffmpeg itself."""
+    result = runner.run(
+        ["ffmpeg", "-loglevel", "error", "-ss", "1", "-i", path, "-vframes", "1",
+         "-vf", f"scale={size[0]}:-2", "-f", "image2", "-c:v", "mjpeg", "pipe:1"],
+        capture_stdout=True, timeout=30, name="ffmpeg-thumbnail")
+    if not result.ok or not result.stdout:
+        raise RuntimeError(f"ffmpeg could not extract a frame from {path}")
+    return result.stdout
+
+
+def encode_thumbnail(img, size=THUMBNAIL_SIZE):
+    img = img.convert("RGB")
+    img.thumbnail(size)
+    stream = io.BytesIO()
+    img.save(stream, format="jpeg", quality=80)
+    return stream.getvalue()
+
+
+class ThumbnailCache:
+    """Serves thumbnails from memory, then disk, and generates missing ones.
+
+    The in-memory LRU holds encoded JPEGs keyed by source path and mtime, and
+    the on-disk copy under thumbnails/ is only trusted if it is newer than
+    its source, so replaced media get a fresh thumbnail.
+    """
+
+    def __init__(self, base_dir, size=THUMBNAIL_SIZE, memory_items=256, workers=1):
+        self.base_dir = base_dir
+        self.size = size
+        self.memory_items = memory_items
+        self.hits = 0
+        self.misses = 0
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnails",
+                                        initializer=_lower_priority)
+
+    def _source_image(self, path):
+        """The file a thumbnail is made from: the photo, the video, or a timelapse's first frame."""
+        full_path = os.path.join(self.base_dir, path)
+        if os.path.isdir(full_path):
+            names = sorted(e.name for e in os.scandir(full_path))
+            frames = [name for name in names if name.endswith(".jpg")]
+            if frames:
+                return os.path.join(full_path, frames[0])
+            # Timelapses assembled without keeping the frames only have the video
+            videos = [name for name in names if name.endswith(".mp4")]
+            if not videos:
+                raise FileNotFoundError(f"no frames in {path}")
+            return os.path.join(full_path, videos[0])
+        return full_path
+
+    def get(self, path):
+        """Encoded thumbnail for a media path relative to the base directory."""
+        path = os.path.normpath(path)
+        source_mtime = os.stat(os.path.join(self.base_dir, path)).st_mtime
+        key = (path, source_mtime)
+        with self._lock:
+            data = self._lru.get(key)
+            if data is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+        data = self._load_or_generate(path, source_mtime)
+        with self._lock:
+            self._lru[key] = data
+            while len(self._lru) > self.memory_items:
+                self._lru.popitem(last=False)
+        return data
+
+    def _load_or_generate(self, path, source_mtime):
+        kind = path.split(os.sep)[0]
+        disk_path = os.path.join(self.base_dir, thumbnail_path(kind, os.path.basename(path)))
+        try:
+            if os.stat(disk_path).st_mtime >= source_mtime:
+                with open(disk_path, "rb") as f:
+                    return f.read()
+        except FileNotFoundError:
+            pass
+        source = self._source_image(path)
+        if source.endswith((".mp4", ".h264")):
+            data = make_video_thumbnail(source, self.size)
+        else:
+            data = make_image_thumbnail(source, self.size)
+        os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+        # A name of its own: the background pool and a page request may make
+        # the same thumbnail at once, and the last rename wins
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(disk_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, disk_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return data
+
+    def _ensure(self, path):
+        try:
+            self.get(path)
+        except Exception as e:
+            print(f"Thumbnail for {path} failed: {e}")
+
+    def submit(self, path):
+        """Generate a thumbnail in the background, e.g. right after a capture."""
+        return self._pool.submit(self._ensure, path)
+
+    def backfill(self, paths):
+        """Create missing thumbnails for existing media on the background pool.
+
+        `paths` may be a lazy iterable; it is consumed on its own thread so
+        the caller does not wait for a large catalog to be walked.
+        """
+        def run():
+            for path in paths:
+                kind = path.split(os.sep)[0]
+                if not os.path.exists(os.path.join(self.base_dir, thumbnail_path(kind, os.path.basename(path)))):
+                    self.submit(path).result()
+
+        threading.Thread(target=run, name="thumbnail-backfill", daemon=True).start()
+
+    def stats(self):
+        return {"memory_items": len(self._lru), "hits": self.hits, "misses": self.misses}
+
+
+def _lower_priority():
+    # Thumbnailing must never compete with an active capture
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+    except (AttributeError, OSError):
+        pass
@@ -0,0 +1,240 @@
+import io
+import json
+import math
+import os
+import queue
+import threading
+import time
+
+from process_runner import PIPE, runner
+
+FRAME_NAME = "image_{:04d}.jpg"
+MANIFEST_NAME = "manifest.jsonl"
+VIDEO_NAME = "timelapse.mp4"
+
+
+class VideoAssembler:
+    """Pipes timelapse frames into ffmpeg as they are captured.
+
+    The output is a fragmented MP4, so it is playable while it grows and
+    complete as soon as ffmpeg has flushed the last frame, without reading
+    the JPEGs back from the card.
+    """
+
+    def __init__(self, path, fps=24, codec="libx264", extra_args=()):
+        self.path = path
+        self.cmd = ["ffmpeg", "-loglevel", "error", "-y",
+                    "-f", "image2pipe", "-framerate", str(fps), "-c:v", "mjpeg", "-i", "-",
+                    "-c:v", codec, "-pix_fmt", "yuv420p"]
+        if codec == "libx264":
+            self.cmd += ["-preset", "ultrafast"]
+        self.cmd += list(extra_args) + ["-movflags", "frag_keyframe+empty_moov", path]
+        self._process = None
+
+    def start(self):
+        self._process = runner.start(self.cmd, stdin=PIPE, name="ffmpeg-timelapse")
+
+    def write(self, entry, data):
+        self._process.stdin.write(data)
+
+    def close(self):
+        """Finish the video and return ffmpeg's exit status."""
+        if self._process is None:
+            return None
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        result = self._process.wait()
+        if not result.ok:
+            print(f"ffmpeg failed assembling {self.path}: {' '.join(result.log[-5:])}")
+        return result.returncode
+
+
+class TimelapseEngine:
+    """Captures frames on a fixed monotonic schedule and writes them on a separate thread.
+
+    Slot n is due at start + n * interval, independent of how long earlier
+    captures or writes took, so the period does not drift. If a capture
+    overruns one or more slots, those slots are skipped and flagged as
+    missed in the manifest instead of shifting every later frame.
+
+    `capture` returns one encoded JPEG as bytes. Every frame (and missed
+    slot) is appended to manifest.jsonl in the timelapse folder with its
+    scheduled and actual timestamps. Frames are also handed to each of
+    `sinks` (e.g. a VideoAssembler); with keep_frames=False the JPEGs only
+    go to the sinks and never hit the card.
+
+    `interval_floor` (seconds) may be raised while running, e.g. by the
+    thermal governor: frames are then taken only every n-th slot so that
+    they are at least that far apart, and the slots in between are flagged
+    as throttled. The schedule itself stays the same.
+    """
+
+    def __init__(self, capture, folder, interval, duration=None, max_frames=None,
+                 stop_event=None, queue_size=8, sinks=(), keep_frames=True):
+        self.capture = capture
+        self.folder = folder
+        self.interval = interval
+        self.duration = duration  # seconds, None = until stopped
+        self.max_frames = max_frames
+        self.stop_event = stop_event or threading.Event()
+        self.sinks = list(sinks)
+        self.keep_frames = keep_frames
+        self.frames = 0
+        self.missed = 0
+        self.throttled = 0
+        self.interval_floor = 0
+        self.capture_times = []  # monotonic time of each capture
+        self.lateness = []  # seconds between due time and capture start
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._manifest = None
+        self._write_error = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stride(self):
+        """Slots from one frame to the next under the current interval floor."""
+        if self.interval <= 0 or self.interval_floor <= self.interval:
+            return 1
+        return math.ceil(self.interval_floor / self.interval - 1e-9)
+
+    def run(self):
+        """Run until duration, max_frames or stop(); returns the summary dict."""
+        os.makedirs(self.folder, exist_ok=True)
+        self._manifest = open(os.path.join(self.folder, MANIFEST_NAME), "a")
+        for sink in self.sinks:
+            sink.start()
+        writer = threading.Thread(target=self._writer, name="timelapse-writer", daemon=True)
+        writer.start()
+        start = time.monotonic()
+        wall_start = time.time()
+        slot = 0
+        try:
+            while not self.stop_event.is_set():
+                if self.max_frames is not None and self.frames >= self.max_frames:
+                    break
+                due = start + slot * self.interval
+                if self.duration is not None and due - start >= self.duration:
+                    break
+                delay = due - time.monotonic()
+                if delay > 0 and self.stop_event.wait(delay):
+                    break
+                now = time.monotonic()
+                late_slots = int((now - due) // self.interval) if self.interval > 0 else 0
+                if late_slots > 0:
+                    # The previous capture overran; drop the slots we can no longer hit
+                    for missed in range(slot, slot + late_slots):
+                        self._queue.put(({"slot": missed, "missed": True,
+                                          "scheduled": wall_start + missed * self.interval}, None))
+                    self.missed += late_slots
+                    slot += late_slots
+                    continue
+                data = self.capture()
+                captured = time.monotonic()
+                self.capture_times.append(now)
+                self.lateness.append(now - due)
+                entry = {
+                    "slot": slot,
+                    "frame": self.frames,
+                    "file": FRAME_NAME.format(self.frames) if self.keep_frames else None,
+                    "scheduled": wall_start + slot * self.interval,
+                    "timestamp": wall_start + (now - start),
+                    "lateness_ms": round((now - due) * 1000, 2),
+                    "capture_ms": round((captured - now) * 1000, 2),
+                }
+                self._queue.put((entry, data))
+                if self._write_error is not None:
+                    raise self._write_error
+                self.frames += 1
+                step = self.stride()
+                for skipped in range(slot + 1, slot + step):
+                    self._queue.put(({"slot": skipped, "throttled": True,
+                                      "scheduled": wall_start + skipped * self.interval}, None))
+                self.throttled += step - 1
+                slot += step
+        finally:
+            self._queue.put(None)
+            writer.join()
+            self._manifest.close()
+            for sink in self.sinks:
+                sink.close()
+        summary = self.summary()
+        with open(os.path.join(self.folder, "summary.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        return summary
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            entry, data = item
+            if self._write_error is not None:
+                continue
+            if data is None:
+                self._log(entry)
+                continue
+            try:
+                t0 = time.monotonic()
+                if entry["file"]:
+                    with open(os.path.join(self.folder, entry["file"]), "wb") as f:
+                        f.write(data)
+                for sink in self.sinks:
+                    sink.write(entry, data)
+                entry["write_ms"] = round((time.monotonic() - t0) * 1000, 2)
+                self._log(entry)
+            except OSError as e:
+                self._write_error = e
+
+    def _log(self, entry):
+        self._manifest.write(json.dumps(entry) + "\n")
+        self._manifest.flush()
+
+    @property
+    def queue_depth(self):
+        """Frames captured but not written yet."""
+        return self._queue.qsize()
+
+    def summary(self):
+        """Achieved frame rate and timing jitter of the run so far."""
+        periods = [b - a for a, b in zip(self.capture_times, self.capture_times[1:])]
+        elapsed = self.capture_times[-1] - self.capture_times[0] if len(self.capture_times) > 1 else 0
+        if periods:
+            mean = sum(periods) / len(periods)
+            jitter = math.sqrt(sum((p - mean) ** 2 for p in periods) / len(periods))
+        else:
+            mean = jitter = 0.0
+        return {
+            "frames": self.frames,
+            "missed_slots": self.missed,
+            "throttled_slots": self.throttled,
+            "interval": self.interval,
+            "achieved_fps": round((len(periods) / elapsed) if elapsed else 0.0, 4),
+            "mean_period_s": round(mean, 4),
+            "jitter_ms": round(jitter * 1000, 2),
+            "max_lateness_ms": round(max(self.lateness, default=0) * 1000, 2),
+        }
+
+
+def session_capture(session):
+    """Capture function for TimelapseEngine that takes JPEGs from a CameraSession."""
+    def capture():
+        stream = io.BytesIO()
+        session.capture_still(stream, format="jpeg")
+        return stream.getvalue()
+    return capture
+
+
+if __name__ == '__main__':
+    # Scheduling check without a camera: python3 timelapse.py [interval] [frames]
+    import sys
+    import tempfile
+    from broadcaster import FakeCameraSource
+    interval = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    source = FakeCameraSource(fps=1000, frame_size=200 * 1024)
+    source.start()
+    with tempfile.TemporaryDirectory() as folder:
+        print(TimelapseEngine(source.read, folder, interval, max_frames=frames).run())
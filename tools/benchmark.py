@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the capture, streaming and gallery hot paths.
+
+By default every HTTP benchmark starts its own server.py on a free port with
+the simulated camera and LEDs and a synthetic media tree in a temporary
+directory, so it runs on any Linux box as well as on the Pi. --url points
+the stream and download benchmarks at a server that is already running.
+Results are printed (or written with --out) as JSON so runs on the Pi Zero
+can be compared across versions.
+
+    python3 tools/benchmark.py --clients 1,4,16 --out bench.json
+    python3 tools/benchmark.py --only index --tree-sizes 100,10000,100000
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+BENCHMARKS = ['stream', 'download', 'index', 'timelapse']
+KINDS = ['photos', 'videos', 'timelapses']
+
+
+def percentiles(values, scale=1000.0):
+    """min/mean/p50/p95/max of `values` (seconds), in milliseconds by default."""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "n": len(ordered),
+        "min": round(ordered[0] * scale, 2),
+        "mean": round(statistics.fmean(ordered) * scale, 2),
+        "p50": round(pick(0.5) * scale, 2),
+        "p95": round(pick(0.95) * scale, 2),
+        "max": round(ordered[-1] * scale, 2),
+    }
+
+
+# Synthetic media trees
+
+def make_tree(base_dir, n_files, photo_size=4096, video_size=1 << 20, frames_per_timelapse=10):
+    """Fill base_dir with about n_files media files (80% photos, 10% videos,
+    10% timelapse frames) plus up to date thumbnails, like a well used card."""
+    from hal import synthetic_jpeg
+    from media_index import thumbnail_path
+    thumb = synthetic_jpeg((128, 96))
+    photo = synthetic_jpeg((64, 48)).ljust(photo_size, b"\0")
+    for kind in KINDS + ['thumbnails']:
+        os.makedirs(os.path.join(base_dir, kind), exist_ok=True)
+    n_videos = max(1, n_files // 10)
+    n_timelapses = max(1, n_files // 10 // frames_per_timelapse)
+    n_photos = max(1, n_files - n_videos - n_timelapses * frames_per_timelapse)
+    items = []
+    for i in range(n_photos):
+        name = f"photo_{i:06d}.jpg"
+        _write(os.path.join(base_dir, 'photos', name), photo)
+        items.append(('photos', name))
+    # Videos are sparse files: the size is realistic without writing the bytes
+    for i in range(n_videos):
+        name = f"video_{i:06d}.mp4"
+        with open(os.path.join(base_dir, 'videos', name), 'wb') as f:
+            f.truncate(video_size)
+        items.append(('videos', name))
+    for i in range(n_timelapses):
+        name = f"timelapse_{i:06d}"
+        os.makedirs(os.path.join(base_dir, 'timelapses', name), exist_ok=True)
+        for j in range(frames_per_timelapse):
+            _write(os.path.join(base_dir, 'timelapses', name, f"image_{j:04d}.jpg"), photo)
+        items.append(('timelapses', name))
+    # Thumbnails last, so they are newer than their sources and count as fresh
+    for kind, name in items:
+        path = os.path.join(base_dir, thumbnail_path(kind, name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write(path, thumb)
+    return {"photos": n_photos, "videos": n_videos, "timelapses": n_timelapses,
+            "files": n_photos + n_videos + n_timelapses * frames_per_timelapse}
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+# Server under test
+
+class LocalServer:
+    """server.py (or async_server.py) in a subprocess with simulated hardware and its own base dir."""
+
+    def __init__(self, base_dir, env=None, script='server.py'):
+        self.base_dir = base_dir
+        self.script = script
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ, ACTIONPI_CAMERA='sim', ACTIONPI_LEDS='sim',
+                        ACTIONPI_BASE_DIR=base_dir, ACTIONPI_PORT=str(self.port))
+        self.env.update(env or {})
+        self.process = None
+        self.startup_s = None
+
+    def __enter__(self):
+        t0 = time.monotonic()
+        self.process = subprocess.Popen([sys.executable, self.script], cwd=ROOT, env=self.env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.script} exited with {self.process.returncode}")
+            try:
+                request(self.url, '/disk_usage', timeout=1)
+                break
+            except OSError:
+                if time.monotonic() - t0 > 600:
+                    raise
+                time.sleep(0.1)
+        self.startup_s = time.monotonic() - t0
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def connect(url, timeout=30):
+    parts = urllib.parse.urlsplit(url)
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+
+
+def request(url, path, timeout=30):
+    """GET path; returns (status, time to first byte, total time, bytes)."""
+    conn = connect(url, timeout)
+    try:
+        t0 = time.monotonic()
+        conn.request('GET', path)
+        response = conn.getresponse()
+        first = response.read(1)
+        ttfb = time.monotonic() - t0
+        size = len(first)
+        while True:
+            chunk = response.read(256 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+        return response.status, ttfb, time.monotonic() - t0, size
+    finally:
+        conn.close()
+
+
+# Benchmarks
+
+def bench_stream(url, clients, seconds, mode='software'):
+    """Frames/s and capture-to-client latency with `clients` concurrent /stream readers.
+
+    Latency compares the part's X-Timestamp with this machine's clock, so it
+    is only meaningful against a local server or with synchronized clocks.
+    """
+    per_client = []
+    latencies = []
+    lock = threading.Lock()
+
+    def client():
+        conn = connect(url)
+        conn.request('GET', f'/stream?mode={mode}')
+        response = conn.getresponse()
+        frames, gaps, lat = 0, [], []
+        t0 = last = time.monotonic()
+        try:
+            while time.monotonic() - t0 < seconds:
+                headers = {}
+                line = response.readline()
+                if not line:
+                    break
+                if not line.startswith(b'--'):
+                    continue
+                while True:
+                    line = response.readline().strip()
+                    if not line:
+                        break
+                    key, _, value = line.partition(b':')
+                    headers[key.strip().lower()] = value.strip()
+                response.read(int(headers[b'content-length']))
+                now = time.monotonic()
+                if b'x-timestamp' in headers:
+                    lat.append(time.time() - float(headers[b'x-timestamp']))
+                if frames:
+                    gaps.append(now - last)
+                last = now
+                frames += 1
+        finally:
+            conn.close()
+        with lock:
+            per_client.append({"frames": frames, "fps": frames / seconds, "gaps": gaps})
+            latencies.extend(lat)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    fps = [c["fps"] for c in per_client]
+    return {
+        "clients": clients,
+        "mode": mode,
+        "seconds": seconds,
+        "fps_per_client": {"min": round(min(fps), 2), "mean": round(statistics.fmean(fps), 2),
+                           "max": round(max(fps), 2)} if fps else None,
+        "frame_interval_ms": percentiles([g for c in per_client for g in c["gaps"]]),
+        "latency_ms": percentiles(latencies),
+    }
+
+
+def bench_download(url, repeat=3):
+    """Time to first byte and throughput of the newest video and of a streamed zip."""
+    conn = connect(url)
+    try:
+        conn.request('GET', '/api/media?kind=videos&limit=1')
+        items = json.loads(conn.getresponse().read())["items"]
+    finally:
+        conn.close()
+    results = []
+    targets = [('/download_all/photos', 'zip')]
+    if items:
+        targets.insert(0, ('/download/' + urllib.parse.quote(items[0]['path']), 'file'))
+    for path, kind in targets:
+        runs = [request(url, path, timeout=600) for _ in range(repeat)]
+        results.append({
+            "path": path,
+            "kind": kind,
+            "status": runs[0][0],
+            "bytes": runs[0][3],
+            "ttfb_ms": percentiles([r[1] for r in runs]),
+            "mb_per_s": round(statistics.fmean(r[3] / r[2] for r in runs) / 1e6, 2),
+        })
+    return results
+
+
+def bench_index(tree_sizes, repeat=5, script='server.py'):
+    """Render time of / for synthetic trees of each size, cold (first request) and warm."""
+    results = []
+    for n_files in tree_sizes:
+        base_dir = tempfile.mkdtemp(prefix=f"actionpi-bench-{n_files}-")
+        try:
+            t0 = time.monotonic()
+            tree = make_tree(base_dir, n_files)
+            build_s = time.monotonic() - t0
+            with LocalServer(base_dir, script=script) as server:
+                cold = request(server.url, '/')
+                warm = [request(server.url, '/') for _ in range(repeat)]
+                page = request(server.url, '/api/media?kind=photos&offset=0&limit=50')
+            results.append({
+                "files": tree["files"],
+                "tree": tree,
+                "tree_build_s": round(build_s, 2),
+                "server_startup_s": round(server.startup_s, 2),
+                "cold_ms": round(cold[2] * 1000, 2),
+                "warm_ms": percentiles([r[2] for r in warm]),
+                "html_bytes": warm[0][3],
+                "api_page_ms": round(page[2] * 1000, 2),
+            })
+        finally:
+            shutil.rmtree(base_dir, ignore_errors=True)
+    return results
+
+
+def bench_timelapse(frames, interval, sensor_size=(2028, 1520), frame_latency=0.03):
+    """Timing jitter of a timelapse from the simulated camera."""
+    from camera_session import CameraSession
+    from hal import SimulatedCamera
+    from timelapse import TimelapseEngine, session_capture
+    folder = tempfile.mkdtemp(prefix="actionpi-bench-timelapse-")
+    try:
+        session = CameraSession(SimulatedCamera(sensor_size, frame_latency, configure_latency=0))
+        engine = TimelapseEngine(session_capture(session), folder, interval, max_frames=frames)
+        summary = engine.run()
+        return dict(summary, interval=interval, lateness_ms=percentiles(engine.lateness))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', help="benchmark a running server instead of starting one")
+    parser.add_argument('--server', default='flask', choices=['flask', 'async'],
+                        help="server.py or the asyncio async_server.py")
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help="comma separated subset of " + ','.join(BENCHMARKS))
+    parser.add_argument('--clients', default='1,4,16', help="concurrent /stream clients per run")
+    parser.add_argument('--seconds', type=float, default=5, help="duration of each stream run")
+    parser.add_argument('--stream-mode', default='software', choices=['software', 'mjpeg'])
+    parser.add_argument('--tree-sizes', default='100,10000,100000', help="media tree sizes for the / benchmark")
+    parser.add_argument('--timelapse-frames', type=int, default=50)
+    parser.add_argument('--timelapse-interval', type=float, default=0.2)
+    parser.add_argument('--out', help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    only = args.only.split(',')
+    script = 'async_server.py' if args.server == 'async' else 'server.py'
+
+    report = {
+        "version": version(),
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "python": platform.python_version(),
+        "started": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "params": vars(args),
+        "results": {},
+    }
+    results = report["results"]
+
+    if 'stream' in only or 'download' in only:
+        base_dir = None
+        server = None
+        if args.url:
+            url = args.url
+        else:
+            base_dir = tempfile.mkdtemp(prefix="actionpi-bench-")
+            make_tree(base_dir, 100, video_size=64 << 20)
+            server = LocalServer(base_dir, script=script).__enter__()
+            url = server.url
+        try:
+            if 'stream' in only:
+                results["stream"] = [bench_stream(url, int(n), args.seconds, args.stream_mode)
+                                     for n in args.clients.split(',')]
+            if 'download' in only:
+                results["download"] = bench_download(url)
+        finally:
+            if server:
+                server.__exit__(None, None, None)
+            if base_dir:
+                shutil.rmtree(base_dir, ignore_errors=True)
+    if 'index' in only:
+        results["index"] = bench_index([int(n) for n in args.tree_sizes.split(',')], script=script)
+    if 'timelapse' in only:
+        results["timelapse"] = bench_timelapse(args.timelapse_frames, args.timelapse_interval)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
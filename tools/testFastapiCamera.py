@@ -1,31 +1,27 @@
 # -*- coding: utf-8 -*-
+import os
+import sys
+
 from fastapi import FastAPI, Response
 from fastapi.responses import StreamingResponse, FileResponse
-from picamera2 import Picamera2
 import uvicorn
-import io
 import time
 
-app = FastAPI()
-
-# Initialize the Pi camera
-picam2 = Picamera2()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from camera_session import CameraSession
+from hal import open_camera
 
-# Define separate configurations for preview and capture
-preview_config = picam2.create_preview_configuration(main={"size": (320, 240)})
-still_config = picam2.create_still_configuration()
+app = FastAPI()
 
-# Set an initial configuration; can be changed later
-picam2.configure(preview_config)
-picam2.start()
+# Initialize the Pi camera (ACTIONPI_CAMERA=sim for the simulated one); the
+# session keeps preview (lores) and still (main) streams running side by side
+# so a capture does not reconfigure the camera
+picam2 = open_camera()
+session = CameraSession(picam2)
 
 def generate_mjpeg():
-    picam2.configure(preview_config)  # Configure for preview
     while True:
-        stream = io.BytesIO()
-        picam2.capture_file(stream, format="jpeg")
-        stream.seek(0)
-        frame = stream.read()
+        frame = session.preview_jpeg()
 
         boundary = "--frameboundary"
         yield (b"--%b\r\n" b"Content-Type: image/jpeg\r\n\r\n" % boundary.encode() + frame + b"\r\n")
@@ -37,10 +33,12 @@ def video_feed():
 
 @app.get("/capture/")
 def capture_picture():
-    picam2.configure(still_config)  # Configure for high-res capture
-    picam2.capture_file("/tmp/high_res.jpg")
-    picam2.configure(preview_config)  # Reconfigure back to preview if needed
+    session.capture_still("/tmp/high_res.jpg", full_resolution=True)
     return FileResponse("/tmp/high_res.jpg", media_type="image/jpeg")
 
+@app.get("/session")
+def session_stats():
+    return session.stats()
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
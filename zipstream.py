@@ -0,0 +1,75 @@
+import os
+import zipfile
+
+# Already-compressed media gains nothing from deflate, it only costs CPU
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.mp4', '.h264', '.mjpeg', '.zip')
+CHUNK_SIZE = 64 * 1024
+
+
+class _Sink:
+    """Write-only, unseekable file object that collects what ZipFile writes.
+
+    Being unseekable makes ZipFile put CRC and sizes in data descriptors after
+    each member instead of seeking back, so the archive can be sent as it is
+    built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._written = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks = self._chunks
+        self._chunks = []
+        return chunks
+
+
+def walk_files(root):
+    """(path, arcname) for every file below root, arcnames relative to root."""
+    for foldername, subfolders, filenames in os.walk(root):
+        subfolders.sort()
+        for filename in sorted(filenames):
+            filepath = os.path.join(foldername, filename)
+            yield filepath, os.path.relpath(filepath, root)
+
+
+def zip_chunks(files, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of (path, arcname) pairs chunk by chunk.
+
+    Nothing is written to disk and at most one chunk of file data is held in
+    memory at a time.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zipf:
+        for filepath, arcname in files:
+            try:
+                st = os.stat(filepath)
+            except FileNotFoundError:
+                continue  # deleted while we were streaming
+            info = zipfile.ZipInfo.from_file(filepath, arcname)
+            if arcname.lower().endswith(STORED_EXTENSIONS):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with open(filepath, 'rb') as src, \
+                    zipf.open(info, 'w', force_zip64=st.st_size >= zipfile.ZIP64_LIMIT) as dst:
+                while True:
+                    data = src.read(chunk_size)
+                    if not data:
+                        break
+                    dst.write(data)
+                    yield from sink.drain()
+            yield from sink.drain()
+    # Central directory
+    yield from sink.drain()